@@ -17,7 +17,7 @@ from app.apps.chat.schemas import (
     GenerateTextResponse,
 )
 from app.apps.rag.services.embedding_service import EmbeddingService
-from app.apps.rag.utils.vector_store import CloudVectorStore
+from app.apps.rag.utils.collection_manager import CollectionManager
 import os
 from dotenv import load_dotenv
 import asyncio
@@ -53,8 +53,8 @@ def get_embedding_service(request: Request) -> EmbeddingService:
     return request.app.state.embedding_service
 
 
-def get_vector_store(request: Request) -> CloudVectorStore:
-    return request.app.state.vector_store
+def get_vector_stores(request: Request) -> CollectionManager:
+    return request.app.state.vector_stores
 
 
 router = APIRouter()
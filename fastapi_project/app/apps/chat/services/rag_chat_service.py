@@ -1,5 +1,7 @@
 from typing import AsyncGenerator, List, Optional, Dict, Any
 import logging
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
 from app.apps.rag.services.embedding_service import EmbeddingService
 from app.apps.rag.utils.vector_store import CloudVectorStore
 from app.apps.chat.services.gemini_service import GeminiChatService
@@ -14,12 +16,28 @@ async def get_rag_streaming_response(
     chat_service: GeminiChatService,
     history: Optional[List[Dict[str, Any]]] = None,
     top_k: int = 3,
+    mmr_lambda: Optional[float] = 0.7,
+    duplicate_threshold: Optional[float] = 0.95,
 ) -> AsyncGenerator[str, None]:
-    """Generate RAG-enhanced streaming response for customer support."""
+    """Generate RAG-enhanced streaming response for customer support.
+
+    Overlapping chunks are diversified with MMR (mmr_lambda) and near
+    duplicates dropped (duplicate_threshold) before they reach the prompt;
+    pass None to disable either.
+    """
     try:
-        # 1. Retrieve relevant documents
-        query_embedding = embedding_service.get_embeddings(query)
-        search_results = vector_store.search(query_embedding, top_k)
+        # 1. Retrieve relevant documents (off the event loop, so other
+        # streams keep flowing while this query is encoded and scored)
+        query_embedding = await embedding_service.aget_embeddings(query, use_cache=True)
+        search_results = await run_in_threadpool(
+            _retrieve,
+            query,
+            query_embedding,
+            vector_store,
+            top_k,
+            mmr_lambda,
+            duplicate_threshold,
+        )
 
         # 2. Format retrieved documents
         context = format_context(search_results)
@@ -36,6 +54,25 @@ async def get_rag_streaming_response(
         yield f"I encountered an error while processing your request: {str(e)}"
 
 
+def _retrieve(
+    query: str,
+    query_embedding: np.ndarray,
+    vector_store: CloudVectorStore,
+    top_k: int,
+    mmr_lambda: Optional[float] = None,
+    duplicate_threshold: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    # Exact terms such as product codes and error strings rank alongside
+    # semantic matches, so a small top_k still finds them
+    return vector_store.hybrid_search(
+        query,
+        query_embedding,
+        top_k,
+        mmr_lambda=mmr_lambda,
+        duplicate_threshold=duplicate_threshold,
+    )
+
+
 def format_context(search_results: List[Dict[str, Any]]) -> str:
     """Format search results into context string."""
     context_parts = []
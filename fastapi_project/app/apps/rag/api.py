@@ -10,9 +10,10 @@ from fastapi import (
     status,
     Request,
 )
-from typing import List, Dict, Any
+from fastapi.concurrency import run_in_threadpool
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Any, Optional
 import os
-import json
 import logging
 from starlette.websockets import WebSocketState
 
@@ -21,53 +22,147 @@ from app.apps.rag.schemas import (
     QueryRequest,
     QueryResponse,
     QueryResult,
+    BatchQueryRequest,
+    BatchQueryResponse,
+    RecallReportRequest,
+    RecallReportResponse,
+    PersistenceStatsResponse,
+    EmbeddingStatsResponse,
     DocumentResponse,
     BatchUploadResponse,
     FileUploadResult,
 )
 from app.apps.rag.services.embedding_service import EmbeddingService
 from app.apps.rag.utils.vector_store import CloudVectorStore
+from app.apps.rag.utils.collection_manager import CollectionManager, CollectionNotFound
+from app.apps.rag.utils.storage import create_chunk_cache_store, create_object_store
 from app.apps.rag.services.document_service import DocumentService
 from app.apps.chat.services.rag_chat_service import get_rag_streaming_response
+from app.config import settings
 
 router = APIRouter(tags=["embeddings"])
 
-# Get environment variables for Google Cloud Storage
-BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "your-gcs-bucket-name")
-GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "your-gcs-project-id")
+# Initialize services with the configured storage backend; the app exposes
+# these same instances on app.state for the chat websocket
+object_store = create_object_store(
+    settings.STORAGE_BACKEND,
+    settings.GCS_BUCKET_NAME,
+    settings.GCP_PROJECT_ID,
+    settings.STORAGE_LOCAL_ROOT,
+)
+embedding_service = EmbeddingService(
+    max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+    max_batch_size=settings.EMBEDDING_MAX_BATCH_SIZE,
+    max_wait_ms=settings.EMBEDDING_MAX_WAIT_MS,
+    cache_max_bytes=settings.EMBEDDING_CACHE_MB * 1024 * 1024,
+    cache_ttl=settings.EMBEDDING_CACHE_TTL or None,
+    chunk_cache_store=create_chunk_cache_store(
+        settings.EMBEDDING_CHUNK_CACHE, settings.EMBEDDING_CHUNK_CACHE_DIR, object_store
+    ),
+    chunk_cache_local_dir=settings.EMBEDDING_CHUNK_CACHE_LOCAL_DIR
+    or settings.VECTOR_STORE_CACHE_DIR,
+)
+
 
-# Initialize services with GCS configuration
-embedding_service = EmbeddingService()
-vector_store = CloudVectorStore(bucket_name=BUCKET_NAME, project_id=GCP_PROJECT_ID)
-document_service = DocumentService(bucket_name=BUCKET_NAME, project_id=GCP_PROJECT_ID)
+def create_vector_store(key_prefix: str) -> CloudVectorStore:
+    return CloudVectorStore(
+        bucket_name=settings.GCS_BUCKET_NAME,
+        project_id=settings.GCP_PROJECT_ID,
+        key_prefix=key_prefix,
+        local_cache_dir=settings.VECTOR_STORE_CACHE_DIR,
+        index_type=settings.VECTOR_STORE_INDEX,
+        nprobe=settings.VECTOR_STORE_NPROBE,
+        quantization=settings.VECTOR_STORE_QUANTIZATION or None,
+        write_behind=settings.VECTOR_STORE_WRITE_BEHIND,
+        flush_max_pending=settings.VECTOR_STORE_FLUSH_MAX_PENDING,
+        flush_interval=settings.VECTOR_STORE_FLUSH_INTERVAL,
+        journal_dir=settings.VECTOR_STORE_JOURNAL_DIR,
+        object_store=object_store,
+        shared_dir=settings.VECTOR_STORE_SHARED_DIR,
+        shared_poll_interval=settings.VECTOR_STORE_SHARED_POLL_INTERVAL,
+        refresh_interval=settings.VECTOR_STORE_REFRESH_INTERVAL or None,
+        transfer_shard_size=settings.VECTOR_STORE_TRANSFER_SHARD_MB * 1024 * 1024,
+        transfer_workers=settings.VECTOR_STORE_TRANSFER_WORKERS,
+    )
+
+
+# One vector store per named collection, loaded on first use
+vector_stores = CollectionManager(
+    create_vector_store,
+    default_collection=settings.VECTOR_STORE_DEFAULT_COLLECTION,
+    memory_budget=settings.VECTOR_STORE_MEMORY_BUDGET_MB * 1024 * 1024
+    if settings.VECTOR_STORE_MEMORY_BUDGET_MB
+    else None,
+    max_collections=settings.VECTOR_STORE_MAX_COLLECTIONS or None,
+)
+document_service = DocumentService(
+    bucket_name=settings.GCS_BUCKET_NAME,
+    project_id=settings.GCP_PROJECT_ID,
+    object_store=object_store,
+)
 
 # Make sure logger is initialized at module level
 logger = logging.getLogger(__name__)
 
 
-# Load embeddings on startup
+# Load the default collection on startup; others load on first use
 @router.on_event("startup")
 async def startup_load_embeddings():
     logger.info("Attempting to load embeddings from cloud storage...")
-    loaded = vector_store.load_from_cloud()
+    with vector_stores.use() as vector_store:
+        loaded = len(vector_store.documents) > 0
     if loaded:
         logger.info("Embeddings loaded successfully.")
     else:
         logger.warning("Failed to load embeddings or no embeddings found.")
 
 
+# Flush write-behind changes before the worker exits
+@router.on_event("shutdown")
+def shutdown_flush_embeddings():
+    vector_stores.close()
+    embedding_service.close()
+
+
+def resolve_collection(collection: Optional[str]) -> str:
+    try:
+        return vector_stores.resolve(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@contextmanager
+def use_collection(name: str, create: bool = False) -> Iterator[CloudVectorStore]:
+    """Lease a collection's store; 404 for a collection with no data unless create"""
+    try:
+        with vector_stores.use(name, create) as vector_store:
+            yield vector_store
+    except CollectionNotFound:
+        raise HTTPException(status_code=404, detail=f"Collection {name} not found")
+
+
 @router.post("/embeddings/encode")
-def generate_embeddings(data: TextData):
+async def generate_embeddings(data: TextData):
     """Generate embeddings for a single text"""
-    embedding = embedding_service.get_embeddings(data.text)
+    embedding = await embedding_service.aget_embeddings(data.text)
     return {"embedding": embedding.tolist()}
 
 
+@router.get("/embeddings/encode/stats", response_model=EmbeddingStatsResponse)
+def embedding_stats():
+    """Embedding executor queue depth, batch sizes, encode latency and query cache hits"""
+    return EmbeddingStatsResponse(**embedding_service.stats())
+
+
 @router.post("/embeddings/add")
-def add_documents(data: List[TextData], background_tasks: BackgroundTasks):
+def add_documents(
+    data: List[TextData],
+    background_tasks: BackgroundTasks,
+    collection: Optional[str] = None,
+):
     """Add documents to the vector store"""
     texts = [item.text for item in data]
-    embeddings = embedding_service.get_embeddings(texts)
+    embeddings = embedding_service.get_chunk_embeddings(texts)
 
     documents = []
     for i, item in enumerate(data):
@@ -77,32 +172,123 @@ def add_documents(data: List[TextData], background_tasks: BackgroundTasks):
         documents.append(doc)
 
     # Add documents to in-memory store
-    vector_store.add_documents(documents, embeddings)
+    with use_collection(resolve_collection(collection), create=True) as vector_store:
+        vector_store.add_documents(documents, embeddings)
 
     return {"message": f"Added {len(documents)} documents to the vector store"}
 
 
 @router.post("/embeddings/search", response_model=QueryResponse)
-def search(query: QueryRequest):
+def search(query: QueryRequest, collection: Optional[str] = None):
     """Search for similar documents"""
-    query_embedding = embedding_service.get_embeddings(query.query)
-    results = vector_store.search(query_embedding, query.top_k)
+    name = resolve_collection(collection)
+    query_embedding = embedding_service.get_embeddings(query.query, use_cache=True)
+    try:
+        with use_collection(name) as vector_store:
+            if query.hybrid:
+                results = vector_store.hybrid_search(
+                    query.query,
+                    query_embedding,
+                    query.top_k,
+                    filters=query.filters,
+                    mmr_lambda=query.mmr_lambda,
+                    duplicate_threshold=query.duplicate_threshold,
+                )
+            else:
+                results = vector_store.search(
+                    query_embedding,
+                    query.top_k,
+                    filters=query.filters,
+                    mmr_lambda=query.mmr_lambda,
+                    duplicate_threshold=query.duplicate_threshold,
+                )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {str(e)}")
 
     return QueryResponse(results=results)
 
 
+@router.post("/embeddings/search/batch", response_model=BatchQueryResponse)
+def search_batch(batch: BatchQueryRequest, collection: Optional[str] = None):
+    """Search for several queries with one encode call and one scoring pass"""
+    name = resolve_collection(collection)
+    if not batch.queries:
+        return BatchQueryResponse(results=[])
+
+    query_embeddings = embedding_service.get_embeddings(
+        [query.query for query in batch.queries], use_cache=True
+    )
+    try:
+        with use_collection(name) as vector_store:
+            results = vector_store.search_batch(
+                query_embeddings,
+                [query.top_k for query in batch.queries],
+                filters=[query.filters for query in batch.queries],
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {str(e)}")
+
+    return BatchQueryResponse(
+        results=[QueryResponse(results=query_results) for query_results in results]
+    )
+
+
+@router.post("/embeddings/recall-report", response_model=RecallReportResponse)
+def recall_report(request: RecallReportRequest, collection: Optional[str] = None):
+    """Measure recall of the configured index and quantization against exact search"""
+    name = resolve_collection(collection)
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+
+    query_embeddings = embedding_service.get_embeddings(request.queries)
+    with use_collection(name) as vector_store:
+        report = vector_store.recall_report(
+            query_embeddings, request.top_k, request.nprobe
+        )
+    return RecallReportResponse(**report)
+
+
 @router.post("/embeddings/sync")
-def force_sync():
-    """Force sync of embeddings to cloud storage"""
-    success = vector_store.save_to_cloud()
+def force_sync(collection: Optional[str] = None):
+    """Write pending (journaled) changes to cloud storage now"""
+    with use_collection(resolve_collection(collection)) as vector_store:
+        success = vector_store.flush()
     if not success:
         raise HTTPException(status_code=500, detail="Failed to sync with cloud storage")
     return {"message": "Sync successful"}
 
 
+@router.post("/embeddings/compact")
+def compact(collection: Optional[str] = None):
+    """Merge a collection's segments into one and drop its deleted rows"""
+    with use_collection(resolve_collection(collection)) as vector_store:
+        success = vector_store.compact()
+    if not success:
+        raise HTTPException(status_code=500, detail="Failed to compact the collection")
+    return {"message": "Compaction successful"}
+
+
+@router.get("/embeddings/sync", response_model=PersistenceStatsResponse)
+def sync_status(collection: Optional[str] = None):
+    """Pending (not yet flushed) changes and flush latency"""
+    with use_collection(resolve_collection(collection)) as vector_store:
+        return PersistenceStatsResponse(**vector_store.persistence_stats())
+
+
+@router.get("/embeddings/collections", response_model=List[Dict[str, Any]])
+def list_collections():
+    """Loaded collections with their row counts and memory use"""
+    return vector_stores.stats()
+
+
 @router.post("/documents/upload", response_model=BatchUploadResponse)
-async def upload_documents(request: Request, files: List[UploadFile] = File(...)):
+async def upload_documents(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    collection: Optional[str] = None,
+):
     """Upload one or more document files (PDF, DOCX, TXT, etc.)"""
+    name = resolve_collection(collection)
     logger.info(f"--- Upload Request Headers ---")
     logger.info(dict(request.headers))
     logger.info(f"--- End Upload Request Headers ---")
@@ -131,32 +317,79 @@ async def upload_documents(request: Request, files: List[UploadFile] = File(...)
             # Read file content
             file_content = await file.read()
 
-            # Process the document using document_service
-            result = document_service.upload_document(file_content, filename)
+            # Parsing, encoding and storage uploads block, so they run in the
+            # threadpool instead of stalling every connection on this worker
+            result = await run_in_threadpool(
+                document_service.upload_document, file_content, filename, name
+            )
 
             # Create text embeddings for each chunk
             text_chunks = result["text_chunks"]
             metadata_list = result["metadata_list"]
 
-            # Generate embeddings
-            embeddings = embedding_service.get_embeddings(text_chunks)
+            # Chunks already in the collection (re-uploads, templated
+            # documents) are neither embedded nor stored again; the document
+            # references the stored chunk, which stays until both are deleted
+            duplicates = [None] * len(text_chunks)
+            if settings.INGEST_SKIP_DUPLICATES:
+                duplicates = await run_in_threadpool(
+                    _find_duplicates, name, text_chunks
+                )
+            skipped = {
+                i: match
+                for i, match in enumerate(duplicates)
+                if _skips_duplicate(match)
+            }
+            near_duplicates = sum(
+                1 for match in duplicates if match and match["match"] == "near"
+            )
+            references = [
+                (match["doc_id"], match["chunk_index"], i)
+                for i, match in skipped.items()
+                if match["doc_id"] is not None
+            ]
+            if references:
+                # Stored chunks deleted meanwhile are stored for this document
+                lost = await run_in_threadpool(
+                    _reference_chunks, name, result["doc_id"], references
+                )
+                for _, _, i in lost:
+                    del skipped[i]
+            new_chunks = [i for i in range(len(text_chunks)) if i not in skipped]
+
+            if new_chunks:
+                # Generate embeddings on the embedding executor; chunks
+                # embedded before (e.g. unchanged parts of a revised
+                # document) come from the chunk embedding cache
+                embeddings = await embedding_service.aget_chunk_embeddings(
+                    [text_chunks[i] for i in new_chunks]
+                )
 
-            # Prepare documents for vector store
-            documents_to_add = []
-            for i, chunk in enumerate(text_chunks):
-                doc = {"text": chunk, "metadata": metadata_list[i]}
-                documents_to_add.append(doc)
+                # Prepare documents for vector store
+                documents_to_add = []
+                for i in new_chunks:
+                    doc = {"text": text_chunks[i], "metadata": metadata_list[i]}
+                    documents_to_add.append(doc)
 
-            # Add to vector store
-            vector_store.add_documents(documents_to_add, embeddings)
+                # Add to vector store; searches keep using the previous snapshot
+                await run_in_threadpool(
+                    _add_to_collection, name, documents_to_add, embeddings
+                )
 
+            message = f"Processed successfully with {result['chunk_count']} chunks."
+            if skipped:
+                message += f" Reused {len(skipped)} already stored chunks."
+            if near_duplicates:
+                message += f" {near_duplicates} chunks nearly duplicate stored ones."
             results.append(
                 FileUploadResult(
                     filename=filename,
                     success=True,
-                    message=f"Processed successfully with {result['chunk_count']} chunks.",
+                    message=message,
                     doc_id=result["doc_id"],
                     chunk_count=result["chunk_count"],
+                    duplicate_chunks=len(skipped),
+                    near_duplicate_chunks=near_duplicates,
                 )
             )
             successful_uploads += 1
@@ -178,19 +411,34 @@ async def upload_documents(request: Request, files: List[UploadFile] = File(...)
     return BatchUploadResponse(results=results, overall_message=overall_message)
 
 
+def _find_duplicates(name: str, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+    with vector_stores.use(name, create=True) as vector_store:
+        return vector_store.find_duplicates(texts)
+
+
+def _skips_duplicate(match: Optional[Dict[str, Any]]) -> bool:
+    """Whether an upload leaves out a chunk matching a stored one"""
+    if match is None or (match["match"] == "near" and not settings.INGEST_SKIP_NEAR_DUPLICATES):
+        return False
+    # A stored chunk without a chunk_index can't be referenced
+    return match["doc_id"] is None or match["chunk_index"] is not None
+
+
+def _reference_chunks(name: str, doc_id: str, references) -> List[Any]:
+    with vector_stores.use(name, create=True) as vector_store:
+        return vector_store.add_references(doc_id, references)
+
+
+def _add_to_collection(name: str, documents: List[Dict[str, Any]], embeddings) -> bool:
+    with vector_stores.use(name, create=True) as vector_store:
+        return vector_store.add_documents(documents, embeddings)
+
+
 @router.get("/documents", response_model=List[Dict[str, Any]])
 async def list_documents():
     """List all uploaded documents"""
     try:
-        registry_blob = document_service.bucket.blob("documents/registry.json")
-
-        if not registry_blob.exists():
-            return []
-
-        registry_content = registry_blob.download_as_string()
-        registry = json.loads(registry_content.decode("utf-8"))
-
-        return registry["documents"]
+        return document_service.list_documents()
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error retrieving document list: {str(e)}"
@@ -201,20 +449,14 @@ async def list_documents():
 async def get_document(doc_id: str):
     """Get information about a specific document"""
     try:
-        # First check registry
-        registry_blob = document_service.bucket.blob("documents/registry.json")
-        registry_content = registry_blob.download_as_string()
-        registry = json.loads(registry_content.decode("utf-8"))
-
-        # Find the document in registry
-        doc_info = next(
-            (doc for doc in registry["documents"] if doc["doc_id"] == doc_id), None
-        )
+        doc_info = document_service.get_document(doc_id)
 
         if not doc_info:
             raise HTTPException(status_code=404, detail="Document not found")
 
         return doc_info
+    except HTTPException:
+        raise  # Re-raise HTTP exceptions
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error retrieving document: {str(e)}"
@@ -225,8 +467,12 @@ async def get_document(doc_id: str):
 async def delete_document(doc_id: str):
     """Delete a document by ID from both storage and vector store"""
     try:
+        # The registry records which collection holds the document's chunks
+        doc_info = await run_in_threadpool(document_service.get_document, doc_id)
+        collection = doc_info.get("collection") if doc_info else None
+
         # First delete from document storage
-        doc_deleted = document_service.delete_document(doc_id)
+        doc_deleted = await run_in_threadpool(document_service.delete_document, doc_id)
         if not doc_deleted:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -234,7 +480,9 @@ async def delete_document(doc_id: str):
             )
 
         # Then remove from vector store
-        vector_deleted = vector_store.delete_documents_by_id(doc_id)
+        vector_deleted = await run_in_threadpool(
+            _delete_from_collection, collection, doc_id
+        )
         if not vector_deleted:
             # This is not critical - document might not be in vector store
             # or already processed, so just log it
@@ -258,6 +506,14 @@ async def delete_document(doc_id: str):
         )
 
 
+def _delete_from_collection(name: Optional[str], doc_id: str) -> bool:
+    try:
+        with vector_stores.use(name) as vector_store:
+            return vector_store.delete_documents_by_id(doc_id)
+    except CollectionNotFound:
+        return False
+
+
 @router.websocket("/ws/rag-chat")
 async def websocket_rag_chat_endpoint(websocket: WebSocket):
     """WebSocket endpoint for RAG-enhanced customer support chat"""
@@ -271,12 +527,15 @@ async def websocket_rag_chat_endpoint(websocket: WebSocket):
         # Get services from app state
         chat_service = websocket.app.state.chat_service
         embedding_service = websocket.app.state.embedding_service
-        vector_store = websocket.app.state.vector_store
+        vector_stores = websocket.app.state.vector_stores
+        # A message may override the collection chosen when connecting
+        default_collection = websocket.query_params.get("collection")
 
         while True:
             data = await websocket.receive_json()
             message = data.get("message")
             history = data.get("history", [])
+            collection = data.get("collection") or default_collection
 
             if not isinstance(message, str):
                 await websocket.send_json(
@@ -285,16 +544,37 @@ async def websocket_rag_chat_endpoint(websocket: WebSocket):
                 continue
 
             try:
-                # Use the RAG chat service to generate responses
-                async for chunk in get_rag_streaming_response(
-                    query=message,
-                    embedding_service=embedding_service,
-                    vector_store=vector_store,
-                    chat_service=chat_service,
-                    history=history,
-                ):
-                    await websocket.send_json({"chunk": chunk, "done": False})
+                collection = vector_stores.resolve(collection)
+            except ValueError as e:
+                await websocket.send_json(
+                    {"error": str(e), "code": "invalid_collection"}
+                )
+                continue
+
+            try:
+                vector_store = await run_in_threadpool(
+                    vector_stores.acquire, collection
+                )
+                try:
+                    # Use the RAG chat service to generate responses
+                    async for chunk in get_rag_streaming_response(
+                        query=message,
+                        embedding_service=embedding_service,
+                        vector_store=vector_store,
+                        chat_service=chat_service,
+                        history=history,
+                    ):
+                        await websocket.send_json({"chunk": chunk, "done": False})
+                finally:
+                    await run_in_threadpool(vector_stores.release, collection)
                 await websocket.send_json({"chunk": "", "done": True})
+            except CollectionNotFound:
+                await websocket.send_json(
+                    {
+                        "error": f"Collection {collection} not found",
+                        "code": "unknown_collection",
+                    }
+                )
             except Exception as e:
                 logger.error(f"RAG streaming error: {str(e)}")
                 await websocket.send_json({"error": str(e), "code": "stream_error"})
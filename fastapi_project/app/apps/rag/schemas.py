@@ -20,23 +20,130 @@ class DocumentResponse(BaseModel):
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 5
+    # Metadata conditions, e.g. {"file_type": "pdf", "doc_id": ["a", "b"],
+    # "upload_time": {"gte": "2025-01-01T00:00:00"}}
+    filters: Optional[Dict[str, Any]] = None
+    # Fuse BM25 keyword matches with the dense ranking
+    hybrid: bool = False
+    # Maximal marginal relevance trade-off (1.0 = relevance only) and the
+    # similarity at which a chunk counts as a duplicate of a better one
+    mmr_lambda: Optional[float] = None
+    duplicate_threshold: Optional[float] = None
 
 
 class QueryResult(BaseModel):
     document: Dict[str, Any]
     score: float
+    # Component scores of hybrid searches
+    dense_score: Optional[float] = None
+    lexical_score: Optional[float] = None
 
 
 class QueryResponse(BaseModel):
     results: List[QueryResult]
 
 
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
+
+
+class RecallReportRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 10
+    nprobe: Optional[int] = None
+
+
+class RecallReportResponse(BaseModel):
+    queries: int
+    top_k: int
+    rows: int
+    index_type: str
+    nprobe: Optional[int] = None
+    quantization: Optional[str] = None
+    rerank_factor: Optional[int] = None
+    recall: float
+    approximate_ms_per_query: float
+    exact_ms_per_query: float
+    bytes_per_vector: int
+    quantized_bytes_per_vector: Optional[int] = None
+    compression_ratio: Optional[float] = None
+
+
+class PersistenceStatsResponse(BaseModel):
+    write_behind: bool
+    pending_changes: int
+    pending_rows: int
+    pending_deletes: int
+    oldest_pending_seconds: Optional[float] = None
+    flush_count: int
+    failed_flushes: int
+    last_flush_ms: Optional[float] = None
+    last_flush_at: Optional[float] = None
+    manifest_generation: Optional[int] = None
+    shared_generation: Optional[int] = None
+    manifest_conflicts: int = 0
+    remote_refreshes: int = 0
+
+
+class EmbeddingCacheStats(BaseModel):
+    entries: int
+    bytes: int
+    max_bytes: int
+    ttl_seconds: Optional[float] = None
+    hits: int
+    misses: int
+    hit_rate: Optional[float] = None
+    evictions: int
+    expirations: int
+
+
+class ChunkEmbeddingCacheStats(BaseModel):
+    entries: int
+    files: int
+    hits: int
+    misses: int
+    hit_rate: Optional[float] = None
+    appended: int
+    refreshes: int
+
+
+class EmbeddingStatsResponse(BaseModel):
+    max_concurrency: int
+    max_batch_size: int
+    max_wait_ms: float
+    # Encode calls waiting for the executor, now and at most so far
+    queue_depth: int
+    running: int
+    max_queue_depth: int
+    completed: int
+    failed: int
+    # Encode calls made for batches of concurrent calls, and their sizes:
+    # power-of-two upper bound -> batches of (bound / 2, bound] texts
+    batches: int
+    avg_batch_size: Optional[float] = None
+    batch_size_histogram: Dict[str, int] = {}
+    avg_wait_ms: Optional[float] = None
+    avg_encode_ms: Optional[float] = None
+    # Query embedding cache (None when disabled)
+    cache: Optional[EmbeddingCacheStats] = None
+    # Persistent chunk embedding cache used by ingestion (None when disabled)
+    chunk_cache: Optional[ChunkEmbeddingCacheStats] = None
+
+
 class FileUploadResult(BaseModel):
     filename: str
     success: bool
     message: str
     doc_id: Optional[str] = None
     chunk_count: Optional[int] = None
+    # Chunks not stored again as exact duplicates of stored chunks, and
+    # chunks that nearly duplicate stored ones (stored unless configured)
+    duplicate_chunks: Optional[int] = None
+    near_duplicate_chunks: Optional[int] = None
 
 
 class BatchUploadResponse(BaseModel):
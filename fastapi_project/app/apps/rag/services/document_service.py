@@ -1,26 +1,53 @@
 # app/apps/rag/services/document_service.py
-from google.cloud import storage
+import copy
 import uuid
 import json
-from typing import Dict, List, Any, BinaryIO, Tuple
+import threading
+from typing import Dict, List, Any, BinaryIO, Callable, Optional, Tuple
 import os
 from datetime import datetime
 from ..utils.document_parser import DocumentParser
+from ..utils.storage import (
+    GCSObjectStore,
+    ObjectNotFound,
+    ObjectStore,
+    PreconditionFailed,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+REGISTRY_KEY = "documents/registry.json"
+# Conditional registry writes retried after a concurrent change
+REGISTRY_WRITE_ATTEMPTS = 5
+
 
 class DocumentService:
-    def __init__(self, bucket_name: str, project_id: str):
+    def __init__(
+        self,
+        bucket_name: str,
+        project_id: str,
+        object_store: Optional[ObjectStore] = None,
+    ):
         self.bucket_name = bucket_name
         self.project_id = project_id
-        self.storage_client = storage.Client(project=project_id)
-        self.bucket = self.storage_client.bucket(bucket_name)
+        self.object_store = object_store or GCSObjectStore(bucket_name, project_id)
         self.document_parser = DocumentParser()
 
-    def upload_document(self, file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Upload a document to GCS and process it for RAG"""
+        # Parsed registry cached by blob generation, with doc_id -> position;
+        # the three are replaced together so readers never see them mixed
+        self._registry: Optional[Tuple[Dict[str, Any], int, Dict[str, int]]] = None
+        # Serializes the registry changes of concurrent uploads and deletes
+        self._registry_lock = threading.Lock()
+
+    def upload_document(
+        self, file_content: bytes, filename: str, collection: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Upload a document to GCS and process it for RAG.
+
+        collection names the vector store collection the chunks go to; it is
+        recorded in the registry so deletes reach the same collection.
+        """
         # Generate a unique ID for the document
         doc_id = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
@@ -36,14 +63,11 @@ class DocumentService:
             "content_type": self._get_content_type(file_ext),
         }
 
-        # Get blob and set metadata BEFORE uploading
-        blob = self.bucket.blob(gcs_path)
-        blob.metadata = metadata  # Set metadata as an attribute
-
-        # Upload the content (without metadata parameter)
-        blob.upload_from_string(
+        self.object_store.put(
+            gcs_path,
             file_content,
             content_type=self._get_content_type(file_ext),
+            metadata=metadata,
         )
 
         # 2. Process the document
@@ -65,7 +89,9 @@ class DocumentService:
                 )
 
             # 4. Update document registry
-            self._update_document_registry(doc_id, filename, gcs_path, metadata)
+            self._update_document_registry(
+                doc_id, filename, gcs_path, metadata, collection
+            )
 
             return {
                 "doc_id": doc_id,
@@ -78,84 +104,143 @@ class DocumentService:
 
         except Exception as e:
             # Delete uploaded file if processing fails
-            blob.delete()
+            self.object_store.delete(gcs_path)
             raise e
 
     def delete_document(self, doc_id: str) -> bool:
         """Delete a document from GCS by its ID and update the registry"""
         try:
-            # Get the document info from registry
-            registry_blob = self.bucket.blob("documents/registry.json")
-
-            if not registry_blob.exists():
+            if self._load_registry() is None:
                 logger.warning(f"Registry not found while deleting document {doc_id}")
                 return False
 
-            registry_content = registry_blob.download_as_string()
-            registry = json.loads(registry_content.decode("utf-8"))
+            def remove(
+                registry: Dict[str, Any], positions: Dict[str, int]
+            ) -> Optional[Dict[str, Any]]:
+                doc_index = positions.get(doc_id)
+                if doc_index is None:
+                    return None
+                return registry["documents"].pop(doc_index)
 
-            # Find the document in registry
-            doc_index = None
-            doc_info = None
-            for i, doc in enumerate(registry["documents"]):
-                if doc["doc_id"] == doc_id:
-                    doc_index = i
-                    doc_info = doc
-                    break
-
-            if doc_index is None:
+            # Update registry
+            doc_info = self._change_registry(remove)
+            if doc_info is None:
                 logger.warning(f"Document {doc_id} not found in registry")
                 return False  # Document not found
+            logger.info(f"Document {doc_id} removed from registry")
 
-            # Delete the original file from GCS
+            # Delete the original file from GCS, once nothing refers to it
             gcs_path = doc_info["gcs_path"]
-            blob = self.bucket.blob(gcs_path)
-            if blob.exists():
-                blob.delete()
+            if self.object_store.delete(gcs_path):
                 logger.info(f"Deleted document file: {gcs_path}")
 
-            # Update registry
-            registry["documents"].pop(doc_index)
-            registry_blob.upload_from_string(
-                json.dumps(registry, indent=2),
-                content_type="application/json",
-            )
-            logger.info(f"Document {doc_id} removed from registry")
-
             return True
         except Exception as e:
             logger.error(f"Error deleting document {doc_id}: {e}")
             return False
 
+    def list_documents(self) -> List[Dict[str, Any]]:
+        """All documents in the registry"""
+        cached = self._load_registry()
+        return cached[0]["documents"] if cached else []
+
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Registry entry for a document, or None if it is not registered"""
+        cached = self._load_registry()
+        if cached is None:
+            return None
+        registry, _, positions = cached
+        doc_index = positions.get(doc_id)
+        return registry["documents"][doc_index] if doc_index is not None else None
+
     def _update_document_registry(
-        self, doc_id: str, filename: str, gcs_path: str, metadata: Dict[str, Any]
+        self,
+        doc_id: str,
+        filename: str,
+        gcs_path: str,
+        metadata: Dict[str, Any],
+        collection: Optional[str] = None,
     ) -> None:
         """Update the document registry with new document information"""
-        registry_blob = self.bucket.blob("documents/registry.json")
-
-        # Get existing registry or create new one
-        if registry_blob.exists():
-            registry_content = registry_blob.download_as_string()
-            registry = json.loads(registry_content.decode("utf-8"))
-        else:
-            registry = {"documents": []}
+        entry = {
+            "doc_id": doc_id,
+            "filename": filename,
+            "gcs_path": gcs_path,
+            "upload_time": metadata["upload_time"],
+            "file_type": os.path.splitext(filename)[1][1:],
+        }
+        if collection is not None:
+            entry["collection"] = collection
 
         # Add new document to registry
-        registry["documents"].append(
-            {
-                "doc_id": doc_id,
-                "filename": filename,
-                "gcs_path": gcs_path,
-                "upload_time": metadata["upload_time"],
-                "file_type": os.path.splitext(filename)[1][1:],
-            }
+        self._change_registry(
+            lambda registry, positions: registry["documents"].append(entry)
         )
 
-        # Save updated registry (without metadata parameter)
-        registry_blob.upload_from_string(
-            json.dumps(registry, indent=2),
-            content_type="application/json",
-        )
+    def _load_registry(self) -> Optional[Tuple[Dict[str, Any], int, Dict[str, int]]]:
+        """Cached (registry, generation, positions), re-read when the generation changes"""
+        generation = self.object_store.generation(REGISTRY_KEY)
+        if generation is None:
+            return None
+
+        cached = self._registry
+        if cached is None or generation != cached[1]:
+            try:
+                registry_content = self.object_store.get(REGISTRY_KEY)
+            except ObjectNotFound:
+                return None
+            # Read after the generation, so at worst the contents are newer and
+            # a conditional write against the generation fails and is retried
+            cached = self._set_registry(
+                json.loads(registry_content.decode("utf-8")), generation
+            )
+        return cached
+
+    def _change_registry(
+        self, change: Callable[[Dict[str, Any], Dict[str, int]], Any]
+    ) -> Any:
+        """Upload the registry with change applied; returns the change's result.
+
+        change gets a copy of the registry and the doc_id -> position map of
+        the registry it was copied from.
+
+        The upload is conditional on the generation the copy was made from, so
+        a write by another instance in between is re-read and the change applied
+        again on top. The cache only takes the copy once the upload succeeded.
+        """
+        with self._registry_lock:
+            for _ in range(REGISTRY_WRITE_ATTEMPTS):
+                cached = self._load_registry()
+                if cached is None:
+                    registry, generation, positions = {"documents": []}, 0, {}
+                else:
+                    registry, generation, positions = (
+                        copy.deepcopy(cached[0]),
+                        cached[1],
+                        cached[2],
+                    )
+                result = change(registry, positions)
+                try:
+                    generation = self.object_store.put(
+                        REGISTRY_KEY,
+                        json.dumps(registry, indent=2).encode("utf-8"),
+                        content_type="application/json",
+                        # 0: only if no registry exists yet
+                        if_generation_match=generation,
+                    )
+                except PreconditionFailed:
+                    logger.info("Document registry was changed by another instance; retrying")
+                    continue
+                self._set_registry(registry, generation)
+                return result
+            raise PreconditionFailed(REGISTRY_KEY)
+
+    def _set_registry(
+        self, registry: Dict[str, Any], generation: int
+    ) -> Tuple[Dict[str, Any], int, Dict[str, int]]:
+        positions = {doc["doc_id"]: i for i, doc in enumerate(registry["documents"])}
+        self._registry = (registry, generation, positions)
+        return self._registry
 
     def _get_content_type(self, file_ext: str) -> str:
         """Get the appropriate content type for a file extension"""
@@ -1,11 +1,19 @@
 from sentence_transformers import SentenceTransformer
-from typing import List, Union, Optional
+from typing import Any, Dict, List, Union, Optional, Tuple
 import numpy as np
+import asyncio
 import os
+import unicodedata
+from concurrent.futures import Future
 from huggingface_hub import login
 import logging
 from dotenv import load_dotenv
 
+from app.apps.rag.utils.chunk_embedding_cache import ChunkEmbeddingCache
+from app.apps.rag.utils.embedding_cache import EmbeddingCache
+from app.apps.rag.utils.micro_batcher import MicroBatcher
+from app.apps.rag.utils.storage import ObjectStore
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -17,6 +25,14 @@ class EmbeddingService:
         model_name: str = "all-MiniLM-L6-v2",
         hf_token: Optional[str] = None,
         use_auth: bool = True,
+        max_concurrency: int = 2,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        cache_max_bytes: int = 64 * 1024 * 1024,
+        cache_ttl: Optional[float] = None,
+        chunk_cache_store: Optional[ObjectStore] = None,
+        chunk_cache_prefix: str = "embedding-cache/",
+        chunk_cache_local_dir: Optional[str] = None,
     ):
         """
         Initialize the embedding service with a sentence transformer model
@@ -25,6 +41,18 @@ class EmbeddingService:
             model_name: Name of the model or path to local model
             hf_token: Hugging Face API token (will use HF_TOKEN env var if not provided)
             use_auth: Whether to try authentication with Hugging Face
+            max_concurrency: Most encode calls running at once; further calls
+                queue for the dedicated executor
+            max_batch_size: Most texts encoded together when concurrent calls
+                are batched into one encode
+            max_wait_ms: How long a call waits for others to join its batch
+            cache_max_bytes: Memory for cached query embeddings (0 disables the cache)
+            cache_ttl: Seconds a cached query embedding stays valid (None: until evicted)
+            chunk_cache_store: Storage for the persistent chunk embedding cache
+                used by get_chunk_embeddings (disabled if None)
+            chunk_cache_prefix: Key prefix of the chunk embedding cache
+            chunk_cache_local_dir: Local disk directory for copies of chunk
+                cache files when the storage has no local files of its own
         """
         # Try authentication if requested
         if use_auth:
@@ -33,6 +61,7 @@ class EmbeddingService:
         try:
             # First try loading the model directly
             self.model = SentenceTransformer(model_name)
+            self.model_name = model_name
             logger.info(f"Successfully loaded model: {model_name}")
         except Exception as e:
             logger.warning(f"Error loading model {model_name}: {e}")
@@ -47,6 +76,7 @@ class EmbeddingService:
                 try:
                     logger.info(f"Trying fallback model: {fallback}")
                     self.model = SentenceTransformer(fallback)
+                    self.model_name = fallback
                     logger.info(f"Successfully loaded fallback model: {fallback}")
                     break
                 except Exception as fallback_e:
@@ -59,6 +89,41 @@ class EmbeddingService:
                     "Failed to load any embedding model. Check your internet connection and HF token."
                 )
 
+        # Every encode runs on the batcher's own executor, so inference never
+        # blocks an event loop and the model is never asked for more than
+        # max_concurrency encodes at once, whoever the callers are.
+        # Concurrent calls (e.g. single chat queries) are encoded together.
+        self._batcher = MicroBatcher(
+            self._encode,
+            max_batch_size=max_batch_size,
+            max_wait=max_wait_ms / 1000,
+            max_concurrency=max_concurrency,
+            name="embedding",
+        )
+
+        # Query embeddings by normalized text, for the repeated questions of
+        # support traffic; callers opt in with use_cache=True
+        self._cache = (
+            EmbeddingCache(cache_max_bytes, cache_ttl) if cache_max_bytes > 0 else None
+        )
+        # Uncased models embed "Refund status" and "refund status" alike
+        self._case_insensitive = bool(
+            getattr(getattr(self.model, "tokenizer", None), "do_lower_case", False)
+        )
+        # Document chunk embeddings by normalized text hash, kept in storage
+        # across restarts, so re-ingested chunks are not encoded again
+        self._chunk_cache = (
+            ChunkEmbeddingCache(
+                chunk_cache_store,
+                self.model_name,
+                chunk_cache_prefix,
+                local_cache_dir=chunk_cache_local_dir,
+                normalize=self._normalize,
+            )
+            if chunk_cache_store is not None
+            else None
+        )
+
     def _authenticate(self, token: Optional[str] = None):
         """Authenticate with Hugging Face"""
         hf_token = token or os.environ.get("HF_TOKEN")
@@ -73,6 +138,146 @@ class EmbeddingService:
                 "No Hugging Face token provided, some models might not be accessible"
             )
 
-    def get_embeddings(self, texts: Union[str, List[str]]) -> np.ndarray:
-        """Generate embeddings for a text or list of texts"""
+    def get_embeddings(
+        self, texts: Union[str, List[str]], use_cache: bool = False
+    ) -> np.ndarray:
+        """Generate embeddings for a text or list of texts, blocking the calling thread.
+
+        With use_cache, texts seen before (e.g. repeated queries) are served
+        from the query embedding cache and only the others are encoded.
+        """
+        items, keys, found, missing = self._lookup(texts, use_cache)
+        encoded = self._submit(items, missing).result() if missing is not None else None
+        return self._result(texts, self._merge(keys, found, missing, encoded))
+
+    async def aget_embeddings(
+        self, texts: Union[str, List[str]], use_cache: bool = False
+    ) -> np.ndarray:
+        """Generate embeddings without blocking the event loop"""
+        items, keys, found, missing = self._lookup(texts, use_cache)
+        encoded = (
+            await asyncio.wrap_future(self._submit(items, missing))
+            if missing is not None
+            else None
+        )
+        return self._result(texts, self._merge(keys, found, missing, encoded))
+
+    def get_chunk_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Embeddings of document chunks, encoding only those not in the chunk cache"""
+        texts = list(texts)
+        found = self._chunk_cache.lookup(texts) if self._chunk_cache is not None else None
+        missing = self._chunk_misses(texts, found)
+        encoded = self._submit(texts, missing).result() if missing else None
+        if missing and found is not None:
+            self._append_chunks(texts, missing, encoded)
+        return self._merge_chunks(texts, found, missing, encoded)
+
+    async def aget_chunk_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Embeddings of document chunks without blocking the event loop"""
+        texts = list(texts)
+        found = (
+            await asyncio.to_thread(self._chunk_cache.lookup, texts)
+            if self._chunk_cache is not None
+            else None
+        )
+        missing = self._chunk_misses(texts, found)
+        encoded = (
+            await asyncio.wrap_future(self._submit(texts, missing)) if missing else None
+        )
+        if missing and found is not None:
+            await asyncio.to_thread(self._append_chunks, texts, missing, encoded)
+        return self._merge_chunks(texts, found, missing, encoded)
+
+    def stats(self) -> Dict[str, Any]:
+        """Executor queue depth, batch sizes and encode timings"""
+        stats = self._batcher.stats()
+        stats["avg_encode_ms"] = stats.pop("avg_process_ms")
+        stats["cache"] = self._cache.stats() if self._cache is not None else None
+        stats["chunk_cache"] = (
+            self._chunk_cache.stats() if self._chunk_cache is not None else None
+        )
+        return stats
+
+    def close(self) -> None:
+        """Finish queued encodes and stop the executor"""
+        self._batcher.close()
+
+    def _lookup(
+        self, texts: Union[str, List[str]], use_cache: bool
+    ) -> Tuple[
+        List[str],
+        Optional[List[Tuple[str, str]]],
+        List[Optional[np.ndarray]],
+        Optional[List[int]],
+    ]:
+        """Texts as a list, their cache keys, cached embeddings, and which to encode"""
+        items = [texts] if isinstance(texts, str) else list(texts)
+        if not use_cache or self._cache is None or not items:
+            return items, None, [], list(range(len(items)))
+        keys = [(self.model_name, self._normalize(item)) for item in items]
+        found = [self._cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(found) if embedding is None]
+        return items, keys, found, missing or None
+
+    def _submit(self, items: List[str], missing: List[int]) -> Future:
+        if len(missing) == len(items):
+            return self._batcher.submit(items)
+        return self._batcher.submit([items[i] for i in missing])
+
+    def _merge(
+        self,
+        keys: Optional[List[Tuple[str, str]]],
+        found: List[Optional[np.ndarray]],
+        missing: Optional[List[int]],
+        encoded: Optional[np.ndarray],
+    ) -> np.ndarray:
+        if keys is None:
+            return encoded
+        for i, embedding in zip(missing or [], encoded if encoded is not None else []):
+            self._cache.put(keys[i], embedding)
+            found[i] = embedding
+        if missing is not None and len(missing) == len(found):
+            return encoded
+        return np.stack(found)
+
+    @staticmethod
+    def _chunk_misses(
+        texts: List[str], found: Optional[List[Optional[np.ndarray]]]
+    ) -> List[int]:
+        if found is None:
+            return list(range(len(texts)))
+        return [i for i, embedding in enumerate(found) if embedding is None]
+
+    def _append_chunks(self, texts: List[str], missing: List[int], encoded: np.ndarray) -> None:
+        try:
+            self._chunk_cache.append([texts[i] for i in missing], encoded)
+        except Exception as e:
+            # The embeddings are still returned; they are only not reused later
+            logger.warning(f"Could not persist chunk embeddings: {e}")
+
+    @staticmethod
+    def _merge_chunks(
+        texts: List[str],
+        found: Optional[List[Optional[np.ndarray]]],
+        missing: List[int],
+        encoded: Optional[np.ndarray],
+    ) -> np.ndarray:
+        if found is None or len(missing) == len(texts):
+            return encoded if encoded is not None else np.empty((0, 0), dtype=np.float32)
+        embeddings = list(found)
+        for i, embedding in zip(missing, encoded if encoded is not None else []):
+            embeddings[i] = embedding
+        return np.stack(embeddings)
+
+    def _normalize(self, text: str) -> str:
+        """Cache key text: Unicode-normalized, whitespace collapsed"""
+        text = " ".join(unicodedata.normalize("NFKC", text).split())
+        return text.casefold() if self._case_insensitive else text
+
+    @staticmethod
+    def _result(texts: Union[str, List[str]], embeddings: np.ndarray) -> np.ndarray:
+        # A single text gets a single vector, as from encode(str)
+        return embeddings[0] if isinstance(texts, str) else embeddings
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
         return self.model.encode(texts)
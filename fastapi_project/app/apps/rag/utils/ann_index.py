@@ -0,0 +1,167 @@
+# app/apps/rag/utils/ann_index.py
+import copy
+import uuid
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .buffers import GrowableArray
+
+
+class IVFIndex:
+    """Inverted file index over unit-length embeddings.
+
+    Rows are clustered around spherical k-means centroids. A query only scores
+    the rows of its ``nprobe`` closest clusters, so the index is a candidate
+    generator: the vector store still scores candidates at full precision.
+    """
+
+    # Rows assigned to centroids per matrix product, to bound temporaries
+    ASSIGN_BLOCK_SIZE = 65536
+
+    def __init__(
+        self,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        train_iterations: int = 10,
+        max_train_samples_per_list: int = 64,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            nlist: Number of clusters (defaults to 4 * sqrt(rows) at training time)
+            nprobe: Default number of clusters scanned per query
+            train_iterations: k-means iterations
+            max_train_samples_per_list: Training sample size per cluster
+            seed: Random seed for sampling and centroid initialisation
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.max_train_samples_per_list = max_train_samples_per_list
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        # Identifies the centroid set that persisted assignments refer to
+        self.version: Optional[str] = None
+        self.trained_size = 0
+        self._assignments = GrowableArray(np.empty(0, dtype=np.int32))
+        # (row count, row order, list offsets), rebuilt when rows were added
+        self._lists: Optional[Tuple[int, np.ndarray, np.ndarray]] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def assignments(self) -> np.ndarray:
+        """Cluster id of every row"""
+        return self._assignments.view
+
+    def train(self, embeddings: np.ndarray) -> None:
+        """Fit centroids with spherical k-means and assign every row"""
+        n_rows = len(embeddings)
+        nlist = self.nlist or int(4 * np.sqrt(n_rows))
+        nlist = max(1, min(nlist, n_rows))
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n_rows, nlist * self.max_train_samples_per_list)
+        sample = np.asarray(
+            embeddings[np.sort(rng.choice(n_rows, size=sample_size, replace=False))],
+            dtype=np.float32,
+        )
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            labels = self._nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+
+            # Re-seed empty clusters from random sample rows
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(sample_size, size=len(empty))]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        self.centroids = np.ascontiguousarray(centroids)
+        self.version = uuid.uuid4().hex
+        self.trained_size = n_rows
+        self.reset(self.assign(embeddings))
+
+    def load(
+        self, centroids: np.ndarray, version: str, trained_size: int
+    ) -> None:
+        """Restore persisted centroids; assignments are set with reset()"""
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.version = version
+        self.trained_size = trained_size
+
+    def assign(self, embeddings: np.ndarray) -> np.ndarray:
+        """Closest centroid for each row"""
+        if not self.is_trained:
+            raise RuntimeError("IVF index is not trained")
+        return self._nearest(embeddings, self.centroids)
+
+    def add(self, assignments: np.ndarray) -> None:
+        """Append assignments for rows added at the end of the store"""
+        self._assignments.append(assignments)
+
+    def select(self, keep_mask: np.ndarray) -> "IVFIndex":
+        """A copy holding only the kept rows, in order; this index is unchanged"""
+        index = copy.copy(self)
+        index.reset(self.assignments[keep_mask])
+        return index
+
+    def reset(self, assignments: np.ndarray) -> None:
+        """Replace all row assignments"""
+        self._assignments = GrowableArray(np.asarray(assignments, dtype=np.int32))
+        self._lists = None
+
+    def candidates(
+        self, queries: np.ndarray, nprobe: Optional[int] = None
+    ) -> List[np.ndarray]:
+        """Row ids in the nprobe closest clusters of each query.
+
+        Rows appended while the lists are read may be included; callers
+        searching a snapshot drop row ids beyond its size.
+        """
+        order, offsets = self._inverted_lists()
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        # Sorted row ids keep the gather from the embedding matrix sequential
+        return [
+            np.sort(
+                np.concatenate(
+                    [order[offsets[list_id] : offsets[list_id + 1]] for list_id in probe]
+                )
+            )
+            for probe in probes
+        ]
+
+    def _inverted_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Row ids grouped by cluster, rebuilt lazily after rows were added"""
+        # Read the cache once; concurrent readers may rebuild it redundantly
+        # but never see row order and offsets from different builds
+        assignments = self.assignments
+        lists = self._lists
+        if lists is None or lists[0] != len(assignments):
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=len(self.centroids))
+            lists = (len(assignments), order, np.concatenate([[0], np.cumsum(counts)]))
+            self._lists = lists
+        return lists[1], lists[2]
+
+    @classmethod
+    def _nearest(cls, embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(embeddings), dtype=np.int32)
+        for start in range(0, len(embeddings), cls.ASSIGN_BLOCK_SIZE):
+            block = embeddings[start : start + cls.ASSIGN_BLOCK_SIZE]
+            labels[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return labels
@@ -0,0 +1,131 @@
+# app/apps/rag/utils/block_file.py
+import json
+import struct
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class CorruptBlockFile(ValueError):
+    """A block file is truncated or fails its checksum"""
+
+
+class BlockFile:
+    """Read side of a file of named NumPy arrays ("blocks") behind an offset table.
+
+    Layout: an 8-byte magic, the header length and its CRC32, a JSON header
+    listing each block's dtype, shape, byte offset, length and CRC32, then the
+    blocks themselves, 8-byte aligned. Blocks are read straight out of the
+    buffer (a memory map stays a memory map) and checksummed on first access,
+    so a reader only pays for the blocks it uses.
+    """
+
+    MAGIC = b"VSBLOCK1"
+    PREFIX = struct.Struct("<II")  # header length, header CRC32
+    ALIGNMENT = 8
+
+    def __init__(self, buffer):
+        self._buffer = np.frombuffer(buffer, dtype=np.uint8)
+        header_start = len(self.MAGIC) + self.PREFIX.size
+        if (
+            len(self._buffer) < header_start
+            or self._buffer[: len(self.MAGIC)].tobytes() != self.MAGIC
+        ):
+            raise CorruptBlockFile("Not a block file")
+
+        header_length, header_checksum = self.PREFIX.unpack(
+            self._buffer[len(self.MAGIC) : header_start].tobytes()
+        )
+        header = self._buffer[header_start : header_start + header_length].tobytes()
+        if len(header) != header_length or zlib.crc32(header) != header_checksum:
+            raise CorruptBlockFile("Block file header is truncated or corrupt")
+
+        header = json.loads(header.decode("utf-8"))
+        self.attributes: Dict[str, Any] = header["attributes"]
+        self._blocks: Dict[str, Dict[str, Any]] = {
+            block["name"]: block for block in header["blocks"]
+        }
+        self._verified: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def is_block_file(cls, buffer) -> bool:
+        return bytes(memoryview(buffer)[: len(cls.MAGIC)]) == cls.MAGIC
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._blocks)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._blocks
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """A block's array, checksummed the first time it is read"""
+        array = self._verified.get(name)
+        if array is not None:
+            return array
+
+        block = self._blocks[name]
+        data = self._buffer[block["offset"] : block["offset"] + block["length"]]
+        if len(data) != block["length"] or zlib.crc32(data) != block["crc32"]:
+            raise CorruptBlockFile(f"Block {name} is truncated or corrupt")
+        array = data.view(np.dtype(block["dtype"])).reshape(block["shape"])
+        self._verified[name] = array
+        return array
+
+    def get(self, name: str, default: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        return self[name] if name in self._blocks else default
+
+    @classmethod
+    def write(
+        cls, blocks: Dict[str, np.ndarray], attributes: Optional[Dict[str, Any]] = None
+    ) -> bytes:
+        """Serialize named arrays (and JSON attributes) into one block file"""
+        arrays = {name: np.ascontiguousarray(array) for name, array in blocks.items()}
+        entries = []
+        offset = 0
+        for name, array in arrays.items():
+            entries.append(
+                {
+                    "name": name,
+                    # Explicit little-endian dtypes keep files portable
+                    "dtype": array.dtype.newbyteorder("<").str,
+                    "shape": list(array.shape),
+                    "offset": offset,
+                    "length": array.nbytes,
+                    "crc32": zlib.crc32(array.astype(array.dtype.newbyteorder("<"), copy=False)),
+                }
+            )
+            offset += cls._aligned(array.nbytes)
+
+        # Block offsets are relative until the header size is known
+        def encode_header(data_start: int) -> bytes:
+            for entry, relative in zip(entries, relative_offsets):
+                entry["offset"] = data_start + relative
+            return json.dumps({"attributes": attributes or {}, "blocks": entries}).encode(
+                "utf-8"
+            )
+
+        relative_offsets = [entry["offset"] for entry in entries]
+        prefix_size = len(cls.MAGIC) + cls.PREFIX.size
+        header = encode_header(0)
+        # Offsets only grow the header, so iterate until its size is stable
+        while True:
+            data_start = cls._aligned(prefix_size + len(header))
+            new_header = encode_header(data_start)
+            if len(new_header) == len(header):
+                header = new_header
+                break
+            header = new_header
+
+        parts = [cls.MAGIC, cls.PREFIX.pack(len(header), zlib.crc32(header)), header]
+        parts.append(b"\0" * (data_start - prefix_size - len(header)))
+        for array in arrays.values():
+            data = array.astype(array.dtype.newbyteorder("<"), copy=False).tobytes()
+            parts.append(data)
+            parts.append(b"\0" * (cls._aligned(len(data)) - len(data)))
+        return b"".join(parts)
+
+    @classmethod
+    def _aligned(cls, size: int) -> int:
+        return -(-size // cls.ALIGNMENT) * cls.ALIGNMENT
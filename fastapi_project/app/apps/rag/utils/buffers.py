@@ -0,0 +1,168 @@
+# app/apps/rag/utils/buffers.py
+from typing import List, Optional, Union
+
+import numpy as np
+
+
+class RowChunks(np.lib.mixins.NDArrayOperatorsMixin):
+    """Rows of several arrays read as one array, without concatenating them.
+
+    Supports len(), shape, integer/slice/fancy/mask row indexing and
+    ``chunks @ matrix`` chunk by chunk; other numpy operations fall back to
+    a concatenated copy.
+    """
+
+    def __init__(self, chunks: List[np.ndarray]):
+        self.chunks = chunks
+        lengths = [len(chunk) for chunk in chunks]
+        # starts[i] is the first row of chunks[i]; starts[-1] the row count
+        self._starts = np.concatenate([[0], np.cumsum(lengths)]).astype(np.intp)
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    @property
+    def shape(self):
+        return (len(self),) + self.chunks[0].shape[1:]
+
+    @property
+    def ndim(self) -> int:
+        return self.chunks[0].ndim
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.chunks[0].dtype
+
+    @property
+    def itemsize(self) -> int:
+        return self.dtype.itemsize
+
+    @property
+    def nbytes(self) -> int:
+        return sum(chunk.nbytes for chunk in self.chunks)
+
+    def __getitem__(self, key) -> Union[np.ndarray, "RowChunks", np.generic]:
+        if isinstance(key, (int, np.integer)):
+            row = int(key) + len(self) if key < 0 else int(key)
+            if not 0 <= row < len(self):
+                raise IndexError(f"row {key} out of range for {len(self)} rows")
+            chunk = int(np.searchsorted(self._starts, row, side="right")) - 1
+            return self.chunks[chunk][row - self._starts[chunk]]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            parts = [
+                chunk[max(start - first, 0) : stop - first]
+                for chunk, first in zip(self.chunks, self._starts)
+                if first < stop and first + len(chunk) > start
+            ]
+            if len(parts) == 1:
+                return parts[0]
+            return RowChunks(parts) if parts else self.chunks[0][:0]
+        if isinstance(key, tuple):
+            return np.asarray(self)[key]
+
+        rows = np.asarray(key)
+        if rows.dtype == bool:
+            if len(rows) != len(self):
+                raise IndexError(f"mask of {len(rows)} rows for {len(self)} rows")
+            rows = np.flatnonzero(rows)
+        rows = np.where(rows < 0, rows + len(self), rows)
+        gathered = np.empty((len(rows),) + self.shape[1:], dtype=self.dtype)
+        owners = np.searchsorted(self._starts, rows, side="right") - 1
+        for i, chunk in enumerate(self.chunks):
+            selected = owners == i
+            gathered[selected] = chunk[rows[selected] - self._starts[i]]
+        return gathered
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        array = np.concatenate(self.chunks)
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if ufunc is np.matmul and method == "__call__" and not kwargs and inputs[0] is self:
+            # Row blocks times a matrix (or vector) stack chunk by chunk
+            return np.concatenate([chunk @ inputs[1] for chunk in self.chunks])
+        inputs = tuple(
+            np.asarray(value) if isinstance(value, RowChunks) else value for value in inputs
+        )
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def tolist(self) -> list:
+        return [value for chunk in self.chunks for value in chunk.tolist()]
+
+    def tobytes(self) -> bytes:
+        return b"".join(chunk.tobytes() for chunk in self.chunks)
+
+
+class GrowableArray:
+    """Append-only array whose capacity grows geometrically.
+
+    Appending copies only the new rows, except when the capacity is exhausted,
+    so n appends cost amortized O(1) per row instead of a full np.vstack each
+    time. ``view`` exposes the logical rows; views taken earlier stay valid
+    because rows beyond their length are never rewritten in place.
+
+    Read-only initial data (e.g. a memory-mapped segment) is never copied:
+    appended rows go to a separate buffer and ``view`` then reads both as
+    RowChunks, so the mapped rows stay in the shared page cache.
+    """
+
+    def __init__(
+        self,
+        data: Optional[np.ndarray] = None,
+        dtype=np.float32,
+        growth: float = 1.5,
+        min_capacity: int = 1024,
+    ):
+        self.growth = growth
+        self.min_capacity = min_capacity
+        if data is None:
+            data = np.empty(0, dtype=dtype)
+        self._base: Optional[np.ndarray] = None
+        if len(data) and not data.flags.writeable:
+            self._base = data
+            data = np.empty((0,) + data.shape[1:], dtype=data.dtype)
+        # Writable initial data is used as is until the first append needs more room
+        self._buffer = data
+        self._length = len(data)
+
+    def __len__(self) -> int:
+        return self._length if self._base is None else len(self._base) + self._length
+
+    @property
+    def view(self) -> Union[np.ndarray, RowChunks]:
+        if self._base is None:
+            return self._buffer[: self._length]
+        if self._length == 0:
+            return self._base
+        return RowChunks([self._base, self._buffer[: self._length]])
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer) if self._base is None else len(self._base) + len(self._buffer)
+
+    def append(self, rows: np.ndarray) -> None:
+        """Append rows, reallocating only when the capacity is exhausted"""
+        rows = np.asarray(rows, dtype=self._buffer.dtype)
+        if len(rows) == 0:
+            return
+
+        new_length = self._length + len(rows)
+        if len(self) == 0 and self._buffer.shape[1:] != rows.shape[1:]:
+            # First rows define the row shape (e.g. the embedding dimension)
+            self._buffer = np.empty(
+                (max(self.min_capacity, len(rows)),) + rows.shape[1:],
+                dtype=self._buffer.dtype,
+            )
+        elif new_length > len(self._buffer):
+            capacity = max(
+                new_length, int(len(self._buffer) * self.growth), self.min_capacity
+            )
+            buffer = np.empty((capacity,) + self._buffer.shape[1:], dtype=self._buffer.dtype)
+            buffer[: self._length] = self._buffer[: self._length]
+            self._buffer = buffer
+
+        self._buffer[self._length : new_length] = rows
+        self._length = new_length
@@ -0,0 +1,290 @@
+# app/apps/rag/utils/chunk_embedding_cache.py
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .block_file import BlockFile
+from .storage import ObjectNotFound, ObjectStore
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkEmbeddingCache:
+    """Persistent, content-addressed embeddings of document chunks.
+
+    Vectors are keyed by a hash of the normalized chunk text and kept per
+    model under {key_prefix}{model}/, so re-uploading a revised document or
+    re-ingesting after a parser change only encodes chunks whose text is new.
+    Storage is an append-only log: every append() writes one immutable block
+    file of hashes (sorted) and float32 vectors. Files are merged by size
+    tier, as in an LSM tree: files of similar size (the same power of
+    merge_factor entries) are merged into one once merge_factor of them
+    exist, so every entry is rewritten about log(entries) / log(merge_factor)
+    times instead of on every merge.
+
+    Nothing is loaded into memory: each file is memory-mapped from the
+    backend's own local file or a copy in local_cache_dir (a disk-backed
+    directory; ~/.cache/embedding-cache by default), and looked up by
+    binary search of its sorted hashes, so workers share the page cache and
+    the kernel drops cold pages. Files written by other instances are picked
+    up when a lookup misses, listing storage at most every refresh_interval
+    seconds.
+    """
+
+    HASH_SIZE = 16
+    # Files of other formats (e.g. keyed by unnormalized text) are skipped
+    FORMAT = 2
+
+    def __init__(
+        self,
+        object_store: ObjectStore,
+        model_name: str,
+        key_prefix: str = "embedding-cache/",
+        merge_factor: int = 4,
+        local_cache_dir: Optional[str] = None,
+        refresh_interval: float = 30.0,
+        normalize: Optional[Callable[[str], str]] = None,
+    ):
+        self.object_store = object_store
+        self.model_name = model_name
+        # Model names may hold slashes ("org/model"); keep one directory per model
+        self.prefix = f"{key_prefix}{re.sub(r'[^A-Za-z0-9._-]', '_', model_name)}/"
+        self.merge_factor = max(2, merge_factor)
+        # Not the temp directory, which is memory-backed on some hosts
+        self.local_cache_dir = local_cache_dir or os.path.join(
+            os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+            "embedding-cache",
+        )
+        self.refresh_interval = refresh_interval
+        self.normalize = normalize
+        self._lock = threading.Lock()
+        # key -> (sorted hashes, vectors), both memory-mapped
+        self._files: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._skipped: Set[str] = set()
+        # Keys copied into local_cache_dir, removed again once merged away
+        self._copies: Set[str] = set()
+        self._listed_at: Optional[float] = None
+        self._hits = 0
+        self._misses = 0
+        self._appended = 0
+        self._refreshes = 0
+
+    def hash(self, text: str) -> bytes:
+        if self.normalize is not None:
+            text = self.normalize(text)
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=self.HASH_SIZE).digest()
+
+    def lookup(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vector of each text, None where it has none"""
+        hashes = [self.hash(text) for text in texts]
+        found = self._find(hashes)
+        if any(vector is None for vector in found) and self._refresh_due():
+            # Another instance may have embedded them meanwhile
+            self.refresh()
+            missing = [i for i, vector in enumerate(found) if vector is None]
+            for i, vector in zip(missing, self._find([hashes[i] for i in missing])):
+                found[i] = vector
+        with self._lock:
+            hits = sum(vector is not None for vector in found)
+            self._hits += hits
+            self._misses += len(found) - hits
+        return found
+
+    def append(self, texts: List[str], vectors: np.ndarray) -> None:
+        """Persist newly encoded vectors as one more log file"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        hashes: Dict[bytes, int] = {}
+        digests = [self.hash(text) for text in texts]
+        for i, (digest, vector) in enumerate(zip(digests, self._find(digests))):
+            if vector is None:
+                hashes.setdefault(digest, i)
+        if not hashes:
+            return
+
+        rows = list(hashes.values())
+        key = self._write(self._as_keys(list(hashes)), vectors[rows])
+        self._open(key)
+        with self._lock:
+            self._appended += len(rows)
+        self.compact()
+
+    def refresh(self) -> int:
+        """Open log files not seen yet; returns how many were opened"""
+        with self._lock:
+            self._listed_at = time.monotonic()
+            self._refreshes += 1
+        try:
+            listed = set(self.object_store.list(self.prefix))
+        except Exception as e:
+            logger.warning(f"Could not list the chunk embedding cache: {e}")
+            return 0
+
+        loaded = 0
+        for key in sorted(listed - set(self._files) - self._skipped):
+            try:
+                loaded += self._open(key)
+            except ObjectNotFound:
+                # Merged away by another instance; its merged file is listed too
+                continue
+            except Exception as e:
+                logger.warning(f"Skipping unreadable chunk embedding cache file {key}: {e}")
+                with self._lock:
+                    self._skipped.add(key)
+        # Files merged away by another instance: their entries are in a listed file
+        self._forget(set(self._files) - listed)
+        return loaded
+
+    def compact(self) -> bool:
+        """Merge every full size tier; returns whether any files were merged"""
+        merged = False
+        while True:
+            with self._lock:
+                files = self._full_tier()
+            if not files or not self._merge(files):
+                return merged
+            merged = True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": sum(len(hashes) for hashes, _ in self._files.values()),
+                "files": len(self._files),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else None,
+                "appended": self._appended,
+                "refreshes": self._refreshes,
+            }
+
+    def _refresh_due(self) -> bool:
+        """Whether a lookup may list storage again; claims the listing if so"""
+        with self._lock:
+            now = time.monotonic()
+            if self._listed_at is not None and now - self._listed_at < self.refresh_interval:
+                return False
+            self._listed_at = now
+            return True
+
+    def _full_tier(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Open files of the smallest size tier holding merge_factor files"""
+        tiers: Dict[int, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+        for key, file in self._files.items():
+            tier, size = 0, len(file[0])
+            while size >= self.merge_factor:
+                size //= self.merge_factor
+                tier += 1
+            tiers.setdefault(tier, {})[key] = file
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier]
+        return {}
+
+    def _merge(self, files: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> bool:
+        """Merge log files into one and delete the merged ones"""
+        try:
+            hashes = np.concatenate([file_hashes for file_hashes, _ in files.values()])
+            vectors = np.concatenate([file_vectors for _, file_vectors in files.values()])
+            hashes, rows = np.unique(hashes, return_index=True)
+            key = self._write(hashes, vectors[rows])
+            self._open(key)
+            # Deleted only once the merged file is in place
+            for old_key in files:
+                self.object_store.delete(old_key)
+            self._forget(set(files))
+            return True
+        except Exception as e:
+            logger.error(f"Error compacting the chunk embedding cache: {e}")
+            return False
+
+    def _find(self, hashes: List[bytes]) -> List[Optional[np.ndarray]]:
+        found: List[Optional[np.ndarray]] = [None] * len(hashes)
+        with self._lock:
+            files = list(self._files.values())
+        if not hashes:
+            return found
+        keys = self._as_keys(hashes)
+        for file_hashes, vectors in files:
+            if not len(file_hashes):
+                continue
+            positions = np.minimum(np.searchsorted(file_hashes, keys), len(file_hashes) - 1)
+            for i in np.flatnonzero(file_hashes[positions] == keys):
+                if found[i] is None:
+                    found[i] = np.array(vectors[positions[i]])
+        return found
+
+    def _open(self, key: str) -> int:
+        """Memory-map a log file and index it; returns 1 if it was opened"""
+        blocks = BlockFile(np.memmap(self._local_path(key), mode="r"))
+        if (
+            blocks.attributes.get("model") != self.model_name
+            or blocks.attributes.get("format") != self.FORMAT
+        ):
+            with self._lock:
+                self._skipped.add(key)
+            return 0
+        hashes = blocks["hashes"].view(f"S{self.HASH_SIZE}").reshape(-1)
+        with self._lock:
+            self._files[key] = (hashes, blocks["vectors"])
+        return 1
+
+    def _forget(self, keys: Set[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._files.pop(key, None)
+            copies = keys & self._copies
+            self._copies -= copies
+        for key in copies:
+            # Open mappings keep the file's contents until they are dropped
+            path = os.path.join(self.local_cache_dir, key)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _local_path(self, key: str) -> str:
+        """Local file with a log file's contents: the backend's own or a copy"""
+        path = self.object_store.local_path(key)
+        if path is not None:
+            return path
+        # Log files never change, so a copy (maybe by another worker) is reusable
+        path = os.path.join(self.local_cache_dir, key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                self.object_store.download_to_filename(key, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        with self._lock:
+            self._copies.add(key)
+        return path
+
+    def _as_keys(self, hashes: List[bytes]) -> np.ndarray:
+        return np.array(hashes, dtype=f"S{self.HASH_SIZE}")
+
+    def _write(self, hashes: np.ndarray, vectors: np.ndarray) -> str:
+        """Write a log file, sorted by hash for lookups by binary search"""
+        order = np.argsort(hashes, kind="stable")
+        key = f"{self.prefix}{uuid.uuid4().hex}.vec"
+        self.object_store.put(
+            key,
+            BlockFile.write(
+                {
+                    "hashes": np.frombuffer(hashes[order].tobytes(), dtype=np.uint8).reshape(
+                        -1, self.HASH_SIZE
+                    ),
+                    "vectors": vectors[order],
+                },
+                {"model": self.model_name, "rows": len(vectors), "format": self.FORMAT},
+            ),
+            content_type="application/octet-stream",
+        )
+        return key
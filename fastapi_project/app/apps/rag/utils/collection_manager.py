@@ -0,0 +1,207 @@
+# app/apps/rag/utils/collection_manager.py
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .vector_store import CloudVectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionNotFound(KeyError):
+    """A collection was read that has nothing in storage"""
+
+
+class CollectionManager:
+    """Named vector store collections, loaded on first use.
+
+    Each collection is its own CloudVectorStore with its own index and storage
+    prefix, so a query only touches the vectors of its collection. Stores are
+    leased while in use; once the loaded stores exceed memory_budget bytes or
+    max_collections stores, the least recently used idle ones are flushed and
+    unloaded. Only writers create collections: reading a name with nothing in
+    storage raises CollectionNotFound instead of keeping an empty store.
+    """
+
+    NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+    def __init__(
+        self,
+        create_store: Callable[[str], CloudVectorStore],
+        default_collection: str = "default",
+        memory_budget: Optional[int] = None,
+        max_collections: Optional[int] = None,
+    ):
+        """
+        Args:
+            create_store: Builds an unloaded store for a storage key prefix
+            default_collection: Collection used when none is given; it keeps
+                the original "embeddings/" prefix
+            memory_budget: Bytes of loaded collections to keep (unlimited if None)
+            max_collections: Loaded collections to keep (unlimited if None)
+        """
+        self.create_store = create_store
+        self.default_collection = default_collection
+        self.memory_budget = memory_budget
+        self.max_collections = max_collections
+
+        self._lock = threading.Lock()
+        # Loaded stores, least recently used first
+        self._stores: "OrderedDict[str, CloudVectorStore]" = OrderedDict()
+        self._leases: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
+        # Serialize loading and unloading per collection, so a collection is
+        # never loaded while its previous store is still flushing
+        self._collection_locks: Dict[str, threading.Lock] = {}
+
+    def key_prefix(self, name: str) -> str:
+        if name == self.default_collection:
+            return "embeddings/"
+        return f"collections/{name}/"
+
+    def resolve(self, name: Optional[str]) -> str:
+        """Collection name to use, raising ValueError for invalid names"""
+        name = name or self.default_collection
+        if not self.NAME_PATTERN.match(name):
+            raise ValueError(
+                f"Invalid collection name: {name!r} "
+                "(letters, digits, '-' and '_', at most 64 characters)"
+            )
+        return name
+
+    @contextmanager
+    def use(
+        self, name: Optional[str] = None, create: bool = False
+    ) -> Iterator[CloudVectorStore]:
+        """Lease a collection's store for the duration of the block"""
+        store = self.acquire(name, create)
+        try:
+            yield store
+        finally:
+            self.release(name)
+
+    def acquire(self, name: Optional[str] = None, create: bool = False) -> CloudVectorStore:
+        """Lease a collection's store, loading it first if needed; see release().
+
+        Unless create is set, a collection with nothing in storage raises
+        CollectionNotFound; the default collection always exists.
+        """
+        name = self.resolve(name)
+        with self._lock:
+            store = self._lease(name)
+            collection_lock = self._collection_locks.setdefault(name, threading.Lock())
+        if store is not None:
+            return store
+
+        with collection_lock:
+            with self._lock:
+                store = self._lease(name)
+            if store is None:
+                store = self.create_store(self.key_prefix(name))
+                if not store.load_from_cloud() and not (
+                    create or name == self.default_collection
+                ):
+                    store.close()
+                    raise CollectionNotFound(name)
+                logger.info(f"Loaded collection {name} ({len(store.documents)} rows)")
+                with self._lock:
+                    self._stores[name] = store
+                    self._leases[name] = self._leases.get(name, 0) + 1
+                    self._last_used[name] = time.time()
+
+        self._enforce_budget()
+        return store
+
+    def release(self, name: Optional[str] = None) -> None:
+        """End a lease taken with acquire()"""
+        name = self.resolve(name)
+        with self._lock:
+            self._leases[name] = max(0, self._leases.get(name, 0) - 1)
+            self._last_used[name] = time.time()
+        # Writes may have grown the collection past the budget
+        self._enforce_budget()
+
+    def unload(self, name: str) -> bool:
+        """Flush and unload an idle collection"""
+        name = self.resolve(name)
+        with self._lock:
+            collection_lock = self._collection_locks.setdefault(name, threading.Lock())
+
+        with collection_lock:
+            with self._lock:
+                if name not in self._stores or self._leases.get(name):
+                    return False
+                store = self._stores.pop(name)
+                self._leases.pop(name, None)
+                self._last_used.pop(name, None)
+            # Searches still holding a snapshot of the store keep working
+            store.close()
+        logger.info(f"Unloaded collection {name}")
+        return True
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Loaded collections with their rows, memory use and leases"""
+        with self._lock:
+            stores = list(self._stores.items())
+            leases = dict(self._leases)
+            last_used = dict(self._last_used)
+        return [
+            {
+                "name": name,
+                "key_prefix": self.key_prefix(name),
+                "rows": len(store.documents),
+                "memory_bytes": store.memory_usage(),
+                "leases": leases.get(name, 0),
+                "last_used": last_used.get(name),
+            }
+            for name, store in stores
+        ]
+
+    def close(self) -> None:
+        """Flush and unload every collection"""
+        with self._lock:
+            stores = list(self._stores.values())
+            self._stores.clear()
+        for store in stores:
+            store.close()
+
+    def _lease(self, name: str) -> Optional[CloudVectorStore]:
+        """Lease a loaded store (caller holds _lock)"""
+        store = self._stores.get(name)
+        if store is not None:
+            self._stores.move_to_end(name)
+            self._leases[name] = self._leases.get(name, 0) + 1
+            self._last_used[name] = time.time()
+        return store
+
+    def _enforce_budget(self) -> None:
+        if self.memory_budget is None and self.max_collections is None:
+            return
+
+        with self._lock:
+            usage = {name: store.memory_usage() for name, store in self._stores.items()}
+            idle = [name for name in self._stores if not self._leases.get(name)]
+        total = sum(usage.values())
+        count = len(usage)
+
+        def over_budget() -> bool:
+            return (self.memory_budget is not None and total > self.memory_budget) or (
+                self.max_collections is not None and count > self.max_collections
+            )
+
+        for name in idle:
+            if not over_budget():
+                break
+            if self.unload(name):
+                total -= usage[name]
+                count -= 1
+        if over_budget():
+            logger.warning(
+                f"{count} loaded collections use {total} bytes, over the budget of "
+                f"{self.max_collections} collections and {self.memory_budget} bytes, "
+                "but the rest are in use"
+            )
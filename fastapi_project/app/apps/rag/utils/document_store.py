@@ -0,0 +1,322 @@
+# app/apps/rag/utils/document_store.py
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .block_file import BlockFile
+from .buffers import GrowableArray
+
+
+class StringDictionary:
+    """Interns repeated strings and hands out small integer codes for them"""
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values: List[str] = list(values or [])
+        self._codes: Dict[str, int] = {value: i for i, value in enumerate(self.values)}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def encode(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+
+class DocumentStore:
+    """Columnar storage for the chunk documents of a vector store.
+
+    Chunk texts are UTF-8 encoded into one byte arena addressed by offsets.
+    Repeated strings such as doc_ids, filenames and file types are
+    dictionary-encoded into int32 code columns, and page and chunk numbers
+    are int32 columns. Metadata that fits none of the columns is kept per row
+    in a sparse dict. Document dicts are only rebuilt for the rows asked for,
+    e.g. the top-k results of a search.
+    """
+
+    STRING_FIELDS = (
+        "doc_id",
+        "original_filename",
+        "source",
+        "file_type",
+        "gcs_path",
+        "upload_time",
+    )
+    INT_FIELDS = ("page", "chunk", "chunk_index")
+    # Code of a missing value in every column
+    MISSING = -1
+    INT_MAX = np.iinfo(np.int32).max
+
+    def __init__(self):
+        self._text_bytes = GrowableArray(np.empty(0, dtype=np.uint8))
+        # Text of row i is _text_bytes[offsets[i] : offsets[i + 1]]
+        self._text_offsets = GrowableArray(np.zeros(1, dtype=np.int64))
+        self._dictionaries = {field: StringDictionary() for field in self.STRING_FIELDS}
+        self._columns = {
+            field: GrowableArray(np.empty(0, dtype=np.int32))
+            for field in self.STRING_FIELDS + self.INT_FIELDS
+        }
+        # Whether each row was stored with a metadata dict
+        self._has_metadata = GrowableArray(np.empty(0, dtype=bool))
+        # row -> (extra document keys, extra metadata keys)
+        self._extras: Dict[int, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        # Appended last in extend(), so every column covers this many rows
+        return len(self._has_metadata)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        """Rebuild the document dict of one row"""
+        row = int(row)
+        if not 0 <= row < len(self):
+            raise IndexError(f"Row {row} out of range")
+
+        document: Dict[str, Any] = {"text": self.text(row)}
+        metadata: Dict[str, Any] = {}
+        for field in self.STRING_FIELDS:
+            code = self._columns[field].view[row]
+            if code != self.MISSING:
+                metadata[field] = self._dictionaries[field].values[code]
+        for field in self.INT_FIELDS:
+            value = self._columns[field].view[row]
+            if value != self.MISSING:
+                metadata[field] = int(value)
+
+        extras = self._extras.get(row)
+        if extras is not None:
+            document.update(extras[0])
+            metadata.update(extras[1])
+        if self._has_metadata.view[row]:
+            document["metadata"] = metadata
+        return document
+
+    def text(self, row: int) -> str:
+        offsets = self._text_offsets.view
+        return (
+            self._text_bytes.view[offsets[row] : offsets[row + 1]]
+            .tobytes()
+            .decode("utf-8")
+        )
+
+    def column(self, field: str) -> np.ndarray:
+        """Codes (string fields) or values (int fields) of a column, MISSING where absent"""
+        return self._columns[field].view
+
+    def dictionary(self, field: str) -> List[str]:
+        """Values of a string field, indexed by code"""
+        return self._dictionaries[field].values
+
+    def extras(self) -> Iterator[Tuple[int, Dict[str, Any], Dict[str, Any]]]:
+        """(row, extra document keys, extra metadata keys) of rows that have any"""
+        for row, (document_extra, metadata_extra) in list(self._extras.items()):
+            yield row, document_extra, metadata_extra
+
+    def values(self, field: str) -> List[Optional[str]]:
+        """Decoded values of a string column, None where missing"""
+        dictionary_values = self._dictionaries[field].values
+        return [
+            dictionary_values[code] if code != self.MISSING else None
+            for code in self._columns[field].view.tolist()
+        ]
+
+    def to_list(self, start: int = 0, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rebuild the document dicts of a row range, e.g. for serialization"""
+        stop = len(self) if stop is None else stop
+        return [self[row] for row in range(start, stop)]
+
+    def extend(self, documents: List[Dict[str, Any]]) -> None:
+        """Append documents as new rows"""
+        first_row = len(self)
+        encoded_texts = []
+        has_metadata = np.zeros(len(documents), dtype=bool)
+        columns = {
+            field: np.full(len(documents), self.MISSING, dtype=np.int32)
+            for field in self._columns
+        }
+
+        for i, document in enumerate(documents):
+            document_extra = {
+                key: value
+                for key, value in document.items()
+                if key not in ("text", "metadata")
+            }
+            text = document.get("text")
+            if isinstance(text, str):
+                encoded_texts.append(text.encode("utf-8"))
+            else:
+                encoded_texts.append(b"")
+                document_extra["text"] = text
+
+            metadata = document.get("metadata")
+            metadata_extra = {}
+            if isinstance(metadata, dict):
+                has_metadata[i] = True
+                for field, value in metadata.items():
+                    if field in self._dictionaries and isinstance(value, str):
+                        columns[field][i] = self._dictionaries[field].encode(value)
+                    elif field in self.INT_FIELDS and self._is_int(value):
+                        columns[field][i] = value
+                    else:
+                        metadata_extra[field] = value
+            elif "metadata" in document:
+                document_extra["metadata"] = metadata
+
+            if document_extra or metadata_extra:
+                self._extras[first_row + i] = (document_extra, metadata_extra)
+
+        lengths = np.fromiter(map(len, encoded_texts), dtype=np.int64, count=len(documents))
+        self._text_bytes.append(np.frombuffer(b"".join(encoded_texts), dtype=np.uint8))
+        self._text_offsets.append(self._text_offsets.view[-1] + np.cumsum(lengths))
+        for field, column in columns.items():
+            self._columns[field].append(column)
+        self._has_metadata.append(has_metadata)
+
+    def append(self, other: "DocumentStore") -> None:
+        """Append every row of another store, re-encoding its dictionaries"""
+        first_row = len(self)
+        columns = {}
+        for field in self.STRING_FIELDS:
+            # other's code -> this store's code, applied to the column at once;
+            # MISSING (-1) picks the trailing MISSING entry
+            dictionary = self._dictionaries[field]
+            mapping = np.array(
+                [dictionary.encode(value) for value in other._dictionaries[field].values]
+                + [self.MISSING],
+                dtype=np.int32,
+            )
+            columns[field] = mapping[other._columns[field].view]
+        for field in self.INT_FIELDS:
+            columns[field] = other._columns[field].view
+
+        for row, extras in other._extras.items():
+            self._extras[first_row + row] = extras
+        other_offsets = other._text_offsets.view
+        self._text_bytes.append(other._text_bytes.view)
+        self._text_offsets.append(self._text_offsets.view[-1] + other_offsets[1:])
+        for field, column in columns.items():
+            self._columns[field].append(column)
+        self._has_metadata.append(other._has_metadata.view)
+
+    def to_bytes(self) -> bytes:
+        """Serialize every row as a checksummed columnar block file"""
+        blocks = {
+            "text_bytes": self._text_bytes.view,
+            "text_offsets": self._text_offsets.view,
+            "has_metadata": self._has_metadata.view,
+        }
+        for field in self.STRING_FIELDS:
+            # Only the dictionary values these rows use are written
+            codes = self._columns[field].view
+            used, compact_codes = np.unique(codes[codes != self.MISSING], return_inverse=True)
+            column = np.full(len(codes), self.MISSING, dtype=np.int32)
+            column[codes != self.MISSING] = compact_codes
+            values = [
+                self._dictionaries[field].values[code].encode("utf-8") for code in used
+            ]
+            lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+            offsets = np.zeros(len(values) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            blocks[f"{field}.codes"] = column
+            blocks[f"{field}.values"] = np.frombuffer(b"".join(values), dtype=np.uint8)
+            blocks[f"{field}.offsets"] = offsets
+        for field in self.INT_FIELDS:
+            blocks[field] = self._columns[field].view
+        if self._extras:
+            # Sparse and free-form, so JSON; rows as string keys
+            blocks["extras"] = np.frombuffer(
+                json.dumps(
+                    {str(row): extras for row, extras in self._extras.items()}
+                ).encode("utf-8"),
+                dtype=np.uint8,
+            )
+        return BlockFile.write(blocks, {"rows": len(self)})
+
+    @classmethod
+    def from_bytes(cls, buffer) -> "DocumentStore":
+        """Load a store written by to_bytes(); columns are not copied out of buffer"""
+        blocks = BlockFile(buffer)
+        store = cls()
+        store._text_bytes = GrowableArray(blocks["text_bytes"])
+        store._text_offsets = GrowableArray(blocks["text_offsets"])
+        store._has_metadata = GrowableArray(blocks["has_metadata"])
+        for field in cls.STRING_FIELDS:
+            values = blocks[f"{field}.values"].tobytes()
+            offsets = blocks[f"{field}.offsets"].tolist()
+            store._dictionaries[field] = StringDictionary(
+                [
+                    values[start:end].decode("utf-8")
+                    for start, end in zip(offsets[:-1], offsets[1:])
+                ]
+            )
+            store._columns[field] = GrowableArray(blocks[f"{field}.codes"])
+        for field in cls.INT_FIELDS:
+            store._columns[field] = GrowableArray(blocks[field])
+        extras = blocks.get("extras")
+        if extras is not None:
+            store._extras = {
+                int(row): (document_extra, metadata_extra)
+                for row, (document_extra, metadata_extra) in json.loads(
+                    extras.tobytes().decode("utf-8")
+                ).items()
+            }
+        if len(store) != blocks.attributes["rows"]:
+            raise ValueError("Document block file has inconsistent column lengths")
+        return store
+
+    def select(self, keep_mask: np.ndarray) -> "DocumentStore":
+        """A new store holding only the kept rows, in order.
+
+        Rows past the end of keep_mask are dropped, so the rows of a snapshot
+        can be selected while later rows are being appended.
+        """
+        store = DocumentStore()
+        kept_rows = np.flatnonzero(keep_mask)
+
+        offsets = self._text_offsets.view
+        starts = offsets[:-1][kept_rows]
+        lengths = offsets[1:][kept_rows] - starts
+        new_offsets = np.zeros(len(kept_rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=new_offsets[1:])
+        # Gather every kept byte range with one fancy index
+        byte_index = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(
+            new_offsets[-1]
+        )
+        store._text_bytes = GrowableArray(self._text_bytes.view[byte_index])
+        store._text_offsets = GrowableArray(new_offsets)
+
+        # Dictionaries are shared as they are; unused values are harmless
+        store._dictionaries = self._dictionaries
+        store._columns = {
+            field: GrowableArray(column.view[kept_rows])
+            for field, column in self._columns.items()
+        }
+        new_rows = np.cumsum(keep_mask) - 1
+        store._extras = {
+            int(new_rows[row]): extras
+            for row, extras in list(self._extras.items())
+            if row < len(keep_mask) and keep_mask[row]
+        }
+        store._has_metadata = GrowableArray(self._has_metadata.view[kept_rows])
+        return store
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the columns, excluding dictionaries and extras"""
+        return (
+            self._text_bytes.capacity
+            + self._text_offsets.capacity * 8
+            + sum(column.capacity * 4 for column in self._columns.values())
+            + self._has_metadata.capacity
+        )
+
+    @classmethod
+    def _is_int(cls, value: Any) -> bool:
+        return (
+            isinstance(value, (int, np.integer))
+            and not isinstance(value, bool)
+            and 0 <= value <= cls.INT_MAX
+        )
@@ -0,0 +1,91 @@
+# app/apps/rag/utils/embedding_cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of embedding vectors, bounded by memory.
+
+    Entries are evicted least recently used first once the vectors (plus a
+    fixed per-entry overhead) exceed max_bytes, and expire ttl seconds
+    after they were stored (never if ttl is None). Cached vectors are
+    read-only, so callers can't change them for later hits.
+    """
+
+    # Rough cost of an entry beyond its vector: key, tuple, dict slot
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (vector, expires_at), least recently used first
+        self._entries: "OrderedDict[Hashable, Tuple[np.ndarray, Optional[float]]]" = (
+            OrderedDict()
+        )
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, vector: np.ndarray) -> None:
+        vector = np.array(vector, copy=True)
+        vector.setflags(write=False)
+        size = vector.nbytes + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (vector, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else None,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        vector, _ = self._entries.pop(key)
+        self._bytes -= vector.nbytes + self.ENTRY_OVERHEAD
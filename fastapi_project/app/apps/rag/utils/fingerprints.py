@@ -0,0 +1,158 @@
+# app/apps/rag/utils/fingerprints.py
+import hashlib
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .buffers import GrowableArray
+
+
+class FingerprintIndex:
+    """Exact and near-duplicate fingerprints of the chunks in a vector store.
+
+    Every row gets two 64-bit fingerprints: a hash of its lightly normalized
+    full text (NFKC, collapsed whitespace, lowercase), so punctuation, signs
+    and symbols still tell chunks apart, and a SimHash over word shingles,
+    which differs in few bits between chunks with mostly the same words. The SimHash is split into eight 8-bit bands,
+    so any two fingerprints within seven bits share at least one band and
+    are found through the band tables without scanning every row.
+
+    Like the other per-row indexes, rows are only appended in place; readers
+    of a snapshot pass its size and deleted flags.
+    """
+
+    # Stored with segment fingerprints; others are recomputed on load
+    VERSION = 2
+    BANDS = 8
+    BAND_BITS = 8
+    SHINGLE_SIZE = 3
+    # Chunks with fewer words only match exactly
+    MIN_NEAR_WORDS = 8
+    WORD_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, max_distance: int = 6):
+        # Eight bands only guarantee a shared band up to seven differing bits
+        self.max_distance = min(max_distance, self.BANDS - 1)
+        self.size = 0
+        # Guards appends to the lookup tables against readers copying them
+        self._lock = threading.Lock()
+        # (exact hash, SimHash) of every row; a SimHash of 0 disables near matching
+        self._fingerprints = GrowableArray(np.empty((0, 2), dtype=np.uint64))
+        self._exact: Dict[int, List[int]] = {}
+        self._bands: List[Dict[int, List[int]]] = [{} for _ in range(self.BANDS)]
+
+    @property
+    def fingerprints(self) -> np.ndarray:
+        """(rows x 2) exact hashes and SimHashes"""
+        return self._fingerprints.view
+
+    @classmethod
+    def fingerprint(cls, texts: List[str]) -> np.ndarray:
+        """(len(texts) x 2) exact hashes and SimHashes"""
+        fingerprints = np.zeros((len(texts), 2), dtype=np.uint64)
+        for i, text in enumerate(texts):
+            text = text if isinstance(text, str) else ""
+            fingerprints[i, 0] = cls._hash(
+                " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+            )
+            # Only near matching ignores punctuation and symbols
+            words = cls.WORD_PATTERN.findall(text.lower())
+            if len(words) >= cls.MIN_NEAR_WORDS:
+                fingerprints[i, 1] = cls._simhash(words)
+        return fingerprints
+
+    def add(self, fingerprints: np.ndarray) -> None:
+        """Index fingerprints of rows appended at the end of the store"""
+        first_row = self.size
+        self._fingerprints.append(fingerprints)
+        with self._lock:
+            for i, (exact, simhash) in enumerate(fingerprints.tolist()):
+                row = first_row + i
+                self._exact.setdefault(exact, []).append(row)
+                if simhash:
+                    for band, key in enumerate(self._band_keys(simhash)):
+                        self._bands[band].setdefault(key, []).append(row)
+            self.size += len(fingerprints)
+
+    def match(
+        self,
+        fingerprint: np.ndarray,
+        size: Optional[int] = None,
+        deleted: Optional[np.ndarray] = None,
+    ) -> Optional[Tuple[str, int]]:
+        """("exact" or "near", row) of a live row the fingerprint duplicates"""
+        size = self.size if size is None else min(size, self.size)
+        exact, simhash = (int(value) for value in fingerprint)
+
+        with self._lock:
+            exact_rows = list(self._exact.get(exact, ()))
+        for row in exact_rows:
+            if row < size and (deleted is None or not deleted[row]):
+                return "exact", row
+        if not simhash:
+            return None
+
+        candidates = set()
+        with self._lock:
+            for band, key in enumerate(self._band_keys(simhash)):
+                candidates.update(self._bands[band].get(key, ()))
+        rows = np.array(sorted(row for row in candidates if row < size), dtype=np.intp)
+        if deleted is not None and len(rows):
+            rows = rows[~deleted[rows]]
+        if not len(rows):
+            return None
+
+        distances = self._distances(self.fingerprints[rows, 1], simhash)
+        best = int(np.argmin(distances))
+        if distances[best] <= self.max_distance:
+            return "near", int(rows[best])
+        return None
+
+    def select(self, keep_mask: np.ndarray) -> "FingerprintIndex":
+        """A new index over the kept rows, renumbered; this index is unchanged"""
+        index = FingerprintIndex(self.max_distance)
+        index.add(self.fingerprints[keep_mask])
+        return index
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the fingerprints and lookup tables"""
+        # One fingerprint pair plus about nine table entries per row
+        return self._fingerprints.capacity * 16 + self.size * (1 + self.BANDS) * 8
+
+    def _band_keys(self, simhash: int) -> List[int]:
+        mask = (1 << self.BAND_BITS) - 1
+        return [(simhash >> (band * self.BAND_BITS)) & mask for band in range(self.BANDS)]
+
+    @staticmethod
+    def _distances(simhashes: np.ndarray, simhash: int) -> np.ndarray:
+        """Hamming distances between SimHashes and one SimHash"""
+        differing = np.bitwise_xor(simhashes, np.uint64(simhash))
+        return np.unpackbits(differing.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(
+            hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+
+    @classmethod
+    def _simhash(cls, words: List[str]) -> int:
+        """Majority vote of the bits of every word shingle's hash"""
+        shingles = [
+            " ".join(words[i : i + cls.SHINGLE_SIZE])
+            for i in range(max(1, len(words) - cls.SHINGLE_SIZE + 1))
+        ]
+        hashes = np.frombuffer(
+            b"".join(
+                hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+                for shingle in shingles
+            ),
+            dtype="<u8",
+        )
+        bits = np.unpackbits(hashes.view(np.uint8), bitorder="little").reshape(-1, 64)
+        votes = 2 * bits.sum(axis=0, dtype=np.int64) > len(shingles)
+        return int(np.packbits(votes, bitorder="little").view("<u8")[0])
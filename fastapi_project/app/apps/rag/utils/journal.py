@@ -0,0 +1,141 @@
+# app/apps/rag/utils/journal.py
+import io
+import json
+import logging
+import os
+import struct
+import zlib
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; journals are then not locked
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """Append-only local log of changes that are not yet in cloud storage.
+
+    Each record is a JSON header and an optional .npy payload, framed by their
+    lengths and followed by a CRC32 of both. append() fsyncs before returning,
+    so an acknowledged change survives a crash. A record torn by a crash
+    mid-write fails its length or checksum and is dropped on replay.
+
+    A journal belongs to one process: acquire() locks it until close(), so
+    another process can tell a live journal from one left by a process that
+    exited before flushing it.
+    """
+
+    FRAME = struct.Struct("<IQ")  # header length, payload length
+    CHECKSUM = struct.Struct("<I")
+    # Whether acquire() actually excludes other processes
+    LOCKING = fcntl is not None
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = None
+
+    def acquire(self) -> bool:
+        """Open and lock the journal; False if another process holds it"""
+        if self._file is not None:
+            return True
+        journal_file = open(self.path, "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(journal_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                journal_file.close()
+                return False
+        self._file = journal_file
+        return True
+
+    def append(self, header: Dict[str, Any], array: Optional[np.ndarray] = None) -> None:
+        """Durably append one record"""
+        header_bytes = json.dumps(header).encode("utf-8")
+        payload = b""
+        if array is not None:
+            array_bytes = io.BytesIO()
+            np.save(array_bytes, array)
+            payload = array_bytes.getvalue()
+
+        record = self.FRAME.pack(len(header_bytes), len(payload)) + header_bytes + payload
+        record += self.CHECKSUM.pack(zlib.crc32(header_bytes + payload))
+
+        if self._file is None and not self.acquire():
+            raise RuntimeError(f"Journal {self.path} is held by another process")
+        self._file.write(record)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def replay(self) -> Iterator[Tuple[Dict[str, Any], Optional[np.ndarray]]]:
+        """Yield the intact records in order, cutting off a torn tail"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as f:
+            content = f.read()
+
+        offset = 0
+        while offset < len(content):
+            record = self._parse(content, offset)
+            if record is None:
+                logger.warning(
+                    f"Dropping {len(content) - offset} bytes of torn journal records "
+                    f"from {self.path}"
+                )
+                self._cut(offset)
+                return
+            header, array, offset = record
+            yield header, array
+
+    def truncate(self) -> None:
+        """Forget every record, once they are all in cloud storage"""
+        self._cut(0)
+
+    def remove(self) -> None:
+        """Delete the journal file, e.g. once another process's records are flushed"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.close()
+
+    def close(self) -> None:
+        """Release the journal to other processes"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _parse(
+        self, content: bytes, offset: int
+    ) -> Optional[Tuple[Dict[str, Any], Optional[np.ndarray], int]]:
+        if offset + self.FRAME.size > len(content):
+            return None
+        header_length, payload_length = self.FRAME.unpack_from(content, offset)
+        start = offset + self.FRAME.size
+        end = start + header_length + payload_length
+        if end + self.CHECKSUM.size > len(content):
+            return None
+
+        body = content[start:end]
+        (checksum,) = self.CHECKSUM.unpack_from(content, end)
+        if zlib.crc32(body) != checksum:
+            return None
+
+        header = json.loads(body[:header_length].decode("utf-8"))
+        array = np.load(io.BytesIO(body[header_length:])) if payload_length else None
+        return header, array, end + self.CHECKSUM.size
+
+    def _cut(self, size: int) -> None:
+        # Through the open file when there is one, so the lock is kept
+        if self._file is not None:
+            self._file.truncate(size)
+            os.fsync(self._file.fileno())
+        elif os.path.exists(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
@@ -0,0 +1,182 @@
+# app/apps/rag/utils/lexical_index.py
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .buffers import GrowableArray
+
+
+class LexicalIndex:
+    """In-memory inverted index over chunk text, scored with BM25.
+
+    Catches what embeddings blur: product codes, error strings and other
+    exact tokens. Each term maps to the rows holding it and their term
+    frequencies; rows are only appended in place, so readers of a snapshot
+    pass its size and rows past it are ignored. Deleted rows are skipped at
+    query time but still count in the corpus statistics until compaction
+    rebuilds the index with select().
+    """
+
+    # Words, with codes such as "ERR-404", "v2.1" or "SKU_12/B" kept whole
+    TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+    SPLIT_PATTERN = re.compile(r"[-./:_]")
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = 0
+        # Guards appends against the lazy merges done by readers
+        self._lock = threading.Lock()
+        # term -> (row ids, term frequencies) chunks, appended per add and merged lazily
+        self._postings: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        # Token count of row i is _length_totals[i + 1] - _length_totals[i]
+        self._length_totals = GrowableArray(np.zeros(1, dtype=np.int64))
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """Lowercased tokens; compound codes also yield their parts"""
+        tokens = []
+        for token in cls.TOKEN_PATTERN.findall(text.lower()):
+            tokens.append(token)
+            parts = cls.SPLIT_PATTERN.split(token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+        return tokens
+
+    def add(self, texts: List[str]) -> None:
+        """Index texts of rows appended at the end of the store"""
+        first_row = self.size
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = np.zeros(len(texts), dtype=np.int64)
+
+        for i, text in enumerate(texts):
+            tokens = self.tokenize(text) if isinstance(text, str) else []
+            lengths[i] = len(tokens)
+            for term, frequency in Counter(tokens).items():
+                rows, frequencies = postings.setdefault(term, ([], []))
+                rows.append(first_row + i)
+                frequencies.append(frequency)
+
+        # Lengths first: a reader that finds the new rows in a posting list
+        # can then always look up their lengths
+        self._length_totals.append(self._length_totals.view[-1] + np.cumsum(lengths))
+        with self._lock:
+            for term, (rows, frequencies) in postings.items():
+                self._postings.setdefault(term, []).append(
+                    (
+                        np.asarray(rows, dtype=np.int64),
+                        np.asarray(frequencies, dtype=np.float32),
+                    )
+                )
+            self.size += len(texts)
+
+    def append(self, other: "LexicalIndex") -> None:
+        """Append every row of another index, e.g. one built for a batch first"""
+        first_row = self.size
+        postings = {term: other._posting(term) for term in list(other._postings)}
+        self._length_totals.append(
+            self._length_totals.view[-1] + other._length_totals.view[1:]
+        )
+        with self._lock:
+            for term, (rows, frequencies) in postings.items():
+                self._postings.setdefault(term, []).append((rows + first_row, frequencies))
+            self.size += other.size
+
+    def select(self, keep_mask: np.ndarray) -> "LexicalIndex":
+        """A new index over the kept rows, renumbered; this index is unchanged"""
+        index = LexicalIndex(self.k1, self.b)
+        new_rows = np.cumsum(keep_mask) - 1
+
+        for term in list(self._postings):
+            rows, frequencies = self._posting(term)
+            kept = keep_mask[rows]
+            if kept.any():
+                index._postings[term] = [(new_rows[rows[kept]], frequencies[kept])]
+
+        lengths = np.diff(self._length_totals.view)[keep_mask]
+        totals = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=totals[1:])
+        index._length_totals = GrowableArray(totals)
+        index.size = int(keep_mask.sum())
+        return index
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        size: Optional[int] = None,
+        deleted: Optional[np.ndarray] = None,
+        rows: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and BM25 scores of the top_k matches, best first.
+
+        Only the first size rows are searched; deleted flags rows to skip and
+        rows, if given, restricts the search to those sorted row ids.
+        """
+        empty = (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32))
+        size = self.size if size is None else min(size, self.size)
+        terms = [term for term in set(self.tokenize(query)) if term in self._postings]
+        if top_k <= 0 or size == 0 or not terms:
+            return empty
+
+        totals = self._length_totals.view
+        average_length = max(totals[size] / size, 1e-9)
+        matched_rows = []
+        matched_scores = []
+        for term in terms:
+            term_rows, frequencies = self._posting(term)
+            # Posting rows are ascending, so the snapshot's rows are a prefix
+            count = np.searchsorted(term_rows, size)
+            if count == 0:
+                continue
+            term_rows, frequencies = term_rows[:count], frequencies[:count]
+            idf = np.log1p((size - count + 0.5) / (count + 0.5))
+            lengths = totals[term_rows + 1] - totals[term_rows]
+            norms = self.k1 * (1 - self.b + self.b * lengths / average_length)
+            matched_rows.append(term_rows)
+            matched_scores.append(idf * frequencies * (self.k1 + 1) / (frequencies + norms))
+        if not matched_rows:
+            return empty
+
+        # Sum the per-term scores of each row
+        all_rows = np.concatenate(matched_rows)
+        candidates, inverse = np.unique(all_rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(matched_scores))
+        keep = np.ones(len(candidates), dtype=bool)
+        if deleted is not None:
+            keep &= ~deleted[candidates]
+        if rows is not None:
+            keep &= np.isin(candidates, rows, assume_unique=True)
+        candidates, scores = candidates[keep], scores[keep].astype(np.float32)
+
+        top_k = min(top_k, len(candidates))
+        if top_k == 0:
+            return empty
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the postings and lengths, excluding term strings"""
+        with self._lock:
+            postings = [chunk for chunks in self._postings.values() for chunk in chunks]
+        return self._length_totals.capacity * 8 + sum(
+            rows.nbytes + frequencies.nbytes for rows, frequencies in postings
+        )
+
+    def _posting(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        chunks = self._postings[term]
+        if len(chunks) > 1:
+            with self._lock:
+                if len(chunks) > 1:
+                    chunks[:] = [
+                        (
+                            np.concatenate([rows for rows, _ in chunks]),
+                            np.concatenate([frequencies for _, frequencies in chunks]),
+                        )
+                    ]
+        return chunks[0]
@@ -0,0 +1,298 @@
+# app/apps/rag/utils/metadata_index.py
+import threading
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .document_store import DocumentStore
+
+
+class MetadataIndex:
+    """In-memory inverted index from chunk metadata to vector store rows.
+
+    Keyword fields map each value to the rows holding it; range fields are
+    kept as numeric columns. Filters are a dict of field -> condition:
+
+        {"file_type": "pdf"}                            equality
+        {"doc_id": ["id-1", "id-2"]}                    membership
+        {"upload_time": {"gte": "2025-01-01T00:00:00"}} range (gt/gte/lt/lte)
+
+    Conditions on different fields are combined with AND. Rows are only
+    appended in place, so readers of a snapshot drop row ids past its size.
+
+    A doc_id condition also matches the rows of chunks stored once for
+    several documents under another doc_id (see set_references).
+    """
+
+    KEYWORD_FIELDS = ("doc_id", "file_type", "original_filename", "source")
+    RANGE_FIELDS = ("page", "chunk_index", "upload_time")
+    RANGE_OPERATORS = ("gt", "gte", "lt", "lte")
+
+    def __init__(self):
+        self.size = 0
+        # Guards appends against the lazy merges done by readers
+        self._lock = threading.Lock()
+        # field -> value -> row id arrays, appended per add and merged lazily
+        self._postings: Dict[str, Dict[Any, List[np.ndarray]]] = {
+            field: {} for field in self.KEYWORD_FIELDS
+        }
+        # doc_id -> rows of other documents' chunks it shares, replaced whole
+        self._references: Dict[Any, np.ndarray] = {}
+        # field -> column chunks (NaN where the field is missing or not a
+        # number or timestamp)
+        self._columns: Dict[str, List[np.ndarray]] = {
+            field: [] for field in self.RANGE_FIELDS
+        }
+
+    def add(self, documents: List[Dict[str, Any]]) -> None:
+        """Index documents appended at the end of the store"""
+        first_row = self.size
+        values: Dict[str, Dict[Any, List[int]]] = {
+            field: {} for field in self.KEYWORD_FIELDS
+        }
+        columns = {
+            field: np.full(len(documents), np.nan) for field in self.RANGE_FIELDS
+        }
+
+        for i, document in enumerate(documents):
+            metadata = document.get("metadata") or {}
+            for field in self.KEYWORD_FIELDS:
+                value = metadata.get(field)
+                if value is not None:
+                    values[field].setdefault(value, []).append(first_row + i)
+            for field in self.RANGE_FIELDS:
+                value = metadata.get(field)
+                if value is not None:
+                    columns[field][i] = self._to_number(value)
+
+        # Columns first: a reader that finds the new rows in a posting list
+        # can then always look them up in the columns
+        with self._lock:
+            for field, column in columns.items():
+                self._columns[field].append(column)
+            for field, field_values in values.items():
+                for value, rows in field_values.items():
+                    self._postings[field].setdefault(value, []).append(
+                        np.asarray(rows, dtype=np.int64)
+                    )
+            self.size += len(documents)
+
+    def add_store(self, store: "DocumentStore") -> None:
+        """Index the rows of a DocumentStore appended at the end of the store.
+
+        Same result as add(store.to_list()), but built from the store's
+        columns instead of one dict per row.
+        """
+        first_row = self.size
+        values: Dict[str, Dict[Any, List[np.ndarray]]] = {
+            field: {} for field in self.KEYWORD_FIELDS
+        }
+        columns = {field: np.full(len(store), np.nan) for field in self.RANGE_FIELDS}
+
+        for field in self.KEYWORD_FIELDS:
+            codes = store.column(field)
+            present = np.flatnonzero(codes != store.MISSING)
+            # Group rows by code; the stable sort keeps each group's rows ascending
+            order = present[np.argsort(codes[present], kind="stable")]
+            boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+            dictionary = store.dictionary(field)
+            for rows in np.split(order, boundaries):
+                if len(rows):
+                    values[field].setdefault(dictionary[codes[rows[0]]], []).append(
+                        first_row + rows
+                    )
+
+        for field in self.RANGE_FIELDS:
+            column = store.column(field)
+            present = column != store.MISSING
+            if field in store.STRING_FIELDS:
+                numbers = np.array(
+                    [self._to_number(value) for value in store.dictionary(field)],
+                    dtype=np.float64,
+                )
+                columns[field][present] = numbers[column[present]]
+            else:
+                columns[field][present] = column[present]
+
+        # Metadata that did not fit the columns is indexed row by row
+        for row, _, metadata_extra in store.extras():
+            for field in self.KEYWORD_FIELDS:
+                value = metadata_extra.get(field)
+                if value is not None:
+                    values[field].setdefault(value, []).append(
+                        np.array([first_row + row], dtype=np.int64)
+                    )
+            for field in self.RANGE_FIELDS:
+                value = metadata_extra.get(field)
+                if value is not None:
+                    columns[field][row] = self._to_number(value)
+
+        with self._lock:
+            for field, column in columns.items():
+                self._columns[field].append(column)
+            for field, field_values in values.items():
+                for value, row_chunks in field_values.items():
+                    rows = np.concatenate(row_chunks).astype(np.int64)
+                    if len(row_chunks) > 1:
+                        rows.sort()
+                    self._postings[field].setdefault(value, []).append(rows)
+            self.size += len(store)
+
+    def append(self, other: "MetadataIndex") -> None:
+        """Append every row of another index, e.g. one built for a batch first"""
+        first_row = self.size
+        columns = {field: other._column(field) for field in self.RANGE_FIELDS}
+        postings = {
+            field: {
+                value: other._posting(field, value) + first_row
+                for value in list(field_values)
+            }
+            for field, field_values in other._postings.items()
+        }
+        with self._lock:
+            for field, column in columns.items():
+                self._columns[field].append(column)
+            for field, field_values in postings.items():
+                for value, rows in field_values.items():
+                    self._postings[field].setdefault(value, []).append(rows)
+            self.size += other.size
+
+    def set_references(self, references: Dict[Any, np.ndarray]) -> None:
+        """Rows a doc_id condition matches besides that doc_id's own rows"""
+        self._references = references
+
+    def select(self, keep_mask: np.ndarray) -> "MetadataIndex":
+        """A new index over the kept rows, renumbered; this index is unchanged"""
+        index = MetadataIndex()
+        new_rows = np.cumsum(keep_mask) - 1
+
+        for field, field_values in self._postings.items():
+            for value in list(field_values):
+                rows = self._posting(field, value)
+                rows = new_rows[rows[keep_mask[rows]]]
+                if len(rows):
+                    index._postings[field][value] = [rows]
+
+        for value, rows in self._references.items():
+            rows = new_rows[rows[keep_mask[rows]]]
+            if len(rows):
+                index._references[value] = rows
+
+        for field in self.RANGE_FIELDS:
+            index._columns[field] = [self._column(field)[keep_mask]]
+        index.size = int(keep_mask.sum())
+        return index
+
+    def rows(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Sorted row ids matching every filter condition"""
+        keyword_filters = {}
+        range_filters = {}
+        for field, condition in filters.items():
+            if field in self.KEYWORD_FIELDS:
+                keyword_filters[field] = condition
+            elif field in self.RANGE_FIELDS:
+                range_filters[field] = condition
+            else:
+                raise ValueError(f"Unsupported filter field: {field}")
+
+        # Keyword conditions narrow the rows first, smallest posting list first
+        candidates: Optional[np.ndarray] = None
+        keyword_rows = sorted(
+            (self._keyword_rows(field, condition) for field, condition in keyword_filters.items()),
+            key=len,
+        )
+        for rows in keyword_rows:
+            candidates = (
+                rows
+                if candidates is None
+                else np.intersect1d(candidates, rows, assume_unique=True)
+            )
+
+        # Range conditions are then checked only on the surviving rows
+        for field, condition in range_filters.items():
+            column = self._column(field)
+            if candidates is None:
+                candidates = np.flatnonzero(self._range_mask(column, condition))
+            else:
+                candidates = candidates[self._range_mask(column[candidates], condition)]
+
+        if candidates is None:
+            return np.arange(self.size)
+        return candidates
+
+    def _keyword_rows(self, field: str, condition: Any) -> np.ndarray:
+        if isinstance(condition, dict):
+            raise ValueError(f"Range conditions are not supported for {field}")
+        values = condition if isinstance(condition, list) else [condition]
+        postings = [
+            self._posting(field, value)
+            for value in values
+            if value in self._postings[field]
+        ]
+        if field == "doc_id":
+            references = self._references
+            postings += [references[value] for value in values if value in references]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        if len(postings) == 1:
+            return postings[0]
+        return np.unique(np.concatenate(postings))
+
+    def _range_mask(self, column: np.ndarray, condition: Any) -> np.ndarray:
+        if isinstance(condition, list):
+            return np.isin(column, [self._to_number(value) for value in condition])
+        if not isinstance(condition, dict):
+            return column == self._to_number(condition)
+
+        unknown = set(condition) - set(self.RANGE_OPERATORS)
+        if unknown:
+            raise ValueError(f"Unsupported range operators: {sorted(unknown)}")
+
+        # Comparisons with NaN are False, so rows missing the field never match
+        mask = np.ones(len(column), dtype=bool)
+        if "gt" in condition:
+            mask &= column > self._to_number(condition["gt"])
+        if "gte" in condition:
+            mask &= column >= self._to_number(condition["gte"])
+        if "lt" in condition:
+            mask &= column < self._to_number(condition["lt"])
+        if "lte" in condition:
+            mask &= column <= self._to_number(condition["lte"])
+        return mask
+
+    def _posting(self, field: str, value: Any) -> np.ndarray:
+        chunks = self._postings[field][value]
+        if len(chunks) > 1:
+            with self._lock:
+                chunks[:] = [np.concatenate(chunks)]
+        return chunks[0]
+
+    def _column(self, field: str) -> np.ndarray:
+        chunks = self._columns[field]
+        if not chunks:
+            return np.empty(0)
+        if len(chunks) > 1:
+            with self._lock:
+                chunks[:] = [np.concatenate(chunks)]
+        return chunks[0]
+
+    @staticmethod
+    def _to_number(value: Any) -> float:
+        """Numbers stay as they are; ISO timestamps become epoch seconds.
+
+        Anything else is NaN, so it stays out of range matches instead of
+        failing the add; the raw value is kept with the document.
+        """
+        try:
+            if isinstance(value, datetime):
+                return value.timestamp()
+            if isinstance(value, str):
+                try:
+                    return float(value)
+                except ValueError:
+                    return datetime.fromisoformat(value).timestamp()
+            return float(value)
+        except (TypeError, ValueError, OverflowError):
+            return np.nan
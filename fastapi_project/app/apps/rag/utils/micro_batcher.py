@@ -0,0 +1,193 @@
+# app/apps/rag/utils/micro_batcher.py
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class _Request:
+    __slots__ = ("items", "future", "submitted_at")
+
+    def __init__(self, items: List[Any]):
+        self.items = items
+        self.future: Future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Coalesces concurrent requests into batches processed by one call each.
+
+    Requests queue until one of max_concurrency workers is free. A batch
+    then takes the oldest request plus whatever else arrives within
+    max_wait seconds of it, up to max_batch_size items; under load the
+    queue already holds enough to fill a batch without waiting. process()
+    gets the concatenated items and returns one result per item (a list
+    or an array); each request's future receives its own slice. Requests
+    larger than max_batch_size are processed on their own. When process()
+    raises, the batch is split in halves and each half processed again, so
+    only the requests that fail on their own receive the exception.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        max_concurrency: int = 1,
+        name: str = "micro-batcher",
+    ):
+        self.process = process
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.max_concurrency = max(1, max_concurrency)
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._slots = threading.Semaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix=name
+        )
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        self._queued = 0
+        self._max_queue_depth = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._batches = 0
+        self._batched_items = 0
+        self._wait_seconds = 0.0
+        self._process_seconds = 0.0
+        # Upper bound (a power of two) -> batches with (bound / 2, bound] items
+        self._batch_sizes: Dict[int, int] = {}
+
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, name=f"{name}-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+
+    def submit(self, items: List[Any]) -> Future:
+        """Queue items for processing; the future resolves to their results"""
+        request = _Request(items)
+        with self._stats_lock:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed micro-batcher")
+            self._queued += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queued)
+            # Queued under the lock, so nothing lands behind close()'s sentinel
+            self._queue.put(request)
+        return request.future
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, batch sizes and timings"""
+        with self._stats_lock:
+            finished = self._completed + self._failed
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": 1000 * self.max_wait,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "max_queue_depth": self._max_queue_depth,
+                "completed": self._completed,
+                "failed": self._failed,
+                "batches": self._batches,
+                "avg_batch_size": self._batched_items / self._batches
+                if self._batches
+                else None,
+                "batch_size_histogram": {
+                    str(bound): count for bound, count in sorted(self._batch_sizes.items())
+                },
+                "avg_wait_ms": 1000 * self._wait_seconds / finished if finished else None,
+                "avg_process_ms": 1000 * self._process_seconds / self._batches
+                if self._batches
+                else None,
+            }
+
+    def close(self) -> None:
+        """Process what is queued, then stop; later submits raise RuntimeError"""
+        with self._stats_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def _dispatch_loop(self) -> None:
+        held: Optional[_Request] = None
+        stopping = False
+        while True:
+            request = held if held is not None else self._queue.get()
+            held = None
+            if request is None:
+                return
+
+            # Requests keep queueing while every worker is busy
+            self._slots.acquire()
+            batch = [request]
+            size = len(request.items)
+            deadline = request.submitted_at + self.max_wait
+            while size < self.max_batch_size:
+                try:
+                    following = self._queue.get(
+                        timeout=max(0.0, deadline - time.perf_counter())
+                    )
+                except queue.Empty:
+                    break
+                if following is None:
+                    stopping = True
+                    break
+                if size + len(following.items) > self.max_batch_size:
+                    # Starts the next batch
+                    held = following
+                    break
+                batch.append(following)
+                size += len(following.items)
+            self._executor.submit(self._run, batch)
+            if stopping:
+                return
+
+    def _run(self, batch: List[_Request]) -> None:
+        started = time.perf_counter()
+        with self._stats_lock:
+            self._queued -= len(batch)
+        # Requests cancelled while queued are dropped from the batch
+        batch = [
+            request for request in batch if request.future.set_running_or_notify_cancel()
+        ]
+        size = sum(len(request.items) for request in batch)
+        with self._stats_lock:
+            self._running += 1
+            self._wait_seconds += sum(started - request.submitted_at for request in batch)
+            self._batches += 1
+            self._batched_items += size
+            bound = 1 << max(0, size - 1).bit_length()
+            self._batch_sizes[bound] = self._batch_sizes.get(bound, 0) + 1
+
+        failed = len(batch)
+        try:
+            failed = self._process(batch) if batch else 0
+        finally:
+            self._slots.release()
+            with self._stats_lock:
+                self._running -= 1
+                self._process_seconds += time.perf_counter() - started
+                self._failed += failed
+                self._completed += len(batch) - failed
+
+    def _process(self, batch: List[_Request]) -> int:
+        """Resolve the requests' futures; returns how many failed"""
+        try:
+            results = self.process([item for request in batch for item in request.items])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].future.set_exception(e)
+                return 1
+            # One bad request must not fail the others batched with it
+            middle = len(batch) // 2
+            return self._process(batch[:middle]) + self._process(batch[middle:])
+        offset = 0
+        for request in batch:
+            request.future.set_result(results[offset : offset + len(request.items)])
+            offset += len(request.items)
+        return 0
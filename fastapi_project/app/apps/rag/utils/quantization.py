@@ -0,0 +1,252 @@
+# app/apps/rag/utils/quantization.py
+import copy
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+import numpy as np
+
+from .buffers import GrowableArray
+
+
+class Quantizer(ABC):
+    """Compact codes for the rows of a vector store.
+
+    Codes are only used to shortlist candidates cheaply; the vector store
+    re-ranks the shortlist against the full-precision embeddings.
+    Subclasses implement training, encoding and asymmetric scoring.
+    """
+
+    name = ""
+    # Rows scored per block, to bound the float temporaries built from codes
+    SCORE_BLOCK_SIZE = 65536
+    # Rows sampled for training
+    MAX_TRAIN_SAMPLES = 65536
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        # Identifies the parameters that persisted codes were produced with
+        self.version: Optional[str] = None
+        self.trained_size = 0
+        self._codes: Optional[GrowableArray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.version is not None
+
+    @property
+    def codes(self) -> Optional[np.ndarray]:
+        """Codes of every row, once trained"""
+        return self._codes.view if self._codes is not None else None
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.codes.shape[1] * self.codes.itemsize if self.codes is not None else 0
+
+    def train(self, embeddings: np.ndarray) -> None:
+        """Fit the quantizer on a sample of rows and encode every row"""
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(embeddings), self.MAX_TRAIN_SAMPLES)
+        sample = np.asarray(
+            embeddings[np.sort(rng.choice(len(embeddings), sample_size, replace=False))],
+            dtype=np.float32,
+        )
+        self._fit(sample, rng)
+        self.version = uuid.uuid4().hex
+        self.trained_size = len(embeddings)
+        self.reset(self.encode(embeddings))
+
+    def load(self, state: Dict[str, np.ndarray], version: str, trained_size: int) -> None:
+        """Restore persisted parameters; codes are set with reset()"""
+        self._set_state(state)
+        self.version = version
+        self.trained_size = trained_size
+
+    def add(self, codes: np.ndarray) -> None:
+        """Append codes for rows added at the end of the store"""
+        if self._codes is None:
+            self._codes = GrowableArray(codes)
+        else:
+            self._codes.append(codes)
+
+    def select(self, keep_mask: np.ndarray) -> "Quantizer":
+        """A copy holding only the kept rows, in order; this quantizer is unchanged"""
+        quantizer = copy.copy(self)
+        quantizer.reset(self.codes[keep_mask])
+        return quantizer
+
+    def reset(self, codes: np.ndarray) -> None:
+        """Replace all row codes"""
+        self._codes = GrowableArray(codes)
+
+    def score(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate (queries x rows) dot products; all rows when rows is None"""
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), self.SCORE_BLOCK_SIZE):
+            # A block spanning mapped and appended codes is copied on its own
+            block = np.asarray(codes[start : start + self.SCORE_BLOCK_SIZE])
+            scores[:, start : start + len(block)] = self._score_codes(queries, block)
+        return scores
+
+    @abstractmethod
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """Codes of the rows of embeddings"""
+
+    @abstractmethod
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Approximate embeddings the codes stand for"""
+
+    @abstractmethod
+    def state(self) -> Dict[str, np.ndarray]:
+        """Trained parameters, as persisted with the store"""
+
+    @abstractmethod
+    def _set_state(self, state: Dict[str, np.ndarray]) -> None:
+        """Restore parameters returned by state()"""
+
+    @abstractmethod
+    def _fit(self, sample: np.ndarray, rng: np.random.Generator) -> None:
+        """Fit the parameters on a sample of rows"""
+
+    @abstractmethod
+    def _score_codes(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate (queries x codes) dot products"""
+
+
+class ScalarQuantizer(Quantizer):
+    """Per-dimension int8 scalar quantization (4x smaller than float32)"""
+
+    name = "int8"
+
+    def __init__(self, seed: int = 0):
+        super().__init__(seed)
+        self.scale: Optional[np.ndarray] = None
+        self.offset: Optional[np.ndarray] = None
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(embeddings, dtype=np.float32) - self.offset) / self.scale)
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"scale": self.scale, "offset": self.offset}
+
+    def _set_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.scale = np.asarray(state["scale"], dtype=np.float32)
+        self.offset = np.asarray(state["offset"], dtype=np.float32)
+
+    def _fit(self, sample: np.ndarray, rng: np.random.Generator) -> None:
+        low = sample.min(axis=0)
+        high = sample.max(axis=0)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1e-8
+        self.scale = scale.astype(np.float32)
+        # Code -128 maps to the per-dimension minimum
+        self.offset = (low + 128.0 * scale).astype(np.float32)
+
+    def _score_codes(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # q . (c * scale + offset) == (q * scale) . c + q . offset
+        return (queries * self.scale) @ codes.T.astype(np.float32) + (
+            queries @ self.offset
+        )[:, None]
+
+
+class ProductQuantizer(Quantizer):
+    """Product quantization with 256 centroids per subspace (uint8 codes).
+
+    With the default of 4 dimensions per subspace a float32 vector shrinks 16x.
+    """
+
+    name = "pq"
+
+    def __init__(
+        self,
+        n_subspaces: Optional[int] = None,
+        dims_per_subspace: int = 4,
+        train_iterations: int = 15,
+        seed: int = 0,
+    ):
+        super().__init__(seed)
+        self.n_subspaces = n_subspaces
+        self.dims_per_subspace = dims_per_subspace
+        self.train_iterations = train_iterations
+        # (n_subspaces, 256, sub_dim)
+        self.codebooks: Optional[np.ndarray] = None
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        subvectors = self._split(np.asarray(embeddings, dtype=np.float32))
+        codes = np.empty((len(embeddings), len(self.codebooks)), dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            codes[:, j] = _nearest_centroid(subvectors[:, j], codebook)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        subspaces = np.arange(len(self.codebooks))
+        return self.codebooks[subspaces, codes].reshape(len(codes), -1)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+    def _set_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.codebooks = np.asarray(state["codebooks"], dtype=np.float32)
+        self.n_subspaces = len(self.codebooks)
+
+    def _fit(self, sample: np.ndarray, rng: np.random.Generator) -> None:
+        dim = sample.shape[1]
+        n_subspaces = self.n_subspaces or max(1, dim // self.dims_per_subspace)
+        if dim % n_subspaces:
+            raise ValueError(
+                f"Embedding dimension {dim} is not divisible into {n_subspaces} subspaces"
+            )
+        self.n_subspaces = n_subspaces
+
+        subvectors = sample.reshape(len(sample), n_subspaces, -1)
+        self.codebooks = np.stack(
+            [
+                _kmeans(subvectors[:, j], 256, self.train_iterations, rng)
+                for j in range(n_subspaces)
+            ]
+        )
+
+    def _score_codes(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # Asymmetric distance: one (subspace x centroid) lookup table per query
+        tables = np.einsum("qmd,mkd->qmk", self._split(queries), self.codebooks)
+        flat_codes = codes.astype(np.intp) + 256 * np.arange(codes.shape[1])
+        return np.stack([table.ravel()[flat_codes].sum(axis=1) for table in tables])
+
+    def _split(self, embeddings: np.ndarray) -> np.ndarray:
+        return embeddings.reshape(len(embeddings), len(self.codebooks), -1)
+
+
+QUANTIZERS = {
+    ScalarQuantizer.name: ScalarQuantizer,
+    ProductQuantizer.name: ProductQuantizer,
+}
+
+
+def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||v - c||^2 == argmax (v . c - ||c||^2 / 2)
+    return np.argmax(vectors @ centroids.T - 0.5 * (centroids**2).sum(axis=1), axis=1)
+
+
+def _kmeans(
+    vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Euclidean k-means; returns k centroids even when there are fewer points"""
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=len(vectors) < k)].copy()
+    for _ in range(iterations):
+        labels = _nearest_centroid(vectors, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), size=len(empty))]
+    return centroids.astype(np.float32)
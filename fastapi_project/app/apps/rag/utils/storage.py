@@ -0,0 +1,334 @@
+# app/apps/rag/utils/storage.py
+import os
+import shutil
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud import storage
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; writes are then only locked per process
+    fcntl = None
+
+
+class ObjectNotFound(KeyError):
+    """The requested key does not exist"""
+
+
+class PreconditionFailed(Exception):
+    """A conditional write found a different generation than expected"""
+
+
+class ObjectStore(ABC):
+    """Flat key -> bytes storage behind the vector store and document service.
+
+    Every write gives the object a new integer generation. Conditional writes
+    pass if_generation_match: the write only happens if the object currently
+    has that generation, with 0 meaning "must not exist yet"; otherwise
+    PreconditionFailed is raised. Range reads take a [start, end) byte range.
+    """
+
+    # Whether large objects are worth moving as shards over several
+    # connections (see ShardedTransfer); not for local files
+    PARALLEL_TRANSFERS = False
+
+    @abstractmethod
+    def get(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        """Object contents, or bytes [start, end) of them"""
+
+    @abstractmethod
+    def generation(self, key: str) -> Optional[int]:
+        """Current generation of an object, None if it does not exist"""
+
+    @abstractmethod
+    def put(
+        self,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+        if_generation_match: Optional[int] = None,
+    ) -> int:
+        """Write an object and return its new generation"""
+
+    def compose(
+        self, key: str, source_keys: List[str], content_type: Optional[str] = None
+    ) -> int:
+        """Write the concatenation of source objects to key; returns its generation"""
+        return self.put(
+            key, b"".join(self.get(source_key) for source_key in source_keys), content_type
+        )
+
+    def exists(self, key: str) -> bool:
+        return self.generation(key) is not None
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """Delete an object; False if it did not exist"""
+
+    @abstractmethod
+    def list(self, prefix: str = "") -> List[str]:
+        """Sorted keys starting with prefix"""
+
+    def download_to_filename(self, key: str, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.get(key))
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Local file holding the object, for backends that keep one.
+
+        None if the backend keeps no local files or the object does not exist.
+
+        The file may be memory-mapped; objects are replaced by rename, so a
+        mapping keeps seeing the contents it was opened with.
+        """
+        return None
+
+
+class GCSObjectStore(ObjectStore):
+    """Objects in a Google Cloud Storage bucket"""
+
+    PARALLEL_TRANSFERS = True
+    # Most source objects a single compose request accepts
+    COMPOSE_LIMIT = 32
+
+    def __init__(self, bucket_name: str, project_id: str):
+        self.bucket_name = bucket_name
+        self.storage_client = storage.Client(project=project_id)
+        self.bucket = self.storage_client.bucket(bucket_name)
+
+    def get(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        if end is not None and end <= (start or 0):
+            return b""
+        try:
+            # GCS byte ranges include their end
+            return self.bucket.blob(key).download_as_bytes(
+                start=start, end=end - 1 if end is not None else None
+            )
+        except google_exceptions.NotFound:
+            raise ObjectNotFound(key)
+
+    def generation(self, key: str) -> Optional[int]:
+        blob = self.bucket.get_blob(key)
+        return blob.generation if blob is not None else None
+
+    def put(
+        self,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+        if_generation_match: Optional[int] = None,
+    ) -> int:
+        blob = self.bucket.blob(key)
+        # Metadata must be set before uploading
+        blob.metadata = metadata
+        try:
+            blob.upload_from_string(
+                data, content_type=content_type, if_generation_match=if_generation_match
+            )
+        except google_exceptions.PreconditionFailed:
+            raise PreconditionFailed(key)
+        return blob.generation
+
+    def compose(
+        self, key: str, source_keys: List[str], content_type: Optional[str] = None
+    ) -> int:
+        sources = [self.bucket.blob(source_key) for source_key in source_keys]
+        intermediates = []
+        try:
+            # Beyond the per-request limit, compose groups first and then the groups
+            while len(sources) > self.COMPOSE_LIMIT:
+                groups = []
+                for start in range(0, len(sources), self.COMPOSE_LIMIT):
+                    group = sources[start : start + self.COMPOSE_LIMIT]
+                    if len(group) == 1:
+                        groups.append(group[0])
+                        continue
+                    intermediate = self.bucket.blob(f"{key}.compose-{uuid.uuid4().hex[:8]}")
+                    intermediate.compose(group)
+                    intermediates.append(intermediate)
+                    groups.append(intermediate)
+                sources = groups
+            blob = self.bucket.blob(key)
+            blob.content_type = content_type
+            blob.compose(sources)
+            return blob.generation
+        finally:
+            for intermediate in intermediates:
+                self.delete(intermediate.name)
+
+    def delete(self, key: str) -> bool:
+        try:
+            self.bucket.blob(key).delete()
+            return True
+        except google_exceptions.NotFound:
+            return False
+
+    def list(self, prefix: str = "") -> List[str]:
+        return sorted(
+            blob.name
+            for blob in self.storage_client.list_blobs(self.bucket_name, prefix=prefix)
+        )
+
+    def download_to_filename(self, key: str, path: str) -> None:
+        try:
+            self.bucket.blob(key).download_to_filename(path)
+        except google_exceptions.NotFound:
+            raise ObjectNotFound(key)
+
+
+class LocalObjectStore(ObjectStore):
+    """Objects as files under a local directory, for offline runs and load tests.
+
+    Writes go to a temporary file that is renamed into place, so readers
+    never see a partial object. The generation is the file's modification
+    time in nanoseconds, bumped when two writes land on the same tick.
+    Content types and custom metadata are not kept.
+    """
+
+    TMP_SUFFIX = ".tmp"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        # Conditional writes check and replace under this lock (and a file
+        # lock shared with other processes using the same root)
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(self.root, ".lock")
+
+    def get(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        try:
+            with open(self._path(key), "rb") as f:
+                if start:
+                    f.seek(start)
+                if end is None:
+                    return f.read()
+                return f.read(max(0, end - (start or 0)))
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def generation(self, key: str) -> Optional[int]:
+        try:
+            return os.stat(self._path(key)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def put(
+        self,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+        if_generation_match: Optional[int] = None,
+    ) -> int:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}{self.TMP_SUFFIX}"
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        try:
+            with self._locked():
+                current = self.generation(key)
+                if if_generation_match is not None and (current or 0) != if_generation_match:
+                    raise PreconditionFailed(key)
+                os.replace(tmp_path, path)
+                generation = os.stat(path).st_mtime_ns
+                if current is not None and generation <= current:
+                    # Coarse clocks: keep generations strictly increasing
+                    generation = current + 1
+                    os.utime(path, ns=(generation, generation))
+                return generation
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, key: str) -> bool:
+        try:
+            with self._locked():
+                os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self, prefix: str = "") -> List[str]:
+        keys = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith((self.TMP_SUFFIX, ".lock")):
+                    continue
+                key = os.path.relpath(os.path.join(directory, filename), self.root)
+                key = key.replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def download_to_filename(self, key: str, path: str) -> None:
+        try:
+            shutil.copyfile(self._path(key), path)
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        # Missing objects have no local file, as with any backend
+        return path if os.path.exists(path) else None
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Key escapes the storage root: {key}")
+        return path
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock, file_lock(self._lock_path):
+            yield
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Exclusive lock shared by every process (and thread) opening the same path"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def create_chunk_cache_store(
+    enabled: bool, local_dir: Optional[str], object_store: ObjectStore
+) -> Optional[ObjectStore]:
+    """Where chunk embeddings are cached: a local directory if given, else object_store"""
+    if not enabled:
+        return None
+    return LocalObjectStore(local_dir) if local_dir else object_store
+
+
+def create_object_store(
+    backend: str,
+    bucket_name: Optional[str] = None,
+    project_id: Optional[str] = None,
+    local_root: Optional[str] = None,
+) -> ObjectStore:
+    """The configured storage backend: "gcs" or "local" """
+    if backend == "gcs":
+        return GCSObjectStore(bucket_name, project_id)
+    if backend == "local":
+        if not local_root:
+            raise ValueError("The local storage backend needs a root directory")
+        return LocalObjectStore(local_root)
+    raise ValueError(f"Unsupported storage backend: {backend}")
@@ -0,0 +1,177 @@
+# app/apps/rag/utils/transfer.py
+import logging
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .storage import ObjectStore
+
+logger = logging.getLogger(__name__)
+
+
+class CorruptTransfer(ValueError):
+    """A shard still failed its checksum after every attempt"""
+
+
+class ShardedTransfer:
+    """Moves large objects as fixed-size shards over a thread pool.
+
+    Uploads write each shard as its own object and compose them into the
+    target key; downloads fetch the shards' byte ranges concurrently. The
+    CRC32 of every shard is computed at upload time and returned, for the
+    caller to keep next to the key (e.g. in a segment entry) and pass back
+    on download, where each shard is verified. Failed shards are retried on
+    their own, and a download into a file skips the shards an interrupted
+    attempt already wrote. Objects up to shard_size go through a single put.
+    """
+
+    def __init__(
+        self,
+        shard_size: int = 32 * 1024 * 1024,
+        max_workers: int = 8,
+        max_attempts: int = 3,
+    ):
+        self.shard_size = max(1, shard_size)
+        self.max_workers = max(1, max_workers)
+        self.max_attempts = max(1, max_attempts)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def upload(
+        self,
+        object_store: ObjectStore,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Write an object; returns its shard layout, or None if it went in one piece"""
+        if len(data) <= self.shard_size or not object_store.PARALLEL_TRANSFERS:
+            object_store.put(key, data, content_type=content_type)
+            return None
+
+        started = time.perf_counter()
+        view = memoryview(data)
+        ranges = self._ranges(len(data))
+        # Fixed names, so a retried upload of the same key overwrites its shards
+        shard_keys = [f"{key}.shard-{i:05d}" for i in range(len(ranges))]
+
+        def put_shard(i: int) -> int:
+            start, end = ranges[i]
+            shard = bytes(view[start:end])
+            self._attempt(
+                lambda: object_store.put(shard_keys[i], shard, content_type=content_type)
+            )
+            return zlib.crc32(shard)
+
+        try:
+            checksums = self._map(put_shard, range(len(ranges)))
+            object_store.compose(key, shard_keys, content_type=content_type)
+        finally:
+            self._map(object_store.delete, shard_keys)
+
+        self._log("Uploaded", key, len(data), len(ranges), started)
+        return {"shard_size": self.shard_size, "length": len(data), "crc32": checksums}
+
+    def download(
+        self, object_store: ObjectStore, key: str, shards: Dict[str, Any]
+    ) -> bytearray:
+        """Object contents, fetched shard by shard and verified"""
+        started = time.perf_counter()
+        buffer = bytearray(shards["length"])
+        view = memoryview(buffer)
+
+        def fetch(i: int) -> None:
+            start, end = self._shard_range(shards, i)
+            view[start:end] = self._get_shard(object_store, key, shards, i)
+
+        self._map(fetch, range(len(shards["crc32"])))
+        self._log("Downloaded", key, len(buffer), len(shards["crc32"]), started)
+        return buffer
+
+    def download_to_filename(
+        self, object_store: ObjectStore, key: str, shards: Dict[str, Any], path: str
+    ) -> None:
+        """Download into path, resuming from what an earlier attempt left behind.
+
+        Shards are written in place into path.partial, which is only renamed
+        to path once every shard is verified; shards already in it with a
+        matching checksum are not fetched again.
+        """
+        started = time.perf_counter()
+        partial_path = f"{path}.partial"
+        with open(partial_path, "ab") as f:
+            f.truncate(shards["length"])
+        buffer = np.memmap(partial_path, dtype=np.uint8, mode="r+", shape=(shards["length"],))
+
+        def fetch(i: int) -> bool:
+            start, end = self._shard_range(shards, i)
+            if zlib.crc32(buffer[start:end]) == shards["crc32"][i]:
+                return False
+            buffer[start:end] = np.frombuffer(
+                self._get_shard(object_store, key, shards, i), dtype=np.uint8
+            )
+            return True
+
+        try:
+            fetched = sum(self._map(fetch, range(len(shards["crc32"]))))
+            buffer.flush()
+        finally:
+            del buffer
+        os.replace(partial_path, path)
+        self._log("Downloaded", key, shards["length"], fetched, started)
+
+    def _get_shard(
+        self, object_store: ObjectStore, key: str, shards: Dict[str, Any], i: int
+    ) -> bytes:
+        start, end = self._shard_range(shards, i)
+
+        def get() -> bytes:
+            data = object_store.get(key, start, end)
+            if len(data) != end - start or zlib.crc32(data) != shards["crc32"][i]:
+                raise CorruptTransfer(f"Shard {i} of {key} is truncated or corrupt")
+            return data
+
+        return self._attempt(get)
+
+    def _attempt(self, operation: Callable[[], Any]) -> Any:
+        """Run one shard's transfer, retrying it alone on failure"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return operation()
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    raise
+                logger.warning(f"Shard transfer failed (attempt {attempt}), retrying: {e}")
+                time.sleep(0.1 * 2**attempt)
+
+    def _map(self, function: Callable[[Any], Any], items) -> List[Any]:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="sharded-transfer"
+                )
+        return list(self._executor.map(function, items))
+
+    def _ranges(self, length: int) -> List[Tuple[int, int]]:
+        return [
+            (start, min(start + self.shard_size, length))
+            for start in range(0, length, self.shard_size)
+        ]
+
+    @staticmethod
+    def _shard_range(shards: Dict[str, Any], i: int) -> Tuple[int, int]:
+        start = i * shards["shard_size"]
+        return start, min(start + shards["shard_size"], shards["length"])
+
+    @staticmethod
+    def _log(action: str, key: str, length: int, shard_count: int, started: float) -> None:
+        seconds = time.perf_counter() - started
+        logger.info(
+            f"{action} {key} ({length / 2**20:.1f} MB, {shard_count} shards) "
+            f"in {seconds:.2f} s ({length / 2**20 / max(seconds, 1e-9):.1f} MB/s)"
+        )
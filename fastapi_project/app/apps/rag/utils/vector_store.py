@@ -1,154 +1,2557 @@
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 import json
 import io
-from google.cloud import storage
+import os
+import threading
+import time
+import uuid
 import logging
+from .ann_index import IVFIndex
+from .buffers import GrowableArray
+from .document_store import DocumentStore
+from .fingerprints import FingerprintIndex
+from .journal import Journal
+from .lexical_index import LexicalIndex
+from .metadata_index import MetadataIndex
+from .quantization import QUANTIZERS, Quantizer
+from .storage import (
+    GCSObjectStore,
+    LocalObjectStore,
+    ObjectNotFound,
+    ObjectStore,
+    PreconditionFailed,
+    file_lock,
+)
+from .transfer import ShardedTransfer
 
 logger = logging.getLogger(__name__)
 
 
+class StoreSnapshot:
+    """Immutable searchable state of a CloudVectorStore.
+
+    Writers never change anything a published snapshot can see: rows are
+    only appended past its size, and deletes, training and compaction build
+    new arrays and objects. Searches therefore run without taking a lock.
+    """
+
+    def __init__(
+        self,
+        documents: DocumentStore,
+        embeddings: np.ndarray,
+        deleted: np.ndarray,
+        deleted_count: int,
+        metadata_index: MetadataIndex,
+        lexical_index: LexicalIndex,
+        fingerprint_index: FingerprintIndex,
+        index: Optional[IVFIndex],
+        quantizer: Optional[Quantizer],
+    ):
+        self.documents = documents
+        self.embeddings = embeddings
+        self.deleted = deleted
+        self.deleted_count = deleted_count
+        self.metadata_index = metadata_index
+        self.lexical_index = lexical_index
+        self.fingerprint_index = fingerprint_index
+        self.index = index
+        self.quantizer = quantizer
+
+    @property
+    def size(self) -> int:
+        return len(self.embeddings)
+
+    def replace(self, **changes) -> "StoreSnapshot":
+        fields = dict(vars(self))
+        fields.update(changes)
+        return StoreSnapshot(**fields)
+
+    def clip(self, rows: np.ndarray) -> np.ndarray:
+        """Drop sorted row ids appended after this snapshot was taken"""
+        return rows[: np.searchsorted(rows, self.size)]
+
+
 class CloudVectorStore:
+    # Maximum number of queries scored together in one matrix-matrix product
+    SEARCH_BLOCK_SIZE = 256
+    MANIFEST_VERSION = 1
+    # Conditional manifest writes re-applied on top of other instances' writes
+    MANIFEST_WRITE_ATTEMPTS = 5
+    # Loads retried when a concurrent compaction deletes the segments read
+    LOAD_ATTEMPTS = 3
+    # Segment documents as a DocumentStore block file; segments without it are JSON
+    METADATA_FORMAT = "columnar"
+    # Retrain IVF centroids and quantizers once the corpus outgrows their
+    # training size this much
+    RETRAIN_GROWTH = 4
+    # Rows taken from each ranking before hybrid search fuses them
+    HYBRID_CANDIDATES = 50
+    # Reciprocal rank fusion constant; larger values flatten the rank weights
+    RRF_K = 60
+    # Candidates per requested result that MMR diversification chooses from
+    MMR_CANDIDATE_FACTOR = 4
+
     def __init__(
         self,
         bucket_name: str,
         project_id: str,
         key_prefix: str = "embeddings/",
+        max_segments: int = 8,
+        max_tombstone_ratio: float = 0.2,
+        local_cache_dir: Optional[str] = None,
+        index_type: str = "flat",
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        min_index_size: int = 10000,
+        quantization: Optional[str] = None,
+        rerank_factor: int = 4,
+        write_behind: bool = False,
+        flush_max_pending: int = 50,
+        flush_interval: float = 30.0,
+        journal_dir: Optional[str] = None,
+        object_store: Optional[ObjectStore] = None,
+        shared_dir: Optional[str] = None,
+        shared_poll_interval: float = 2.0,
+        refresh_interval: Optional[float] = None,
+        transfer_shard_size: int = 32 * 1024 * 1024,
+        transfer_workers: int = 8,
     ):
-        self.documents = []
-        self.embeddings = np.array([])
+        # Embeddings are kept as a contiguous, L2-normalized float32 matrix so
+        # that cosine similarity reduces to a single matrix-vector product.
+        # The matrix lives in a growable buffer so adds append in place.
+        self._embedding_buffer = GrowableArray(np.empty((0, 0), dtype=np.float32))
+        # Deleted rows are only flagged; search skips them and compaction
+        # drops them once they exceed max_tombstone_ratio of the rows.
+        self._deleted_buffer = GrowableArray(np.zeros(0, dtype=bool))
+        self.max_tombstone_ratio = max_tombstone_ratio
+        # doc_id -> [(start, end)] row ranges, for O(1) lookup on delete
+        self.doc_rows: Dict[str, List[Tuple[int, int]]] = {}
         self.bucket_name = bucket_name
         self.project_id = project_id
         self.key_prefix = key_prefix
+        self.max_segments = max_segments
+        # Optional local snapshot directory; segment files found there are
+        # reused while their remote generation matches and memory-mapped.
+        self.local_cache_dir = local_cache_dir
+
+        # "flat" scans every row; "ivf" scans only the rows of the nprobe
+        # closest k-means clusters once the store holds min_index_size rows.
+        # Exact scanning stays available through search(..., exact=True).
+        if index_type not in ("flat", "ivf"):
+            raise ValueError(f"Unsupported index type: {index_type}")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_index_size = min_index_size
+
+        # Optional "int8" or "pq" codes: the scan runs over the compact codes
+        # and the best top_k * rerank_factor rows are re-scored at full
+        # precision. Keep the full-precision matrix memory-mapped through
+        # local_cache_dir so that only the codes stay resident.
+        if quantization is not None and quantization not in QUANTIZERS:
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        self.quantization = quantization
+        self.rerank_factor = max(1, rerank_factor)
 
-        # Initialize Google Cloud Storage client
-        self.storage_client = storage.Client(project=project_id)
-        self.bucket = self.storage_client.bucket(bucket_name)
+        # Searches read the current snapshot; writers publish a new one under
+        # _manifest_lock with a single attribute assignment
+        self._snapshot = self._empty_snapshot()
 
+        # Segments and manifests live in GCS unless another backend is given
+        self.object_store = object_store or GCSObjectStore(bucket_name, project_id)
+        # Segment files larger than transfer_shard_size are uploaded and
+        # downloaded as shards over transfer_workers connections; the shard
+        # checksums are kept in the segment entry
+        self.transfer = ShardedTransfer(transfer_shard_size, transfer_workers)
+
+        # Legacy single-file layout, still read when no manifest exists
         self.metadata_key = f"{key_prefix}metadata.json"
         self.embeddings_key = f"{key_prefix}embeddings.npy"
 
+        # Segmented layout: immutable segment files listed in a small manifest.
+        # Tombstones map a deleted doc_id to the sequence number at deletion
+        # time and hide that doc_id in every older segment.
+        self.manifest_key = f"{key_prefix}manifest.json"
+        self.segments_prefix = f"{key_prefix}segments/"
+        self.ivf_prefix = f"{key_prefix}ivf/"
+        self.quantizer_prefix = f"{key_prefix}quantizer/"
+        self.segments: List[Dict[str, Any]] = []
+        self.tombstones: Dict[str, int] = {}
+        self.next_seq = 1
+        # Chunks stored once for several documents, also kept in the manifest:
+        # owner doc_id -> {owner chunk_index: [[doc_id, chunk_index], ...]} of
+        # the documents whose identical chunk was not stored again. Deleting
+        # the owner moves a referenced chunk to its first remaining referrer.
+        self.references: Dict[str, Dict[str, List[List[Any]]]] = {}
+        self._manifest_lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        # One compaction at a time: two would both merge the same segments
+        self._compaction_lock = threading.Lock()
+        # Parameter versions referenced by the last manifest written
+        self._manifest_ivf_version: Optional[str] = None
+        self._manifest_quantizer_version: Optional[str] = None
+
+        # Changes not yet in cloud storage: rows from _flushed_rows on, plus
+        # tombstones for deleted doc_ids. Without write-behind every change
+        # is flushed right away; with it, changes are journaled locally and
+        # flushed together after flush_max_pending changes, flush_interval
+        # seconds or an explicit flush().
+        self.write_behind = write_behind
+        self.flush_max_pending = max(1, flush_max_pending)
+        self.flush_interval = flush_interval
+        self._flushed_rows = 0
+        self._pending_tombstones: Dict[str, None] = {}
+        self._pending_references: List[List[Any]] = []
+        self._pending_changes = 0
+        self._first_pending_at: Optional[float] = None
+        # Every instance journals to its own file, so worker processes on one
+        # host never truncate each other's records. Journals left behind by
+        # processes that exited before flushing are adopted on load, replayed
+        # and deleted once their changes are flushed.
+        self.journal: Optional[Journal] = None
+        self._adopted_journals: List[Journal] = []
+        if write_behind:
+            journal_root = journal_dir or local_cache_dir
+            if not journal_root:
+                raise ValueError("Write-behind persistence needs a journal_dir")
+            self.journal_dir = os.path.join(journal_root, key_prefix)
+            # Created and locked under the directory lock, so adoption never
+            # sees it unlocked
+            with file_lock(os.path.join(self.journal_dir, "journal.lock")):
+                self.journal = Journal(
+                    os.path.join(self.journal_dir, f"journal-{uuid.uuid4().hex}.log")
+                )
+                self.journal.acquire()
+        self._flush_wakeup = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+        self._closing = False
+        self._flush_count = 0
+        self._failed_flushes = 0
+        self._last_flush_seconds: Optional[float] = None
+        self._last_flush_at: Optional[float] = None
+
+        # Optional host-wide snapshot shared by worker processes (put it on a
+        # tmpfs such as /dev/shm): one process loads from cloud storage and
+        # writes the live rows there as a single segment, and every process
+        # memory-maps it instead of holding its own copy. Each publish bumps
+        # a generation counter; processes poll it every shared_poll_interval
+        # seconds and attach to newer snapshots, e.g. after another worker
+        # ingested documents. In-memory indexes are still built per process.
+        self.shared_store = LocalObjectStore(shared_dir) if shared_dir else None
+        self.shared_manifest_key = f"{key_prefix}shared.json"
+        self.shared_poll_interval = shared_poll_interval
+        # Manifest last written or loaded, and its storage generation
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._manifest_generation: Optional[int] = None
+        # Shared snapshot generation attached or published, and the file
+        # generation of the shared manifest last looked at
+        self._shared_generation: Optional[int] = None
+        self._shared_file_generation: Optional[int] = None
+        self._shared_capture: Optional[Dict[str, Any]] = None
+        self._publish_lock = threading.Lock()
+        self._publish_wakeup = threading.Event()
+        self._publish_thread: Optional[threading.Thread] = None
+        self._refresh_wakeup = threading.Event()
+        self._refresh_thread: Optional[threading.Thread] = None
+
+        # Several instances (hosts, or processes without a shared directory)
+        # may write to the same prefix. Manifest writes are conditional on the
+        # generation last seen, so a concurrent write is detected and
+        # re-applied instead of lost, and every refresh_interval seconds the
+        # manifest generation is polled and segments and tombstones written
+        # elsewhere are loaded without a full reload.
+        self.refresh_interval = refresh_interval
+        self._last_remote_check = time.monotonic()
+        # Segments (embeddings_key -> seq) and tombstones reflected in memory
+        self._applied_segments: Dict[str, int] = {}
+        self._applied_tombstones: Dict[str, int] = {}
+        self._manifest_conflicts = 0
+        self._remote_refreshes = 0
+
     def load_from_cloud(self) -> bool:
         """Load embeddings and documents from cloud storage"""
-        try:
-            # Load metadata (documents)
-            metadata_blob = self.bucket.blob(self.metadata_key)
-            if not metadata_blob.exists():
-                print(f"Metadata file doesn't exist: {self.metadata_key}")
-                return False
+        if self.shared_store is None:
+            loaded = self._load()
+        else:
+            # One process per host loads from cloud storage and publishes the
+            # shared snapshot; the others wait here and then attach to it
+            lock_path = os.path.join(self.shared_store.root, self.key_prefix, "loader.lock")
+            with file_lock(lock_path):
+                loaded = self._load()
+        # A store with nothing in storage yet starts polling after its first flush
+        if loaded:
+            self._start_refresh()
+        return loaded
 
-            metadata_content = metadata_blob.download_as_string()
-            self.documents = json.loads(metadata_content.decode("utf-8"))
+    def _load(self) -> bool:
+        try:
+            self._adopt_journals()
+            manifest_generation = self.object_store.generation(self.manifest_key)
+            shared, _ = self._read_shared_manifest()
+            if (
+                shared is not None
+                and manifest_generation is not None
+                and shared["source_generation"] == manifest_generation
+            ):
+                manifest = shared["manifest"]
+                state = self._read_state(shared["view"], self.shared_store)
+            else:
+                shared = None
+                stored = self._read_stored_state()
+                if stored is None:
+                    return False
+                manifest, manifest_generation, state = stored
 
-            # Load embeddings
-            embeddings_blob = self.bucket.blob(self.embeddings_key)
-            if not embeddings_blob.exists():
-                print(f"Embeddings file doesn't exist: {self.embeddings_key}")
-                return False
+            with self._manifest_lock:
+                self._install_state(manifest, manifest_generation, state)
+                replayed = self._replay_journal()
+                if shared is not None:
+                    self._shared_generation = shared["generation"]
+                    capture = None
+                else:
+                    capture = self._capture_shared()
+            # Published before the loader lock is released, so the processes
+            # waiting for it attach instead of loading again
+            if capture is not None and self._publish_shared(capture):
+                self._adopt_shared(capture["snapshot"])
 
-            embeddings_content = embeddings_blob.download_as_string()
-            self.embeddings = np.load(io.BytesIO(embeddings_content))
+            if self.local_cache_dir:
+                self._prune_local_cache()
 
+            source = (
+                f"shared snapshot generation {shared['generation']}"
+                if shared is not None
+                else "cloud storage"
+            )
             print(
-                f"Loaded {len(self.documents)} documents and embeddings from cloud storage"
+                f"Loaded {len(self.documents)} documents and embeddings from {source} "
+                f"({len(self.segments)} segments, {replayed} journaled changes)"
             )
             return True
         except Exception as e:
             print(f"Error loading from cloud storage: {e}")
             # Initialize with empty data
-            self.documents = []
-            self.embeddings = np.array([])
+            with self._manifest_lock:
+                self._embedding_buffer = GrowableArray(np.empty((0, 0), dtype=np.float32))
+                self._deleted_buffer = GrowableArray(np.zeros(0, dtype=bool))
+                self._snapshot = self._empty_snapshot()
+                self.doc_rows = {}
             return False
 
+    def _read_stored_state(
+        self,
+    ) -> Optional[Tuple[Dict[str, Any], Optional[int], Dict[str, Any]]]:
+        """The manifest in storage, its generation and its state; None if nothing is stored"""
+        for attempt in range(self.LOAD_ATTEMPTS):
+            manifest_generation = self.object_store.generation(self.manifest_key)
+            try:
+                manifest = json.loads(self.object_store.get(self.manifest_key).decode("utf-8"))
+            except ObjectNotFound:
+                manifest = self._legacy_manifest()
+                if manifest is None:
+                    # Changes journaled before the first flush still count
+                    if not any(os.path.getsize(journal.path) for journal in self._journals()):
+                        return None
+                    manifest = self._empty_manifest()
+            try:
+                return manifest, manifest_generation, self._read_state(manifest, self.object_store)
+            except (ObjectNotFound, FileNotFoundError):
+                # Another instance compacted the segments away after the
+                # manifest was read (maybe while a local file was being
+                # opened); the manifest it wrote lists the merged segment
+                if (
+                    attempt == self.LOAD_ATTEMPTS - 1
+                    or self.object_store.generation(self.manifest_key) == manifest_generation
+                ):
+                    raise
+
+    def _read_state(
+        self, manifest: Dict[str, Any], object_store: ObjectStore
+    ) -> Dict[str, Any]:
+        """Read the live rows of a manifest's segments and rebuild their indexes"""
+        documents = DocumentStore()
+        metadata_index = MetadataIndex()
+        lexical_index = LexicalIndex()
+        fingerprint_index = FingerprintIndex()
+        embeddings = []
+        live_segments = []
+        for segment in manifest["segments"]:
+            segment_documents, segment_embeddings = self._read_segment(segment, object_store)
+            keep_mask = self._live_mask(
+                segment_documents.values("doc_id"), segment["seq"], manifest["tombstones"]
+            )
+            if not keep_mask.any():
+                continue
+            if not keep_mask.all():
+                segment_documents = segment_documents.select(keep_mask)
+            # The first segment's columns are used as loaded (memory-mapped
+            # through the local cache); later ones are appended to them
+            if len(documents):
+                documents.append(segment_documents)
+            else:
+                documents = segment_documents
+            metadata_index.add_store(segment_documents)
+            texts = [segment_documents.text(row) for row in range(len(segment_documents))]
+            lexical_index.add(texts)
+            # Segments written before fingerprinting, or with an older kind of
+            # fingerprint, get them computed once
+            if (
+                segment.get("fingerprints_key")
+                and segment.get("fingerprints_version") == FingerprintIndex.VERSION
+            ):
+                fingerprints = self._load_npy(
+                    segment["fingerprints_key"],
+                    object_store=object_store,
+                    shards=self._shards(segment, "fingerprints_key"),
+                )[keep_mask]
+            else:
+                fingerprints = FingerprintIndex.fingerprint(texts)
+            fingerprint_index.add(fingerprints)
+            live_segments.append((segment, keep_mask))
+            if not segment.get("normalized"):
+                segment_embeddings = self._normalize(segment_embeddings)
+            # A memory-mapped segment with no deleted rows is used without copying
+            if not keep_mask.all():
+                segment_embeddings = segment_embeddings[keep_mask]
+            embeddings.append(segment_embeddings)
+
+        if len(embeddings) == 1:
+            loaded_embeddings = embeddings[0]
+        elif embeddings:
+            loaded_embeddings = np.vstack(embeddings)
+        else:
+            loaded_embeddings = np.empty((0, 0), dtype=np.float32)
+
+        return {
+            "documents": documents,
+            "embeddings": loaded_embeddings,
+            "metadata_index": metadata_index,
+            "lexical_index": lexical_index,
+            "fingerprint_index": fingerprint_index,
+            "index": self._restore_index(
+                manifest.get("ivf"), live_segments, loaded_embeddings, object_store
+            ),
+            "quantizer": self._restore_quantizer(
+                manifest.get("quantizer"), live_segments, loaded_embeddings, object_store
+            ),
+        }
+
+    def _install_state(
+        self,
+        manifest: Dict[str, Any],
+        manifest_generation: Optional[int],
+        state: Dict[str, Any],
+    ) -> None:
+        """Publish loaded state as the current snapshot; called under _manifest_lock"""
+        documents = state["documents"]
+        self._embedding_buffer = GrowableArray(state["embeddings"])
+        self._deleted_buffer = GrowableArray(np.zeros(len(documents), dtype=bool))
+        self._snapshot = StoreSnapshot(
+            documents,
+            self._embedding_buffer.view,
+            self._deleted_buffer.view,
+            0,
+            state["metadata_index"],
+            state["lexical_index"],
+            state["fingerprint_index"],
+            state["index"],
+            state["quantizer"],
+        )
+        self.doc_rows = {}
+        self._add_doc_rows(documents.values("doc_id"), 0)
+        self._pending_references = []
+        self._set_manifest(manifest, manifest_generation)
+        # The rows now reflect exactly these segments and tombstones
+        self._applied_segments = {
+            segment["embeddings_key"]: segment["seq"] for segment in manifest["segments"]
+        }
+        self._applied_tombstones = dict(manifest["tombstones"])
+        self._manifest_ivf_version = (manifest.get("ivf") or {}).get("version")
+        self._manifest_quantizer_version = (manifest.get("quantizer") or {}).get("version")
+        self._flushed_rows = len(documents)
+        self._pending_tombstones = {}
+        self._pending_changes = 0
+        self._first_pending_at = None
+
     def save_to_cloud(self) -> bool:
-        """Save embeddings and documents to cloud storage"""
+        """Save embeddings and documents to cloud storage as one compacted segment"""
+        return self.compact()
+
+    def compact(self) -> bool:
+        """Drop deleted rows and merge all segments into a single segment"""
+        with self._compaction_lock:
+            return self._compact()
+
+    def _compact(self) -> bool:
         try:
-            # Save metadata (documents)
-            metadata_blob = self.bucket.blob(self.metadata_key)
-            metadata_bytes = json.dumps(self.documents).encode("utf-8")
-            metadata_blob.upload_from_string(
-                metadata_bytes, content_type="application/json"
+            # Pending changes go into segments first, so the merge covers them,
+            # and segments written by other instances are loaded to be merged too
+            if not self.flush():
+                return False
+            self.refresh_remote()
+
+            # Snapshot under the lock so the rows match exactly the listed segments
+            with self._manifest_lock:
+                if not self.flush():
+                    return False
+                if self._behind_manifest():
+                    logger.warning(
+                        "Skipping compaction: changes from other instances are not loaded yet"
+                    )
+                    return False
+                if self.deleted_count:
+                    self._purge_deleted()
+                # Rows are only appended past a snapshot's size, so its
+                # objects can be serialized after the lock is released
+                snapshot = self._snapshot
+                row_count = snapshot.size
+                # Document columns are copied here, while no add can extend them
+                documents = snapshot.documents.select(
+                    np.arange(len(snapshot.documents)) < row_count
+                )
+                embeddings = snapshot.embeddings
+                merged_segments = list(self.segments)
+                applied_tombstones = dict(self._applied_tombstones)
+                assignments, ivf_version = None, None
+                if snapshot.index is not None and snapshot.index.is_trained:
+                    assignments = snapshot.index.assignments[:row_count]
+                    ivf_version = snapshot.index.version
+                codes, codes_version = None, None
+                if snapshot.quantizer is not None and snapshot.quantizer.is_trained:
+                    codes = snapshot.quantizer.codes[:row_count]
+                    codes_version = snapshot.quantizer.version
+                fingerprints = snapshot.fingerprint_index.fingerprints[:row_count]
+                seq = max((segment["seq"] for segment in merged_segments), default=self.next_seq)
+
+            # Upload the merged segment without blocking adds and deletes
+            merged = (
+                [
+                    self._write_segment(
+                        seq,
+                        documents,
+                        embeddings,
+                        assignments,
+                        ivf_version,
+                        codes,
+                        codes_version,
+                        fingerprints,
+                    )
+                ]
+                if row_count
+                else []
             )
 
-            # Save embeddings
-            embeddings_bytes = io.BytesIO()
-            np.save(embeddings_bytes, self.embeddings)
-            embeddings_bytes.seek(0)
+            merged_keys = {segment["embeddings_key"] for segment in merged_segments}
+
+            def change(manifest: Dict[str, Any]) -> None:
+                present = {segment["embeddings_key"] for segment in manifest["segments"]}
+                if not merged_keys <= present:
+                    raise RuntimeError("Segments were compacted by another instance meanwhile")
+                if merged and not merged_segments:
+                    merged[0]["seq"] = manifest["next_seq"]
+                    manifest["next_seq"] += 1
+                # Segments added by anyone since the snapshot are kept as they are
+                manifest["segments"] = merged + [
+                    segment
+                    for segment in manifest["segments"]
+                    if segment["embeddings_key"] not in merged_keys
+                ]
+                # Tombstones recorded after the snapshot still apply to the merged rows
+                manifest["tombstones"] = {
+                    doc_id: tombstone_seq
+                    for doc_id, tombstone_seq in manifest["tombstones"].items()
+                    if applied_tombstones.get(doc_id) != tombstone_seq
+                }
+
+            with self._manifest_lock:
+                try:
+                    self._write_manifest(change)
+                except Exception:
+                    self._delete_objects(
+                        key for segment in merged for key in self._segment_keys(segment)
+                    )
+                    raise
+                for key in merged_keys:
+                    self._applied_segments.pop(key, None)
+                for segment in merged:
+                    self._applied_segments[segment["embeddings_key"]] = segment["seq"]
+                self._applied_tombstones = {
+                    doc_id: tombstone_seq
+                    for doc_id, tombstone_seq in self._applied_tombstones.items()
+                    if applied_tombstones.get(doc_id) != tombstone_seq
+                }
+                self._schedule_shared_publish()
 
-            embeddings_blob = self.bucket.blob(self.embeddings_key)
-            embeddings_blob.upload_from_string(
-                embeddings_bytes.getvalue(), content_type="application/octet-stream"
+            # Old segments are unreachable once the new manifest is written
+            self._delete_objects(
+                key for segment in merged_segments for key in self._segment_keys(segment)
             )
 
             print(
-                f"Saved {len(self.documents)} documents and embeddings to cloud storage"
+                f"Saved {row_count} documents and embeddings to cloud storage "
+                f"(compacted {len(merged_segments)} segments)"
             )
             return True
         except Exception as e:
             print(f"Error saving to cloud storage: {e}")
             return False
 
+    def compact_in_background(self) -> bool:
+        """Start a compaction thread unless one is already running"""
+        with self._manifest_lock:
+            if self._compaction_thread and self._compaction_thread.is_alive():
+                return False
+            self._compaction_thread = threading.Thread(
+                target=self.compact, name="vector-store-compaction", daemon=True
+            )
+            self._compaction_thread.start()
+            return True
+
     def add_documents(
         self, documents: List[Dict[str, Any]], embeddings: np.ndarray
     ) -> bool:
         """Add documents and their embeddings to the store"""
-        self.documents.extend(documents)
+        embeddings = self._normalize(embeddings)
 
-        if self.embeddings.size == 0:
-            self.embeddings = embeddings
-        else:
-            self.embeddings = np.vstack([self.embeddings, embeddings])
+        with self._manifest_lock:
+            # Bad input fails here, before it is journaled or applied
+            prepared = self._prepare_add(documents, embeddings)
+            if self.journal is not None and not self._journal_change(
+                {"op": "add", "documents": documents}, embeddings
+            ):
+                return False
+            self._apply_add(documents, embeddings, prepared)
+            return self._persist_change()
+
+    def flush(self) -> bool:
+        """Write pending changes as one segment and one manifest update"""
+        with self._manifest_lock:
+            if not self._pending_changes:
+                return True
+
+            started = time.perf_counter()
+            snapshot = self._snapshot
+            start, end = self._flushed_rows, snapshot.size
+            pending_tombstones = list(self._pending_tombstones)
+            pending_references = list(self._pending_references)
+            segment = None
+            try:
+                # Rows added and deleted again since the last flush are skipped
+                rows = start + np.flatnonzero(~snapshot.deleted[start:end])
+                if len(rows):
+                    row_mask = np.zeros(len(snapshot.documents), dtype=bool)
+                    row_mask[rows] = True
+                    index, quantizer = snapshot.index, snapshot.quantizer
+                    index_trained = index is not None and index.is_trained
+                    codes_trained = quantizer is not None and quantizer.is_trained
+                    segment = self._write_segment(
+                        self.next_seq,
+                        snapshot.documents.select(row_mask),
+                        snapshot.embeddings[rows],
+                        index.assignments[rows] if index_trained else None,
+                        index.version if index_trained else None,
+                        quantizer.codes[rows] if codes_trained else None,
+                        quantizer.version if codes_trained else None,
+                        snapshot.fingerprint_index.fingerprints[rows],
+                    )
+
+                def change(manifest: Dict[str, Any]) -> None:
+                    # Tombstones take the next sequence number, so they hide the
+                    # deleted doc_ids in every existing segment but not in the new one
+                    seq = manifest["next_seq"]
+                    for doc_id in pending_tombstones:
+                        manifest["tombstones"][doc_id] = seq
+                    if segment is not None:
+                        manifest["segments"].append(dict(segment, seq=seq))
+                    manifest["next_seq"] = seq + 1
+                    self._change_references(
+                        manifest.setdefault("references", {}), pending_references
+                    )
+
+                # Marks the records so far as covered by this flush, for a
+                # crash between the manifest write and the truncate below
+                segment_key = segment["embeddings_key"] if segment is not None else None
+                for journal in self._journals():
+                    journal.append({"op": "flush", "segment": segment_key})
+                self._write_manifest(change)
+            except Exception as e:
+                # An uploaded but unlisted segment is just garbage; the
+                # changes stay pending and are retried by the next flush
+                self._failed_flushes += 1
+                self._first_pending_at = time.time()
+                logger.error(f"Error flushing vector store changes to cloud storage: {e}")
+                return False
+
+            if segment is not None:
+                self._applied_segments[segment["embeddings_key"]] = self.next_seq - 1
+            for doc_id in pending_tombstones:
+                self._applied_tombstones[doc_id] = self.tombstones[doc_id]
+            flushed_changes = self._pending_changes
+            self._flushed_rows = end
+            self._pending_tombstones = {}
+            self._pending_references = []
+            self._pending_changes = 0
+            self._first_pending_at = None
+            if self.journal is not None:
+                self.journal.truncate()
+            for journal in self._adopted_journals:
+                journal.remove()
+            self._adopted_journals = []
+
+            self._flush_count += 1
+            self._last_flush_seconds = time.perf_counter() - started
+            self._last_flush_at = time.time()
+            self._schedule_shared_publish()
+            if self._refresh_thread is None and not self._closing:
+                self._start_refresh()
+            logger.info(
+                f"Flushed {flushed_changes} changes ({len(rows)} rows) to cloud storage "
+                f"in {1000 * self._last_flush_seconds:.1f} ms"
+            )
+            if self._behind_manifest():
+                # Another instance wrote in between; load its changes too
+                self._refresh_wakeup.set()
+
+        if len(self.segments) > self.max_segments:
+            self.compact_in_background()
+        return True
+
+    def close(self) -> None:
+        """Stop the background threads and flush what is still pending"""
+        self._closing = True
+        self._flush_wakeup.set()
+        self._publish_wakeup.set()
+        self._refresh_wakeup.set()
+        for thread in (self._flush_thread, self._publish_thread, self._refresh_thread):
+            if thread is not None:
+                thread.join()
+        flushed = self.flush()
+        for journal in self._adopted_journals:
+            journal.close()
+        if self.journal is not None:
+            if flushed and not os.path.getsize(self.journal.path):
+                self.journal.remove()
+            else:
+                self.journal.close()
 
-        # Sync to cloud storage
-        return self.save_to_cloud()
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the current snapshot"""
+        snapshot = self._snapshot
+        total = (
+            snapshot.embeddings.nbytes
+            + snapshot.deleted.nbytes
+            + snapshot.documents.nbytes
+            + snapshot.lexical_index.nbytes
+            + snapshot.fingerprint_index.nbytes
+        )
+        if snapshot.index is not None and snapshot.index.is_trained:
+            total += snapshot.index.assignments.nbytes + snapshot.index.centroids.nbytes
+        if snapshot.quantizer is not None and snapshot.quantizer.is_trained:
+            total += snapshot.quantizer.codes.nbytes
+        return total
+
+    def persistence_stats(self) -> Dict[str, Any]:
+        """Pending changes and flush timings"""
+        with self._manifest_lock:
+            return {
+                "write_behind": self.write_behind,
+                "pending_changes": self._pending_changes,
+                "pending_rows": self._snapshot.size - self._flushed_rows,
+                "pending_deletes": len(self._pending_tombstones),
+                "oldest_pending_seconds": time.time() - self._first_pending_at
+                if self._first_pending_at is not None
+                else None,
+                "flush_count": self._flush_count,
+                "failed_flushes": self._failed_flushes,
+                "last_flush_ms": 1000 * self._last_flush_seconds
+                if self._last_flush_seconds is not None
+                else None,
+                "last_flush_at": self._last_flush_at,
+                "manifest_generation": self._manifest_generation,
+                "shared_generation": self._shared_generation,
+                "manifest_conflicts": self._manifest_conflicts,
+                "remote_refreshes": self._remote_refreshes,
+            }
+
+    @property
+    def snapshot(self) -> StoreSnapshot:
+        """The current immutable state; hold on to it for consistent reads"""
+        return self._snapshot
+
+    @property
+    def documents(self) -> DocumentStore:
+        return self._snapshot.documents
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """The (rows x dim) embedding matrix"""
+        return self._snapshot.embeddings
+
+    @property
+    def deleted(self) -> np.ndarray:
+        """Per-row deletion flags"""
+        return self._snapshot.deleted
+
+    @property
+    def deleted_count(self) -> int:
+        return self._snapshot.deleted_count
+
+    @property
+    def metadata_index(self) -> MetadataIndex:
+        return self._snapshot.metadata_index
+
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        return self._snapshot.lexical_index
+
+    @property
+    def index(self) -> Optional[IVFIndex]:
+        return self._snapshot.index
+
+    @property
+    def quantizer(self) -> Optional[Quantizer]:
+        return self._snapshot.quantizer
 
     def search(
-        self, query_embedding: np.ndarray, top_k: int = 5
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[Dict[str, Any]] = None,
+        mmr_lambda: Optional[float] = None,
+        duplicate_threshold: Optional[float] = None,
     ) -> List[Dict[str, Any]]:
-        """Search for similar documents using cosine similarity"""
-        if len(self.embeddings) == 0:
-            return []
+        """Search for similar documents using cosine similarity
+
+        filters restrict the search to chunks whose metadata match them (see
+        MetadataIndex); only the matching rows are scored. mmr_lambda and
+        duplicate_threshold diversify the results (see _diversify).
+        """
+        if mmr_lambda is None and duplicate_threshold is None:
+            return self.search_batch(query_embedding, [top_k], nprobe, exact, [filters])[0]
 
-        # Calculate cosine similarity
-        similarities = np.dot(self.embeddings, query_embedding) / (
-            np.linalg.norm(self.embeddings, axis=1) * np.linalg.norm(query_embedding)
+        snapshot = self._snapshot
+        rows, scores = self._search_rows(
+            snapshot,
+            self._normalize(query_embedding),
+            top_k * self.MMR_CANDIDATE_FACTOR,
+            nprobe,
+            exact,
+            [filters],
+        )[0]
+        rows, scores = self._diversify(
+            snapshot, rows, scores, top_k, mmr_lambda, duplicate_threshold
         )
+        return self._format_results(snapshot, rows, scores)
 
-        # Get top-k indices
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: Union[int, Sequence[int]] = 5,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Union[None, Dict[str, Any], Sequence[Optional[Dict[str, Any]]]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Search for several queries at once, with shared or per-query top_k and filters"""
+        # Rows and documents must come from the same snapshot
+        snapshot = self._snapshot
+        return [
+            self._format_results(snapshot, rows, scores)
+            for rows, scores in self._search_rows(
+                snapshot, self._normalize(query_embeddings), top_k, nprobe, exact, filters
+            )
+        ]
 
+    def hybrid_search(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        candidates: Optional[int] = None,
+        mmr_lambda: Optional[float] = None,
+        duplicate_threshold: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """Search with dense similarity and BM25 together, fused by reciprocal rank
+
+        Each ranking adds 1 / (RRF_K + rank) to a row's score, so chunks that
+        match both the meaning and the exact terms of the query (product
+        codes, error strings) come first. Scores are scaled so that a row
+        ranked first by both is 1.0; results also carry the dense and BM25
+        scores (None when that ranking did not retrieve the row).
+        mmr_lambda and duplicate_threshold diversify the fused results.
+        """
+        snapshot = self._snapshot
+        candidates = max(candidates or self.HYBRID_CANDIDATES, top_k)
+
+        dense_rows, dense_scores = self._search_rows(
+            snapshot, self._normalize(query_embedding), candidates, filters=[filters]
+        )[0]
+        allowed_rows = (
+            snapshot.clip(snapshot.metadata_index.rows(filters)) if filters else None
+        )
+        lexical_rows, lexical_scores = snapshot.lexical_index.search(
+            query,
+            candidates,
+            snapshot.size,
+            snapshot.deleted if snapshot.deleted_count else None,
+            allowed_rows,
+        )
+
+        fused: Dict[int, float] = {}
+        for ranking in (dense_rows, lexical_rows):
+            for rank, row in enumerate(ranking.tolist(), 1):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (self.RRF_K + rank)
+        ranked_rows = sorted(fused, key=fused.get, reverse=True)
+        max_score = 2.0 / (self.RRF_K + 1)
+        best_rows = np.asarray(ranked_rows[:top_k], dtype=np.intp)
+        best_scores = np.array([fused[row] for row in best_rows.tolist()]) / max_score
+        if mmr_lambda is not None or duplicate_threshold is not None:
+            best_rows, best_scores = self._diversify(
+                snapshot,
+                np.asarray(ranked_rows, dtype=np.intp),
+                np.array([fused[row] for row in ranked_rows]) / max_score,
+                top_k,
+                mmr_lambda,
+                duplicate_threshold,
+            )
+
+        dense = dict(zip(dense_rows.tolist(), dense_scores.tolist()))
+        lexical = dict(zip(lexical_rows.tolist(), lexical_scores.tolist()))
+        return [
+            {
+                "document": snapshot.documents[row],
+                "score": float(score),
+                "dense_score": dense.get(row),
+                "lexical_score": lexical.get(row),
+            }
+            for row, score in zip(best_rows.tolist(), best_scores.tolist())
+        ]
+
+    @staticmethod
+    def _diversify(
+        snapshot: StoreSnapshot,
+        rows: np.ndarray,
+        scores: np.ndarray,
+        top_k: int,
+        mmr_lambda: Optional[float] = None,
+        duplicate_threshold: Optional[float] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Pick up to top_k of the candidate rows by maximal marginal relevance.
+
+        Each pick maximizes mmr_lambda * score - (1 - mmr_lambda) * its highest
+        cosine similarity to the rows already picked, so overlapping chunks
+        stop crowding out other sources (mmr_lambda None keeps the score
+        order). Candidates at least duplicate_threshold similar to a picked
+        row are dropped outright.
+        """
+        if len(rows) == 0 or top_k <= 0:
+            return rows[:0], scores[:0]
+
+        mmr_lambda = 1.0 if mmr_lambda is None else mmr_lambda
+        candidates = np.asarray(snapshot.embeddings[rows], dtype=np.float32)
+        # Rows are unit length, so this is the pairwise cosine similarity
+        similarities = candidates @ candidates.T
+        relevance = mmr_lambda * np.asarray(scores, dtype=np.float32)
+        redundancy = np.zeros(len(rows), dtype=np.float32)
+        available = np.ones(len(rows), dtype=bool)
+
+        picked = []
+        while len(picked) < top_k and available.any():
+            marginal = relevance - (1 - mmr_lambda) * redundancy
+            marginal[~available] = -np.inf
+            best = int(np.argmax(marginal))
+            picked.append(best)
+            available[best] = False
+            if duplicate_threshold is not None:
+                available &= similarities[best] < duplicate_threshold
+            np.maximum(redundancy, similarities[best], out=redundancy)
+
+        picked = np.asarray(picked, dtype=np.intp)
+        return rows[picked], scores[picked]
+
+    def _search_rows(
+        self,
+        snapshot: StoreSnapshot,
+        queries: np.ndarray,
+        top_k: Union[int, Sequence[int]],
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Union[None, Dict[str, Any], Sequence[Optional[Dict[str, Any]]]] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Best snapshot rows and their cosine similarities for each normalized query"""
+        if isinstance(top_k, int):
+            top_ks = [top_k] * len(queries)
+        else:
+            top_ks = list(top_k)
+            if len(top_ks) != len(queries):
+                raise ValueError(
+                    f"Got {len(top_ks)} top_k values for {len(queries)} queries"
+                )
+        if filters is None or isinstance(filters, dict):
+            query_filters = [filters] * len(queries)
+        else:
+            query_filters = list(filters)
+            if len(query_filters) != len(queries):
+                raise ValueError(
+                    f"Got {len(query_filters)} filters for {len(queries)} queries"
+                )
+
+        empty = (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32))
+        embeddings = snapshot.embeddings
+        if len(embeddings) == 0:
+            return [empty for _ in top_ks]
+
+        index, quantizer = snapshot.index, snapshot.quantizer
+        use_index = not exact and index is not None and index.is_trained
+        use_codes = not exact and quantizer is not None and quantizer.is_trained
+        deleted = snapshot.deleted if snapshot.deleted_count else None
+
+        results = []
+        # Score the queries in blocks to bound the (queries x corpus) score matrix
+        for start in range(0, len(queries), self.SEARCH_BLOCK_SIZE):
+            block = queries[start : start + self.SEARCH_BLOCK_SIZE]
+            block_top_ks = top_ks[start : start + len(block)]
+            block_filters = query_filters[start : start + len(block)]
+            filtered = any(block_filters)
+
+            if not use_index and not use_codes and not filtered:
+                # Stored rows are unit length, so the dot product is the cosine
+                # similarity; the rows go on the left so that mapped rows and
+                # rows appended since are multiplied in place (see RowChunks)
+                block_similarities = (embeddings @ block.T).T
+                if deleted is not None:
+                    block_similarities[:, deleted] = -np.inf
+                for similarities, k in zip(block_similarities, block_top_ks):
+                    results.append(self._top_rows(similarities, k))
+                continue
+
+            if use_index:
+                candidate_rows = [
+                    snapshot.clip(rows) for rows in index.candidates(block, nprobe)
+                ]
+            else:
+                candidate_rows = [None] * len(block)
+            approximate_scores = None
+            if use_codes and not use_index and not filtered:
+                approximate_scores = quantizer.score(block)[:, : snapshot.size]
+                if deleted is not None:
+                    approximate_scores[:, deleted] = -np.inf
+
+            for i, (query, rows, k, conditions) in enumerate(
+                zip(block, candidate_rows, block_top_ks, block_filters)
+            ):
+                if k <= 0:
+                    results.append(empty)
+                    continue
+                if conditions:
+                    # Filtered searches scan exactly the matching rows, which
+                    # replaces the IVF probe and costs O(matching rows)
+                    rows = snapshot.clip(snapshot.metadata_index.rows(conditions))
+                if rows is not None and deleted is not None:
+                    rows = rows[~deleted[rows]]
+                if use_codes and (rows is None or len(rows) > k * self.rerank_factor):
+                    # Shortlist on the codes, then re-rank at full precision
+                    if approximate_scores is not None:
+                        scores = approximate_scores[i]
+                    else:
+                        scores = quantizer.score(query[None], rows)[0, : snapshot.size]
+                        if rows is None and deleted is not None:
+                            scores[deleted] = -np.inf
+                    shortlist = self._top_k_indices(scores, k * self.rerank_factor)
+                    shortlist = shortlist[np.isfinite(scores[shortlist])]
+                    rows = np.sort(shortlist if rows is None else rows[shortlist])
+
+                if rows is None:
+                    similarities = embeddings @ query
+                    if deleted is not None:
+                        similarities[deleted] = -np.inf
+                else:
+                    similarities = embeddings[rows] @ query
+                results.append(self._top_rows(similarities, k, rows))
+
+        return results
+
+    def _top_rows(
+        self,
+        similarities: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and scores of the top_k similarities; rows maps scores to store rows"""
+        if top_k <= 0 or len(similarities) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+
+        top_indices = self._top_k_indices(similarities, top_k)
+        # Deleted rows are scored -inf and never returned
+        top_indices = top_indices[np.isfinite(similarities[top_indices])]
+        top_rows = top_indices if rows is None else rows[top_indices]
+        return top_rows, similarities[top_indices]
+
+    @staticmethod
+    def _format_results(
+        snapshot: StoreSnapshot, rows: np.ndarray, scores: np.ndarray
+    ) -> List[Dict[str, Any]]:
         return [
-            {"document": self.documents[i], "score": float(similarities[i])}
-            for i in top_indices
+            {"document": snapshot.documents[row], "score": float(score)}
+            for row, score in zip(rows, scores)
         ]
 
+    def recall_report(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 10,
+        nprobe: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Compare the configured index/quantization against exact search"""
+        queries = self._normalize(query_embeddings)
+        snapshot = self._snapshot
+
+        started = time.perf_counter()
+        approximate = self._search_rows(snapshot, queries, top_k, nprobe)
+        approximate_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        exact = self._search_rows(snapshot, queries, top_k, exact=True)
+        exact_seconds = time.perf_counter() - started
+
+        recalls = [
+            len(np.intersect1d(found, expected)) / len(expected)
+            for (found, _), (expected, _) in zip(approximate, exact)
+            if len(expected)
+        ]
+
+        full_bytes = snapshot.embeddings.shape[1] * 4 if snapshot.size else 0
+        quantized_bytes = (
+            snapshot.quantizer.bytes_per_vector
+            if snapshot.quantizer is not None and snapshot.quantizer.is_trained
+            else None
+        )
+        return {
+            "queries": len(queries),
+            "top_k": top_k,
+            "rows": snapshot.size,
+            "index_type": self.index_type
+            if snapshot.index is not None and snapshot.index.is_trained
+            else "flat",
+            "nprobe": (nprobe or self.nprobe) if snapshot.index is not None else None,
+            "quantization": self.quantization if quantized_bytes else None,
+            "rerank_factor": self.rerank_factor if quantized_bytes else None,
+            "recall": float(np.mean(recalls)) if recalls else 1.0,
+            "approximate_ms_per_query": 1000 * approximate_seconds / max(1, len(queries)),
+            "exact_ms_per_query": 1000 * exact_seconds / max(1, len(queries)),
+            "bytes_per_vector": full_bytes,
+            "quantized_bytes_per_vector": quantized_bytes,
+            "compression_ratio": full_bytes / quantized_bytes if quantized_bytes else None,
+        }
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        """Return embeddings as a contiguous 2D float32 matrix of unit-length rows"""
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Leave all-zero rows untouched instead of dividing by zero
+        norms[norms == 0] = 1.0
+        return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+    @staticmethod
+    def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Indices of the top_k highest scores, best first, without a full sort"""
+        top_k = min(top_k, len(scores))
+        if top_k < len(scores):
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    def find_duplicates(self, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Which texts duplicate a stored chunk or an earlier text in the list.
+
+        Returns, per text, None or {"match": "exact" or "near", "doc_id": ...,
+        "chunk_index": ...} naming the chunk it duplicates; doc_id is None
+        for a duplicate of an earlier text in the same list.
+        """
+        snapshot = self._snapshot
+        deleted = snapshot.deleted if snapshot.deleted_count else None
+        fingerprints = FingerprintIndex.fingerprint(texts)
+        batch = FingerprintIndex()
+
+        duplicates: List[Optional[Dict[str, Any]]] = []
+        for i, fingerprint in enumerate(fingerprints):
+            match = snapshot.fingerprint_index.match(fingerprint, snapshot.size, deleted)
+            if match is not None:
+                metadata = snapshot.documents[match[1]].get("metadata") or {}
+                duplicates.append(
+                    {
+                        "match": match[0],
+                        "doc_id": metadata.get("doc_id"),
+                        "chunk_index": metadata.get("chunk_index"),
+                    }
+                )
+            else:
+                match = batch.match(fingerprint)
+                duplicates.append(
+                    {"match": match[0], "doc_id": None, "chunk_index": match[1]}
+                    if match is not None
+                    else None
+                )
+            batch.add(fingerprints[i : i + 1])
+        return duplicates
+
     def delete_documents_by_id(self, doc_id: str) -> bool:
         """Delete all documents with the specified doc_id from vector store"""
-        if not self.documents or len(self.documents) == 0:
+        if len(self.documents) == 0:
             logger.warning(f"No documents in vector store to delete for {doc_id}")
             return False
 
-        # Find indices of documents with matching doc_id
-        indices_to_remove = []
-        for i, doc in enumerate(self.documents):
-            metadata = doc.get("metadata", {})
-            if metadata.get("doc_id") == doc_id:
-                indices_to_remove.append(i)
+        with self._manifest_lock:
+            moved, moved_rows, changes = self._release_references(doc_id)
+            if not self.doc_rows.get(doc_id) and not changes:
+                logger.warning(
+                    f"No documents with doc_id {doc_id} found in vector store"
+                )
+                return False  # No matching documents found
+
+            # One record, so a replay moves the shared chunks and deletes together
+            header: Dict[str, Any] = {"op": "delete", "doc_id": doc_id}
+            embeddings = self._snapshot.embeddings[moved_rows] if moved else None
+            if moved:
+                header["moved"] = moved
+            if changes:
+                header["references"] = changes
+            if self.journal is not None and not self._journal_change(header, embeddings):
+                return False
+            removed = self._apply_document_delete(doc_id, moved, embeddings, changes)
+            logger.info(
+                f"Removed {removed} embeddings for doc_id {doc_id}"
+                + (f", kept {len(moved)} chunks other documents share" if moved else "")
+            )
+            # A tombstone is recorded instead of rewriting the segments that hold the rows
+            if not self._persist_change():
+                return False
+
+        if self.deleted_count > self.max_tombstone_ratio * len(self.documents):
+            self.compact_in_background()
+        return True
+
+    def _prepare_add(
+        self, documents: List[Dict[str, Any]], embeddings: np.ndarray
+    ) -> Dict[str, Any]:
+        """Documents, indexes and fingerprints of rows to append, built aside.
+
+        Everything that can fail on bad input happens here, before any of the
+        store's state is touched.
+        """
+        if embeddings.ndim != 2 or len(embeddings) != len(documents):
+            raise ValueError(
+                f"Expected one embedding per document, got {embeddings.shape} "
+                f"for {len(documents)} documents"
+            )
+        stored = self._embedding_buffer.view
+        if len(stored) and stored.shape[1:] != embeddings.shape[1:]:
+            raise ValueError(
+                f"Embeddings have dimension {embeddings.shape[1]}, "
+                f"the store holds {stored.shape[1]}"
+            )
+        batch = DocumentStore()
+        batch.extend(documents)
+        metadata_index = MetadataIndex()
+        metadata_index.add(documents)
+        texts = [document.get("text") for document in documents]
+        lexical_index = LexicalIndex()
+        lexical_index.add(texts)
+        return {
+            "documents": batch,
+            "doc_ids": [self._doc_id(document) for document in documents],
+            "embeddings": embeddings,
+            "metadata_index": metadata_index,
+            "lexical_index": lexical_index,
+            "fingerprints": FingerprintIndex.fingerprint(texts),
+        }
+
+    def _apply_add(
+        self,
+        documents: List[Dict[str, Any]],
+        embeddings: np.ndarray,
+        prepared: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Append normalized rows in memory and publish them to searches"""
+        if prepared is None:
+            prepared = self._prepare_add(documents, embeddings)
+        snapshot = self._snapshot
+        # Only appends from here on, and they land past the published
+        # snapshot's size, so it is unaffected until the swap below
+        self._add_doc_rows(prepared["doc_ids"], snapshot.size)
+        self._deleted_buffer.append(np.zeros(len(documents), dtype=bool))
+        snapshot.documents.append(prepared["documents"])
+        snapshot.metadata_index.append(prepared["metadata_index"])
+        snapshot.lexical_index.append(prepared["lexical_index"])
+        snapshot.fingerprint_index.add(prepared["fingerprints"])
+        self._embedding_buffer.append(embeddings)
+
+        try:
+            index = self._index_new_rows(snapshot.index, embeddings)
+            quantizer = self._quantize_new_rows(snapshot.quantizer, embeddings)
+        except Exception as e:
+            # Fall back to exact search until the next add retrains
+            logger.error(f"Error indexing new rows: {e}")
+            index, quantizer = self._new_index(), self._new_quantizer()
+        self._snapshot = snapshot.replace(
+            embeddings=self._embedding_buffer.view,
+            deleted=self._deleted_buffer.view,
+            index=index,
+            quantizer=quantizer,
+        )
+
+    def add_references(
+        self, doc_id: str, chunks: List[Tuple[str, int, int]]
+    ) -> List[Tuple[str, int, int]]:
+        """Record chunks of doc_id that are already stored for other documents.
+
+        chunks lists (owner doc_id, owner chunk_index, chunk_index in doc_id)
+        for every chunk of doc_id that duplicates a stored one and is not
+        stored again; the stored chunk then stays until both are deleted.
+        Returns the chunks whose stored copy is gone by now (or that could
+        not be recorded), which the caller has to store itself.
+        """
+        with self._manifest_lock:
+            lost, changes = [], []
+            for owner, owner_chunk, chunk in chunks:
+                if self._chunk_row(owner, owner_chunk) is None:
+                    lost.append((owner, owner_chunk, chunk))
+                else:
+                    changes.append(["add", owner, owner_chunk, doc_id, chunk])
+            if not changes:
+                return lost
+            if self.journal is not None and not self._journal_change(
+                {"op": "references", "changes": changes}
+            ):
+                return list(chunks)
+            self._apply_references(changes)
+            if not self._persist_change():
+                # Applied in memory and retried by the next flush
+                logger.warning(f"References of {doc_id} are not in cloud storage yet")
+            return lost
+
+    def _release_references(
+        self, doc_id: str
+    ) -> Tuple[List[Dict[str, Any]], List[int], List[List[Any]]]:
+        """Reference changes for deleting doc_id, and the shared chunks to keep.
+
+        doc_id stops referencing other documents' chunks, and each of its own
+        chunks that others still reference is copied to the first of them
+        (moved documents and their source rows) before the delete hides it.
+        """
+        changes: List[List[Any]] = [
+            ["remove", owner, chunk, doc_id]
+            for owner, chunks in self.references.items()
+            for chunk, referrers in chunks.items()
+            if owner != doc_id and any(referrer[0] == doc_id for referrer in referrers)
+        ]
+        moved: List[Dict[str, Any]] = []
+        moved_rows: List[int] = []
+        for chunk, referrers in self.references.get(doc_id, {}).items():
+            changes += [["remove", doc_id, chunk, referrer[0]] for referrer in referrers]
+            remaining = [referrer for referrer in referrers if referrer[0] != doc_id]
+            row = self._chunk_row(doc_id, int(chunk))
+            if not remaining or row is None:
+                continue
+            (new_owner, new_chunk), others = remaining[0], remaining[1:]
+            moved.append(self._moved_document(row, new_owner, new_chunk))
+            moved_rows.append(row)
+            changes += [
+                ["add", new_owner, new_chunk, referrer, referrer_chunk]
+                for referrer, referrer_chunk in others
+            ]
+        return moved, moved_rows, changes
+
+    def _apply_document_delete(
+        self,
+        doc_id: str,
+        moved: Optional[List[Dict[str, Any]]],
+        embeddings: Optional[np.ndarray],
+        changes: Optional[List[List[Any]]],
+    ) -> int:
+        """Keep the shared chunks, update the references and delete doc_id's rows"""
+        if moved:
+            self._apply_add(moved, embeddings)
+        if changes:
+            self._apply_references(changes)
+        return self._apply_delete(doc_id)
+
+    def _apply_references(self, changes: List[List[Any]]) -> None:
+        self._change_references(self.references, changes)
+        self._pending_references.extend(changes)
+        self._index_references()
+
+    def _index_references(self) -> None:
+        """Let doc_id filters match the stored chunks each document references"""
+        rows: Dict[str, List[int]] = {}
+        for owner, chunks in self.references.items():
+            owner_rows = self._chunk_rows(owner)
+            for chunk, referrers in chunks.items():
+                row = owner_rows.get(int(chunk))
+                if row is None:
+                    continue
+                for referrer in referrers:
+                    rows.setdefault(referrer[0], []).append(row)
+        self._snapshot.metadata_index.set_references(
+            {
+                doc_id: np.unique(np.asarray(doc_rows, dtype=np.int64))
+                for doc_id, doc_rows in rows.items()
+            }
+        )
+
+    @staticmethod
+    def _change_references(
+        references: Dict[str, Dict[str, List[List[Any]]]], changes: List[List[Any]]
+    ) -> None:
+        """Apply ["add", owner, chunk, doc_id, doc_chunk] and ["remove", owner,
+        chunk, doc_id] changes; both can be applied twice"""
+        for change in changes:
+            owner, chunk = change[1], str(change[2])
+            if change[0] == "add":
+                referrers = references.setdefault(owner, {}).setdefault(chunk, [])
+                if [change[3], change[4]] not in referrers:
+                    referrers.append([change[3], change[4]])
+                continue
+            referrers = references.get(owner, {}).get(chunk)
+            if referrers is None:
+                continue
+            referrers[:] = [referrer for referrer in referrers if referrer[0] != change[3]]
+            if not referrers:
+                del references[owner][chunk]
+                if not references[owner]:
+                    del references[owner]
+
+    def _chunk_row(self, doc_id: str, chunk_index: int) -> Optional[int]:
+        """Live row holding chunk_index of doc_id"""
+        return self._chunk_rows(doc_id).get(chunk_index)
+
+    def _chunk_rows(self, doc_id: str) -> Dict[int, int]:
+        """chunk_index -> live row of each chunk of doc_id"""
+        snapshot = self._snapshot
+        chunk_indexes = snapshot.documents.column("chunk_index")
+        rows: Dict[int, int] = {}
+        for start, end in self.doc_rows.get(doc_id, []):
+            for row in range(start, end):
+                if snapshot.deleted[row]:
+                    continue
+                chunk_index = int(chunk_indexes[row])
+                if chunk_index == DocumentStore.MISSING:
+                    # Not a column value (e.g. too large); read it from the row
+                    chunk_index = (snapshot.documents[row].get("metadata") or {}).get(
+                        "chunk_index"
+                    )
+                rows.setdefault(chunk_index, row)
+        return rows
+
+    def _moved_document(self, row: int, doc_id: str, chunk_index: int) -> Dict[str, Any]:
+        """A row's document re-labelled as chunk_index of doc_id"""
+        snapshot = self._snapshot
+        document = snapshot.documents[row]
+        metadata = dict(document.get("metadata") or {})
+        # Document-level fields (filename, path, upload time) come from doc_id's own rows
+        own_rows = self.doc_rows.get(doc_id)
+        if own_rows:
+            own_metadata = snapshot.documents[own_rows[0][0]].get("metadata") or {}
+            metadata.update(
+                (field, own_metadata[field])
+                for field in DocumentStore.STRING_FIELDS
+                if field in own_metadata
+            )
+        metadata.update(doc_id=doc_id, chunk_index=chunk_index)
+        return dict(document, metadata=metadata)
+
+    def _apply_delete(self, doc_id: str, pending: bool = True) -> int:
+        """Flag a doc_id's rows as deleted in memory and publish that to searches.
+
+        pending=False for deletes already in storage, e.g. loaded from another
+        instance's tombstones.
+        """
+        row_ranges = self.doc_rows.pop(doc_id, [])
+        # Flag the rows as deleted instead of copying the whole matrix;
+        # only the flags are copied, since published snapshots share them
+        snapshot = self._snapshot
+        deleted = self._deleted_buffer.view.copy()
+        removed = 0
+        for start, end in row_ranges:
+            deleted[start:end] = True
+            removed += end - start
+        self._deleted_buffer = GrowableArray(deleted)
+        self._snapshot = snapshot.replace(
+            deleted=self._deleted_buffer.view,
+            deleted_count=snapshot.deleted_count + removed,
+        )
+        if pending:
+            self._pending_tombstones[doc_id] = None
+        return removed
+
+    def _persist_change(self) -> bool:
+        """Count an applied change and flush it now or schedule the flush"""
+        self._pending_changes += 1
+        if self._first_pending_at is None:
+            self._first_pending_at = time.time()
+        if not self.write_behind:
+            return self.flush()
+        self._schedule_flush()
+        return True
+
+    def _schedule_flush(self) -> None:
+        """Wake the background flusher, starting it on first use"""
+        if self._flush_thread is None or not self._flush_thread.is_alive():
+            self._flush_thread = threading.Thread(
+                target=self._flush_loop, name="vector-store-flusher", daemon=True
+            )
+            self._flush_thread.start()
+        self._flush_wakeup.set()
+
+    def _flush_loop(self) -> None:
+        """Flush after flush_max_pending changes or flush_interval seconds"""
+        while not self._closing:
+            with self._manifest_lock:
+                pending = self._pending_changes
+                first_pending_at = self._first_pending_at
+            if not pending:
+                self._flush_wakeup.wait()
+                self._flush_wakeup.clear()
+                continue
+
+            wait = first_pending_at + self.flush_interval - time.time()
+            if pending >= self.flush_max_pending or wait <= 0:
+                self.flush()
+            else:
+                self._flush_wakeup.wait(wait)
+                self._flush_wakeup.clear()
+
+    def refresh_shared(self) -> bool:
+        """Attach to the shared snapshot if another process published a newer one"""
+        if self.shared_store is None:
+            return False
+        file_generation = self.shared_store.generation(self.shared_manifest_key)
+        if file_generation is None or file_generation == self._shared_file_generation:
+            return False
+
+        shared, file_generation = self._read_shared_manifest()
+        with self._manifest_lock:
+            manifest_generation = self._manifest_generation
+            if self._pending_changes:
+                # Our own changes go out first; look again after they are flushed
+                return False
+        if manifest_generation is not None and (
+            shared["source_generation"] <= manifest_generation
+        ):
+            # Published by this process, or older than what it has
+            self._shared_file_generation = file_generation
+            return False
+
+        state = self._read_state(shared["view"], self.shared_store)
+        with self._manifest_lock:
+            if self._pending_changes or self._manifest_generation != manifest_generation:
+                return False
+            self._install_state(shared["manifest"], shared["source_generation"], state)
+            self._shared_generation = shared["generation"]
+            self._shared_file_generation = file_generation
+        logger.info(
+            f"Attached shared snapshot generation {shared['generation']} "
+            f"({len(state['documents'])} rows)"
+        )
+        return True
+
+    def refresh_remote(self) -> bool:
+        """Load segments and tombstones that other instances added to the manifest.
+
+        New segments are read and appended and new tombstones applied in
+        place. A full reload is only needed when the segments this instance
+        holds were compacted away, or a tombstone hides just some of its rows.
+        Skipped while local changes are pending; the next flush writes them
+        on top of the newer manifest and then triggers a refresh.
+        """
+        with self._manifest_lock:
+            if self._pending_changes:
+                return False
+            manifest_generation = self._manifest_generation
+            behind = self._behind_manifest()
+        generation = self.object_store.generation(self.manifest_key)
+        if generation is None or (generation == manifest_generation and not behind):
+            return False
+
+        manifest, generation = self._fetch_manifest()
+        with self._manifest_lock:
+            applied_segments = dict(self._applied_segments)
+            applied_tombstones = dict(self._applied_tombstones)
+        remote_keys = {segment["embeddings_key"] for segment in manifest["segments"]}
+        new_segments = [
+            segment
+            for segment in manifest["segments"]
+            if segment["embeddings_key"] not in applied_segments
+        ]
+        new_tombstones = {
+            doc_id: seq
+            for doc_id, seq in manifest["tombstones"].items()
+            if applied_tombstones.get(doc_id) != seq
+        }
+        newest_applied = max(applied_segments.values(), default=0)
+        full_reload = not set(applied_segments) <= remote_keys or any(
+            seq <= newest_applied for seq in new_tombstones.values()
+        )
+
+        if full_reload:
+            state = self._read_state(manifest, self.object_store)
+        else:
+            added = []
+            for segment in new_segments:
+                documents, embeddings = self._read_segment(segment, self.object_store)
+                keep_mask = self._live_mask(
+                    documents.values("doc_id"), segment["seq"], manifest["tombstones"]
+                )
+                if keep_mask.any():
+                    documents = documents.select(keep_mask).to_list()
+                    embeddings = np.asarray(embeddings)[keep_mask]
+                    added.append(
+                        (documents, embeddings, self._prepare_add(documents, embeddings))
+                    )
+
+        with self._manifest_lock:
+            if self._pending_changes or self._manifest_generation != manifest_generation:
+                # Changed meanwhile; the next poll looks again
+                return False
+            if full_reload:
+                self._install_state(manifest, generation, state)
+            else:
+                # Every applied segment predates these tombstones, so they
+                # hide all rows of their doc_ids held in memory
+                for doc_id in new_tombstones:
+                    self._apply_delete(doc_id, pending=False)
+                for documents, embeddings, prepared in added:
+                    self._apply_add(documents, embeddings, prepared)
+                self._flushed_rows = self._snapshot.size
+                self._set_manifest(manifest, generation)
+                for segment in new_segments:
+                    self._applied_segments[segment["embeddings_key"]] = segment["seq"]
+                self._applied_tombstones.update(new_tombstones)
+            self._remote_refreshes += 1
+            self._schedule_shared_publish()
+        logger.info(
+            f"Refreshed from manifest generation {generation} "
+            + (
+                f"(full reload, {self._snapshot.size} rows)"
+                if full_reload
+                else f"({len(new_segments)} segments, {len(new_tombstones)} tombstones)"
+            )
+        )
+        return True
+
+    def _start_refresh(self) -> None:
+        if not self.refresh_interval and self.shared_store is None:
+            return
+        if self._refresh_thread is None or not self._refresh_thread.is_alive():
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_loop, name="vector-store-refresh", daemon=True
+            )
+            self._refresh_thread.start()
+
+    def _refresh_loop(self) -> None:
+        """Poll the shared snapshot generation every shared_poll_interval seconds
+        and the manifest generation every refresh_interval seconds"""
+        intervals = [
+            interval
+            for interval, enabled in (
+                (self.shared_poll_interval, self.shared_store is not None),
+                (self.refresh_interval, bool(self.refresh_interval)),
+            )
+            if enabled
+        ]
+        while not self._closing:
+            # Set early after a flush that found the manifest moved on
+            woken = self._refresh_wakeup.wait(min(intervals))
+            self._refresh_wakeup.clear()
+            if self._closing:
+                return
+            try:
+                self.refresh_shared()
+            except Exception as e:
+                logger.error(f"Error attaching shared vector store snapshot: {e}")
+            if self.refresh_interval and (
+                woken or time.monotonic() - self._last_remote_check >= self.refresh_interval
+            ):
+                self._last_remote_check = time.monotonic()
+                try:
+                    self.refresh_remote()
+                except Exception as e:
+                    logger.error(f"Error refreshing vector store from cloud storage: {e}")
+
+    def _read_shared_manifest(self) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """The shared manifest and its file generation, (None, None) if there is none"""
+        if self.shared_store is None:
+            return None, None
+        generation = self.shared_store.generation(self.shared_manifest_key)
+        if generation is None:
+            return None, None
+        try:
+            content = self.shared_store.get(self.shared_manifest_key)
+        except ObjectNotFound:
+            return None, None
+        return json.loads(content.decode("utf-8")), generation
+
+    def _capture_shared(self) -> Optional[Dict[str, Any]]:
+        """What to publish as the shared snapshot; called under _manifest_lock.
+
+        Only state that matches the manifest in storage exactly is published,
+        i.e. with no changes pending.
+        """
+        if (
+            self.shared_store is None
+            or self._pending_changes
+            or self._manifest_generation is None
+        ):
+            return None
+        return {
+            "snapshot": self._snapshot,
+            "manifest": self._manifest,
+            "source_generation": self._manifest_generation,
+        }
+
+    def _schedule_shared_publish(self) -> None:
+        """Publish the current state from the background, coalescing bursts"""
+        capture = self._capture_shared()
+        if capture is None or self._closing:
+            return
+        self._shared_capture = capture
+        if self._publish_thread is None or not self._publish_thread.is_alive():
+            self._publish_thread = threading.Thread(
+                target=self._publish_loop, name="vector-store-publisher", daemon=True
+            )
+            self._publish_thread.start()
+        self._publish_wakeup.set()
+
+    def _publish_loop(self) -> None:
+        while not self._closing:
+            self._publish_wakeup.wait()
+            self._publish_wakeup.clear()
+            capture, self._shared_capture = self._shared_capture, None
+            if capture is not None:
+                self._publish_shared(capture)
+
+    def _publish_shared(self, capture: Dict[str, Any]) -> bool:
+        """Write a captured state's live rows to the shared directory as one segment"""
+        shared_store = self.shared_store
+        with self._publish_lock:
+            try:
+                current, current_generation = self._read_shared_manifest()
+                if current is not None and (
+                    current["source_generation"] >= capture["source_generation"]
+                ):
+                    # Another process already published this state or a newer one
+                    return False
+
+                snapshot = capture["snapshot"]
+                live = ~snapshot.deleted
+                all_live = bool(live.all())
+                index, quantizer = snapshot.index, snapshot.quantizer
+                index_trained = index is not None and index.is_trained
+                codes_trained = quantizer is not None and quantizer.is_trained
+                segment = self._write_segment(
+                    0,
+                    snapshot.documents.select(live),
+                    snapshot.embeddings if all_live else snapshot.embeddings[live],
+                    index.assignments[: snapshot.size][live] if index_trained else None,
+                    index.version if index_trained else None,
+                    quantizer.codes[: snapshot.size][live] if codes_trained else None,
+                    quantizer.version if codes_trained else None,
+                    snapshot.fingerprint_index.fingerprints[: snapshot.size][live],
+                    object_store=shared_store,
+                )
+                # The segment's rows are all live and already renumbered
+                view = {"segments": [segment], "tombstones": {}}
+                keys = self._segment_keys(segment)
+                if index_trained:
+                    view["ivf"] = {
+                        "version": index.version,
+                        "centroids_key": self._centroids_key(index.version),
+                        "trained_size": index.trained_size,
+                    }
+                    self._upload_npy(view["ivf"]["centroids_key"], index.centroids, shared_store)
+                    keys.append(view["ivf"]["centroids_key"])
+                if codes_trained:
+                    view["quantizer"] = {
+                        "type": quantizer.name,
+                        "version": quantizer.version,
+                        "key": self._quantizer_key(quantizer.version),
+                        "trained_size": quantizer.trained_size,
+                    }
+                    self._upload_npz(view["quantizer"]["key"], quantizer.state(), shared_store)
+                    keys.append(view["quantizer"]["key"])
+
+                shared = {
+                    "generation": (current["generation"] if current else 0) + 1,
+                    "source_generation": capture["source_generation"],
+                    "manifest": capture["manifest"],
+                    "view": view,
+                }
+                try:
+                    file_generation = shared_store.put(
+                        self.shared_manifest_key,
+                        json.dumps(shared).encode("utf-8"),
+                        content_type="application/json",
+                        if_generation_match=current_generation or 0,
+                    )
+                except PreconditionFailed:
+                    # Lost the race to another publisher; its snapshot stands
+                    self._delete_objects(keys, shared_store)
+                    return False
+
+                # Processes still reading the old files keep their mappings
+                if current is not None:
+                    self._delete_objects(
+                        (key for key in self._shared_keys(current["view"]) if key not in keys),
+                        shared_store,
+                    )
+                with self._manifest_lock:
+                    if self._manifest_generation == capture["source_generation"]:
+                        self._shared_generation = shared["generation"]
+                        self._shared_file_generation = file_generation
+                logger.info(
+                    f"Published shared snapshot generation {shared['generation']} "
+                    f"({segment['count']} rows)"
+                )
+                return True
+            except Exception as e:
+                logger.error(f"Error publishing shared vector store snapshot: {e}")
+                return False
+
+    def _adopt_shared(self, snapshot: StoreSnapshot) -> None:
+        """Swap the loader's own copy of the rows for the shared one it just published"""
+        shared, _ = self._read_shared_manifest()
+        documents, embeddings = self._read_segment(
+            shared["view"]["segments"][0], self.shared_store
+        )
+        with self._manifest_lock:
+            # Same rows in the same order, unless something changed meanwhile
+            if self._snapshot is not snapshot or snapshot.deleted_count:
+                return
+            self._embedding_buffer = GrowableArray(embeddings)
+            self._snapshot = snapshot.replace(
+                documents=documents, embeddings=self._embedding_buffer.view
+            )
+
+    def _shared_keys(self, view: Dict[str, Any]) -> List[str]:
+        keys = [key for segment in view["segments"] for key in self._segment_keys(segment)]
+        if view.get("ivf"):
+            keys.append(view["ivf"]["centroids_key"])
+        if view.get("quantizer"):
+            keys.append(view["quantizer"]["key"])
+        return keys
+
+    def _journal_change(
+        self, header: Dict[str, Any], array: Optional[np.ndarray] = None
+    ) -> bool:
+        """Durably log a change before applying it"""
+        try:
+            self.journal.append(header, array)
+        except Exception as e:
+            logger.error(f"Error journaling vector store change: {e}")
+            return False
+        return True
+
+    def _journals(self) -> List[Journal]:
+        return ([self.journal] if self.journal is not None else []) + self._adopted_journals
+
+    def _adopt_journals(self) -> None:
+        """Take over the journals of processes that exited without flushing them"""
+        # Without file locks a live journal can't be told from an orphaned one
+        if self.journal is None or not Journal.LOCKING:
+            return
+
+        held = {journal.path for journal in self._journals()}
+        with file_lock(os.path.join(self.journal_dir, "journal.lock")):
+            paths = [
+                os.path.join(self.journal_dir, name)
+                for name in os.listdir(self.journal_dir)
+                if name.startswith("journal") and name.endswith(".log")
+            ]
+            for path in sorted(paths, key=os.path.getmtime):
+                if path in held:
+                    continue
+                journal = Journal(path)
+                if not journal.acquire():
+                    # Its process is still running
+                    continue
+                if os.path.getsize(path):
+                    logger.info(f"Adopting orphaned vector store journal {path}")
+                    self._adopted_journals.append(journal)
+                else:
+                    journal.remove()
+
+    def _replay_journal(self) -> int:
+        """Re-apply journaled changes that did not reach cloud storage"""
+        replayed = 0
+        for journal in self._journals():
+            records = list(journal.replay())
+            # Records up to a flush marker whose segment the manifest lists are
+            # in storage already. A flush of deletes only writes no segment and
+            # can't be told apart from a failed one; replaying its deletes is
+            # harmless.
+            listed = {segment["embeddings_key"] for segment in self.segments}
+            start = 0
+            for i, (header, _) in enumerate(records):
+                if header["op"] == "flush" and header["segment"] in listed:
+                    start = i + 1
+
+            journal_replayed = 0
+            for header, array in records[start:]:
+                try:
+                    if header["op"] == "add":
+                        self._apply_add(header["documents"], array)
+                    elif header["op"] == "delete":
+                        self._apply_document_delete(
+                            header["doc_id"],
+                            header.get("moved"),
+                            array,
+                            header.get("references"),
+                        )
+                    elif header["op"] == "references":
+                        self._apply_references(header["changes"])
+                    else:
+                        continue
+                except Exception as e:
+                    # One bad record must not cost the store every other change
+                    logger.error(
+                        f"Skipping journaled {header['op']} in {journal.path} "
+                        f"that could not be replayed: {e}"
+                    )
+                    continue
+                journal_replayed += 1
+            if not journal_replayed and journal is not self.journal:
+                # Everything in it was flushed before its process exited
+                journal.remove()
+                self._adopted_journals.remove(journal)
+            replayed += journal_replayed
+
+        if replayed:
+            logger.info(f"Replayed {replayed} journaled vector store changes")
+            self._pending_changes = replayed
+            self._first_pending_at = time.time()
+            self._schedule_flush()
+        return replayed
+
+    def _add_doc_rows(self, doc_ids: List[Optional[str]], first_row: int) -> None:
+        """Record the row ranges of the doc_ids of rows appended at first_row"""
+        run_start = 0
+        for i in range(1, len(doc_ids) + 1):
+            doc_id = doc_ids[run_start]
+            if i < len(doc_ids) and doc_ids[i] == doc_id:
+                continue
+            if doc_id is not None:
+                self.doc_rows.setdefault(doc_id, []).append(
+                    (first_row + run_start, first_row + i)
+                )
+            run_start = i
+
+    def _purge_deleted(self) -> None:
+        """Publish a snapshot without the deleted rows; the old one stays intact"""
+        snapshot = self._snapshot
+        keep_mask = ~snapshot.deleted
+        documents = snapshot.documents.select(keep_mask)
+        index = snapshot.index
+        if index is not None and index.is_trained:
+            index = index.select(keep_mask)
+        quantizer = snapshot.quantizer
+        if quantizer is not None and quantizer.is_trained:
+            quantizer = quantizer.select(keep_mask)
+
+        self._embedding_buffer = GrowableArray(snapshot.embeddings[keep_mask])
+        self._deleted_buffer = GrowableArray(np.zeros(len(documents), dtype=bool))
+        self._snapshot = StoreSnapshot(
+            documents,
+            self._embedding_buffer.view,
+            self._deleted_buffer.view,
+            0,
+            snapshot.metadata_index.select(keep_mask),
+            snapshot.lexical_index.select(keep_mask),
+            snapshot.fingerprint_index.select(keep_mask),
+            index,
+            quantizer,
+        )
+
+        logger.info(f"Compacted {snapshot.deleted_count} deleted rows out of memory")
+        self.doc_rows = {}
+        self._add_doc_rows(documents.values("doc_id"), 0)
+        # Only called right after a flush, so every remaining row is persisted
+        self._flushed_rows = len(documents)
+
+    def _empty_snapshot(self) -> StoreSnapshot:
+        return StoreSnapshot(
+            DocumentStore(),
+            self._embedding_buffer.view,
+            self._deleted_buffer.view,
+            0,
+            MetadataIndex(),
+            LexicalIndex(),
+            FingerprintIndex(),
+            self._new_index(),
+            self._new_quantizer(),
+        )
+
+    def _new_index(self) -> Optional[IVFIndex]:
+        if self.index_type != "ivf":
+            return None
+        return IVFIndex(nlist=self.nlist, nprobe=self.nprobe)
+
+    def _index_new_rows(
+        self, index: Optional[IVFIndex], embeddings: np.ndarray
+    ) -> Optional[IVFIndex]:
+        """Assign rows just appended to the store, training a new index when due"""
+        if index is None:
+            return None
+
+        all_embeddings = self._embedding_buffer.view
+        if not self._training_due(index.is_trained, index.trained_size, len(all_embeddings)):
+            if index.is_trained:
+                index.add(index.assign(embeddings))
+            return index
+
+        # Train (or retrain) a new index on every row, leaving the published
+        # one to in-flight searches; older segments keep their stale
+        # assignments until compaction and are re-assigned on load meanwhile.
+        # The centroids are uploaded with the next manifest.
+        index = self._new_index()
+        index.train(all_embeddings)
+        logger.info(
+            f"Trained IVF index with {len(index.centroids)} lists "
+            f"on {len(all_embeddings)} rows"
+        )
+        return index
 
-        if not indices_to_remove:
-            logger.warning(f"No documents with doc_id {doc_id} found in vector store")
-            return False  # No matching documents found
+    def _quantize_new_rows(
+        self, quantizer: Optional[Quantizer], embeddings: np.ndarray
+    ) -> Optional[Quantizer]:
+        """Encode rows just appended to the store, training a new quantizer when due"""
+        if quantizer is None:
+            return None
 
-        # Create a mask of documents to keep
-        keep_mask = np.ones(len(self.documents), dtype=bool)
-        for idx in indices_to_remove:
-            keep_mask[idx] = False
+        all_embeddings = self._embedding_buffer.view
+        if not self._training_due(
+            quantizer.is_trained, quantizer.trained_size, len(all_embeddings)
+        ):
+            if quantizer.is_trained:
+                quantizer.add(quantizer.encode(embeddings))
+            return quantizer
 
-        # Update documents and embeddings
-        self.documents = [d for i, d in enumerate(self.documents) if keep_mask[i]]
-        self.embeddings = self.embeddings[keep_mask]
+        quantizer = self._new_quantizer()
+        quantizer.train(all_embeddings)
+        logger.info(
+            f"Trained {self.quantization} quantizer on {len(all_embeddings)} rows "
+            f"({quantizer.bytes_per_vector} bytes per vector)"
+        )
+        return quantizer
+
+    def _training_due(self, is_trained: bool, trained_size: int, size: int) -> bool:
+        """Train once min_index_size rows exist, retrain after enough growth"""
+        if is_trained:
+            return size >= self.RETRAIN_GROWTH * trained_size
+        return size >= self.min_index_size
+
+    def _restore_index(
+        self,
+        ivf_manifest: Optional[Dict[str, Any]],
+        live_segments: List[Tuple[Dict[str, Any], np.ndarray]],
+        embeddings: np.ndarray,
+        object_store: ObjectStore,
+    ) -> Optional[IVFIndex]:
+        """Rebuild the IVF index from persisted centroids and segment assignments"""
+        index = self._new_index()
+        if index is None:
+            return None
+
+        if ivf_manifest is None:
+            if len(embeddings) >= self.min_index_size:
+                index.train(embeddings)
+            return index
+
+        index.load(
+            self._load_npy(ivf_manifest["centroids_key"], object_store=object_store),
+            ivf_manifest["version"],
+            ivf_manifest["trained_size"],
+        )
+
+        assignments = []
+        offset = 0
+        for segment, keep_mask in live_segments:
+            live_rows = int(keep_mask.sum())
+            if segment.get("ivf_version") == index.version:
+                assignments.append(
+                    self._load_npy(
+                        segment["ivf_key"],
+                        object_store=object_store,
+                        shards=self._shards(segment, "ivf_key"),
+                    )[keep_mask]
+                )
+            else:
+                assignments.append(index.assign(embeddings[offset : offset + live_rows]))
+            offset += live_rows
+
+        index.reset(
+            np.concatenate(assignments) if assignments else np.empty(0, dtype=np.int32)
+        )
+        return index
+
+    def _restore_quantizer(
+        self,
+        quantizer_manifest: Optional[Dict[str, Any]],
+        live_segments: List[Tuple[Dict[str, Any], np.ndarray]],
+        embeddings: np.ndarray,
+        object_store: ObjectStore,
+    ) -> Optional[Quantizer]:
+        """Rebuild quantized codes from persisted parameters and segment codes"""
+        quantizer = self._new_quantizer()
+        if quantizer is None:
+            return None
+
+        if quantizer_manifest is None or quantizer_manifest["type"] != quantizer.name:
+            if len(embeddings) >= self.min_index_size:
+                quantizer.train(embeddings)
+            return quantizer
+
+        quantizer.load(
+            self._load_npz(quantizer_manifest["key"], object_store),
+            quantizer_manifest["version"],
+            quantizer_manifest["trained_size"],
+        )
+
+        codes = []
+        offset = 0
+        for segment, keep_mask in live_segments:
+            live_rows = int(keep_mask.sum())
+            if segment.get("codes_version") == quantizer.version:
+                codes.append(
+                    self._load_npy(
+                        segment["codes_key"],
+                        object_store=object_store,
+                        shards=self._shards(segment, "codes_key"),
+                    )[keep_mask]
+                )
+            else:
+                codes.append(quantizer.encode(embeddings[offset : offset + live_rows]))
+            offset += live_rows
+
+        if codes:
+            quantizer.reset(np.concatenate(codes))
+        return quantizer
+
+    def _new_quantizer(self) -> Optional[Quantizer]:
+        if self.quantization is None:
+            return None
+        return QUANTIZERS[self.quantization]()
+
+    def _centroids_key(self, version: str) -> str:
+        return f"{self.ivf_prefix}{version}.npy"
+
+    def _quantizer_key(self, version: str) -> str:
+        return f"{self.quantizer_prefix}{version}.npz"
+
+    def _legacy_manifest(self) -> Optional[Dict[str, Any]]:
+        """Describe the legacy metadata.json/embeddings.npy pair as segment 0"""
+        if not self.object_store.exists(self.metadata_key):
+            print(f"Metadata file doesn't exist: {self.metadata_key}")
+            return None
+        if not self.object_store.exists(self.embeddings_key):
+            print(f"Embeddings file doesn't exist: {self.embeddings_key}")
+            return None
+
+        return {
+            "version": self.MANIFEST_VERSION,
+            "next_seq": 1,
+            "segments": [
+                {
+                    "seq": 0,
+                    "metadata_key": self.metadata_key,
+                    "embeddings_key": self.embeddings_key,
+                }
+            ],
+            "tombstones": {},
+        }
+
+    def _read_segment(
+        self, segment: Dict[str, Any], object_store: ObjectStore
+    ) -> Tuple[DocumentStore, np.ndarray]:
+        """Load one segment's documents and embeddings"""
+        metadata_shards = self._shards(segment, "metadata_key")
+        path = self._local_path(segment["metadata_key"], object_store, metadata_shards)
+        if segment.get("metadata_format") == self.METADATA_FORMAT:
+            if path is not None:
+                # Columns stay in the page cache until a row is touched
+                documents = DocumentStore.from_bytes(np.memmap(path, mode="r"))
+            else:
+                documents = DocumentStore.from_bytes(
+                    self._get_object(segment["metadata_key"], object_store, metadata_shards)
+                )
+        else:
+            # JSON segments written before the columnar format
+            if path is not None:
+                with open(path, "rb") as f:
+                    document_list = json.load(f)
+            else:
+                metadata_content = object_store.get(segment["metadata_key"])
+                document_list = json.loads(metadata_content.decode("utf-8"))
+            documents = DocumentStore()
+            documents.extend(document_list)
+
+        embeddings = self._load_npy(
+            segment["embeddings_key"],
+            mmap=True,
+            object_store=object_store,
+            shards=self._shards(segment, "embeddings_key"),
+        )
+
+        return documents, embeddings.reshape(len(documents), -1) if len(documents) else embeddings
+
+    def _load_npy(
+        self,
+        key: str,
+        mmap: bool = False,
+        object_store: Optional[ObjectStore] = None,
+        shards: Optional[Dict[str, Any]] = None,
+    ) -> np.ndarray:
+        """Load an .npy blob, through a local file when there is one"""
+        object_store = object_store or self.object_store
+        path = self._local_path(key, object_store, shards)
+        if path is not None:
+            # Pages are loaded on demand and shared between processes by the OS
+            return np.load(path, mmap_mode="r" if mmap else None)
+
+        content = self._get_object(key, object_store, shards)
+        return np.load(io.BytesIO(content))
+
+    def _get_object(
+        self, key: str, object_store: ObjectStore, shards: Optional[Dict[str, Any]]
+    ):
+        """An object's contents, fetched as parallel verified shards when it has them"""
+        if shards is not None:
+            return self.transfer.download(object_store, key, shards)
+        return object_store.get(key)
+
+    @staticmethod
+    def _shards(segment: Dict[str, Any], key_field: str) -> Optional[Dict[str, Any]]:
+        """Shard layout of a segment file, None if it was uploaded in one piece"""
+        return segment.get("shards", {}).get(segment.get(key_field))
+
+    def _load_npz(
+        self, key: str, object_store: Optional[ObjectStore] = None
+    ) -> Dict[str, np.ndarray]:
+        object_store = object_store or self.object_store
+        path = self._local_path(key, object_store)
+        if path is not None:
+            with np.load(path) as arrays:
+                return dict(arrays)
+
+        content = object_store.get(key)
+        with np.load(io.BytesIO(content)) as arrays:
+            return dict(arrays)
+
+    def _upload_npz(
+        self,
+        key: str,
+        arrays: Dict[str, np.ndarray],
+        object_store: Optional[ObjectStore] = None,
+    ) -> None:
+        array_bytes = io.BytesIO()
+        np.savez(array_bytes, **arrays)
+        (object_store or self.object_store).put(
+            key, array_bytes.getvalue(), content_type="application/octet-stream"
+        )
+
+    def _upload_npy(
+        self, key: str, array: np.ndarray, object_store: Optional[ObjectStore] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Upload an array as an .npy blob; returns its shard layout if it was sharded"""
+        array_bytes = io.BytesIO()
+        np.save(array_bytes, array)
+        return self.transfer.upload(
+            object_store or self.object_store,
+            key,
+            array_bytes.getvalue(),
+            content_type="application/octet-stream",
+        )
+
+    def _local_path(
+        self,
+        key: str,
+        object_store: ObjectStore,
+        shards: Optional[Dict[str, Any]] = None,
+    ) -> Optional[str]:
+        """Local file with an object's contents: the backend's own or a cached copy"""
+        path = object_store.local_path(key)
+        if path is None and self.local_cache_dir and object_store is self.object_store:
+            path = self._cached_path(key, shards)
+        return path
+
+    def _delete_objects(self, keys, object_store: Optional[ObjectStore] = None) -> None:
+        object_store = object_store or self.object_store
+        for key in keys:
+            object_store.delete(key)
+
+    @staticmethod
+    def _segment_keys(segment: Dict[str, Any]) -> List[str]:
+        keys = [segment["metadata_key"], segment["embeddings_key"]]
+        for optional_key in ("ivf_key", "codes_key", "fingerprints_key"):
+            if segment.get(optional_key):
+                keys.append(segment[optional_key])
+        return keys
+
+    def _cached_path(self, key: str, shards: Optional[Dict[str, Any]] = None) -> str:
+        """Local copy of a blob, downloaded again only when its generation changes"""
+        path = os.path.join(self.local_cache_dir, key)
+        generation_path = f"{path}.generation"
+
+        generation = self.object_store.generation(key)
+        if generation is None:
+            raise ObjectNotFound(key)
+        generation = str(generation)
+
+        if os.path.exists(path) and os.path.exists(generation_path):
+            with open(generation_path) as f:
+                if f.read().strip() == generation:
+                    return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(generation_path):
+            os.remove(generation_path)
+
+        if shards is not None:
+            # Shards are verified as they arrive; an interrupted download
+            # resumes with the shards it is missing. Locked, since processes
+            # sharing the cache would otherwise write the same partial file.
+            with file_lock(f"{path}.lock"):
+                self.transfer.download_to_filename(self.object_store, key, shards, path)
+        else:
+            # Stream to a temporary file so a partial download is never reused
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                self.object_store.download_to_filename(key, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        with open(generation_path, "w") as f:
+            f.write(generation)
+        logger.info(f"Cached {key} (generation {generation}) in {self.local_cache_dir}")
+        return path
+
+    def _prune_local_cache(self) -> None:
+        """Remove cached segment files no longer listed in the manifest"""
+        segments_dir = os.path.join(self.local_cache_dir, self.segments_prefix)
+        if not os.path.isdir(segments_dir):
+            return
+
+        live_keys = {key for segment in self.segments for key in self._segment_keys(segment)}
+
+        for filename in os.listdir(segments_dir):
+            key = f"{self.segments_prefix}{filename}"
+            for suffix in (".generation", ".partial", ".lock"):
+                key = key.removesuffix(suffix)
+            if key not in live_keys:
+                try:
+                    os.remove(os.path.join(segments_dir, filename))
+                except OSError as e:
+                    logger.warning(f"Could not remove stale cache file {filename}: {e}")
+
+    def _write_segment(
+        self,
+        seq: int,
+        documents: DocumentStore,
+        embeddings: np.ndarray,
+        assignments: Optional[np.ndarray] = None,
+        ivf_version: Optional[str] = None,
+        codes: Optional[np.ndarray] = None,
+        codes_version: Optional[str] = None,
+        fingerprints: Optional[np.ndarray] = None,
+        object_store: Optional[ObjectStore] = None,
+    ) -> Dict[str, Any]:
+        """Upload documents and embeddings as a new immutable segment"""
+        object_store = object_store or self.object_store
+        # The random suffix keeps a compacted segment from overwriting its inputs
+        name = f"{self.segments_prefix}{seq:08d}-{uuid.uuid4().hex[:8]}"
+        segment = {
+            "seq": seq,
+            "count": len(documents),
+            "normalized": True,
+            "metadata_key": f"{name}.docs",
+            "metadata_format": self.METADATA_FORMAT,
+            "embeddings_key": f"{name}.npy",
+        }
+
+        shards = {
+            segment["metadata_key"]: self.transfer.upload(
+                object_store,
+                segment["metadata_key"],
+                documents.to_bytes(),
+                content_type="application/octet-stream",
+            ),
+            segment["embeddings_key"]: self._upload_npy(
+                segment["embeddings_key"], embeddings, object_store
+            ),
+        }
+
+        # IVF list assignments are only valid for the centroids they came from
+        if assignments is not None:
+            segment["ivf_version"] = ivf_version
+            segment["ivf_key"] = f"{name}.ivf.npy"
+            shards[segment["ivf_key"]] = self._upload_npy(
+                segment["ivf_key"], assignments, object_store
+            )
+        if codes is not None:
+            segment["codes_version"] = codes_version
+            segment["codes_key"] = f"{name}.codes.npy"
+            shards[segment["codes_key"]] = self._upload_npy(
+                segment["codes_key"], codes, object_store
+            )
+        if fingerprints is not None:
+            segment["fingerprints_version"] = FingerprintIndex.VERSION
+            segment["fingerprints_key"] = f"{name}.fp.npy"
+            shards[segment["fingerprints_key"]] = self._upload_npy(
+                segment["fingerprints_key"], fingerprints, object_store
+            )
+
+        shards = {key: layout for key, layout in shards.items() if layout is not None}
+        if shards:
+            segment["shards"] = shards
+        return segment
+
+    def _write_manifest(self, change: Callable[[Dict[str, Any]], None]) -> None:
+        """Apply a change to the manifest and upload it: the commit point for segment changes.
+
+        The upload is conditional on the manifest in storage still being the
+        generation this store last read or wrote. If another instance wrote
+        in between, its manifest is read and the change applied again on top,
+        so neither instance's segments and tombstones are lost.
+        """
+        index, quantizer = self.index, self.quantizer
+        ivf_version = index.version if index is not None and index.is_trained else None
+        quantizer_version = (
+            quantizer.version if quantizer is not None and quantizer.is_trained else None
+        )
+
+        # Parameters trained since the last manifest are uploaded before it
+        if ivf_version and ivf_version != self._manifest_ivf_version:
+            self._upload_npy(self._centroids_key(ivf_version), index.centroids)
+        if quantizer_version and quantizer_version != self._manifest_quantizer_version:
+            self._upload_npz(self._quantizer_key(quantizer_version), quantizer.state())
+
+        base = self._manifest or self._empty_manifest()
+        generation = self._manifest_generation
+        for _ in range(self.MANIFEST_WRITE_ATTEMPTS):
+            # A copy, so a rejected attempt leaves the base untouched
+            manifest = json.loads(json.dumps(base))
+            change(manifest)
+            manifest["version"] = self.MANIFEST_VERSION
+            manifest.pop("ivf", None)
+            manifest.pop("quantizer", None)
+            if ivf_version:
+                manifest["ivf"] = {
+                    "version": ivf_version,
+                    "centroids_key": self._centroids_key(ivf_version),
+                    "trained_size": index.trained_size,
+                }
+            if quantizer_version:
+                manifest["quantizer"] = {
+                    "type": quantizer.name,
+                    "version": quantizer_version,
+                    "key": self._quantizer_key(quantizer_version),
+                    "trained_size": quantizer.trained_size,
+                }
+            try:
+                generation = self.object_store.put(
+                    self.manifest_key,
+                    json.dumps(manifest).encode("utf-8"),
+                    content_type="application/json",
+                    # 0: only if no manifest exists yet
+                    if_generation_match=generation or 0,
+                )
+                break
+            except PreconditionFailed:
+                self._manifest_conflicts += 1
+                logger.info("Manifest was changed by another instance; re-applying on top")
+                base, generation = self._fetch_manifest()
+        else:
+            raise PreconditionFailed(self.manifest_key)
+        self._set_manifest(manifest, generation)
+
+        # Retraining replaced the parameters referenced by the old manifest
+        stale_keys = []
+        if self._manifest_ivf_version and self._manifest_ivf_version != ivf_version:
+            stale_keys.append(self._centroids_key(self._manifest_ivf_version))
+        if (
+            self._manifest_quantizer_version
+            and self._manifest_quantizer_version != quantizer_version
+        ):
+            stale_keys.append(self._quantizer_key(self._manifest_quantizer_version))
+        self._manifest_ivf_version = ivf_version
+        self._manifest_quantizer_version = quantizer_version
+        self._delete_objects(stale_keys)
+
+    def _set_manifest(self, manifest: Dict[str, Any], generation: Optional[int]) -> None:
+        self._manifest = manifest
+        self._manifest_generation = generation
+        self.segments = manifest["segments"]
+        self.tombstones = manifest["tombstones"]
+        self.next_seq = manifest["next_seq"]
+        # A copy, with the changes not flushed yet applied on top
+        self.references = json.loads(json.dumps(manifest.get("references", {})))
+        self._change_references(self.references, self._pending_references)
+        self._index_references()
+
+    def _fetch_manifest(self) -> Tuple[Dict[str, Any], int]:
+        """The manifest in storage and its generation (0 if there is none yet)"""
+        # Read before the contents: at worst the contents are newer, which
+        # only makes a conditional write against the generation fail again
+        generation = self.object_store.generation(self.manifest_key)
+        if generation is None:
+            return self._legacy_manifest() or self._empty_manifest(), 0
+        try:
+            content = self.object_store.get(self.manifest_key)
+        except ObjectNotFound:
+            return self._empty_manifest(), 0
+        return json.loads(content.decode("utf-8")), generation
+
+    def _empty_manifest(self) -> Dict[str, Any]:
+        return {
+            "version": self.MANIFEST_VERSION,
+            "next_seq": 1,
+            "segments": [],
+            "tombstones": {},
+        }
+
+    def _behind_manifest(self) -> bool:
+        """Whether the manifest lists segments or tombstones not applied in memory"""
+        return set(self._applied_segments) != {
+            segment["embeddings_key"] for segment in self.segments
+        } or any(
+            self._applied_tombstones.get(doc_id) != tombstone_seq
+            for doc_id, tombstone_seq in self.tombstones.items()
+        )
 
-        logger.info(f"Removed {len(indices_to_remove)} embeddings for doc_id {doc_id}")
+    @staticmethod
+    def _live_mask(
+        doc_ids: List[Optional[str]],
+        segment_seq: int,
+        tombstones: Dict[str, int],
+    ) -> np.ndarray:
+        """Mask of segment rows not hidden by a later tombstone"""
+        keep_mask = np.ones(len(doc_ids), dtype=bool)
+        if tombstones:
+            for i, doc_id in enumerate(doc_ids):
+                tombstone_seq = tombstones.get(doc_id)
+                if tombstone_seq is not None and segment_seq < tombstone_seq:
+                    keep_mask[i] = False
+        return keep_mask
 
-        # Sync to cloud storage
-        return self.save_to_cloud()
+    @staticmethod
+    def _doc_id(document: Dict[str, Any]) -> Optional[str]:
+        return (document.get("metadata") or {}).get("doc_id")
@@ -41,6 +41,67 @@ class Settings(BaseSettings):
     GCP_PROJECT_ID: str
     GOOGLE_LOCATION: str = "us-east1"
     GCS_BUCKET_NAME: str
+    # Object storage for documents and vector stores: "gcs", or "local" to
+    # keep everything under STORAGE_LOCAL_ROOT (offline runs and load tests)
+    STORAGE_BACKEND: str = "gcs"
+    STORAGE_LOCAL_ROOT: Optional[str] = None
+    # Local directory for memory-mapped vector store snapshots (disabled if unset)
+    VECTOR_STORE_CACHE_DIR: Optional[str] = None
+    # Vector store index: "flat" (exact scan) or "ivf" (approximate)
+    VECTOR_STORE_INDEX: str = "flat"
+    VECTOR_STORE_NPROBE: int = 8
+    # Optional compact codes for scanning: "int8" or "pq"
+    VECTOR_STORE_QUANTIZATION: Optional[str] = None
+    # Write-behind persistence: journal changes locally and flush them to
+    # storage together after N changes or T seconds (or on /embeddings/sync)
+    VECTOR_STORE_WRITE_BEHIND: bool = False
+    VECTOR_STORE_FLUSH_MAX_PENDING: int = 50
+    VECTOR_STORE_FLUSH_INTERVAL: float = 30.0
+    # Journal location (defaults to VECTOR_STORE_CACHE_DIR)
+    VECTOR_STORE_JOURNAL_DIR: Optional[str] = None
+    # Host-wide snapshot that worker processes memory-map instead of each
+    # loading their own copy, e.g. /dev/shm/vector-store (disabled if unset);
+    # workers check for newer snapshots every VECTOR_STORE_SHARED_POLL_INTERVAL seconds
+    VECTOR_STORE_SHARED_DIR: Optional[str] = None
+    VECTOR_STORE_SHARED_POLL_INTERVAL: float = 2.0
+    # Seconds between checks for segments written by other instances to the
+    # same collection (0 disables; their writes are never lost either way)
+    VECTOR_STORE_REFRESH_INTERVAL: float = 30.0
+    # Segment files above this size move as checksummed shards over
+    # VECTOR_STORE_TRANSFER_WORKERS parallel connections
+    VECTOR_STORE_TRANSFER_SHARD_MB: int = 32
+    VECTOR_STORE_TRANSFER_WORKERS: int = 8
+    # Collection used when a request names none (stored under "embeddings/")
+    VECTOR_STORE_DEFAULT_COLLECTION: str = "default"
+    # Unload idle collections once loaded ones exceed this many MB (unlimited if unset)
+    VECTOR_STORE_MEMORY_BUDGET_MB: Optional[int] = None
+    # ... or once more than this many collections are loaded (unlimited if unset)
+    VECTOR_STORE_MAX_COLLECTIONS: Optional[int] = 16
+    # Don't store uploaded chunks that exactly duplicate stored ones; the
+    # document references the stored chunk instead. Near duplicates are only
+    # reported unless INGEST_SKIP_NEAR_DUPLICATES is set too, since a chunk
+    # revised in a single fact still counts as a near duplicate.
+    INGEST_SKIP_DUPLICATES: bool = True
+    INGEST_SKIP_NEAR_DUPLICATES: bool = False
+    # Embedding encodes running at once on the dedicated executor; more queue
+    EMBEDDING_MAX_CONCURRENCY: int = 2
+    # Concurrent embedding calls are encoded together: up to this many texts,
+    # waiting at most this long for others to join
+    EMBEDDING_MAX_BATCH_SIZE: int = 32
+    EMBEDDING_MAX_WAIT_MS: float = 5.0
+    # Memory for cached query embeddings (0 disables) and how many seconds
+    # they stay valid (0: until evicted)
+    EMBEDDING_CACHE_MB: int = 64
+    EMBEDDING_CACHE_TTL: float = 0.0
+    # Persistent cache of document chunk embeddings by text hash, so
+    # re-ingested chunks are not encoded again; kept in object storage under
+    # "embedding-cache/", or in EMBEDDING_CHUNK_CACHE_DIR on local disk
+    EMBEDDING_CHUNK_CACHE: bool = True
+    EMBEDDING_CHUNK_CACHE_DIR: Optional[str] = None
+    # Local copies of chunk cache files kept in object storage, memory-mapped
+    # from there (defaults to VECTOR_STORE_CACHE_DIR, else ~/.cache); on Cloud
+    # Run point it at a mounted volume, as the container filesystem is in memory
+    EMBEDDING_CHUNK_CACHE_LOCAL_DIR: Optional[str] = None
 
     HF_TOKEN: Optional[str] = None
     # Chat settings
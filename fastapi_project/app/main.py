@@ -17,8 +17,7 @@ from app.apps.image_generation.services.image_generation_service import (
     ImageGenerationService,
 )
 from app.apps.image_generation.api import router as image_router, setup_image_store
-from app.apps.rag.services.embedding_service import EmbeddingService
-from app.apps.rag.utils.vector_store import CloudVectorStore
+from app.apps.rag.api import embedding_service, vector_stores
 import os
 
 # Configure logging
@@ -41,12 +40,8 @@ async def lifespan(app: FastAPI):
     print(f"Starting application in {app_env} mode")
     logger.info(f"Application environment: {app_env}")
 
-    # Get environment variables for Google Cloud Storage
-    BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", settings.GCS_BUCKET_NAME)
-    GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", settings.GCP_PROJECT_ID)
-
-    logger.info(f"Initializing with GCP_PROJECT_ID: {GCP_PROJECT_ID}")
-    logger.info(f"Using bucket: {BUCKET_NAME}")
+    logger.info(f"Initializing with GCP_PROJECT_ID: {settings.GCP_PROJECT_ID}")
+    logger.info(f"Using bucket: {settings.GCS_BUCKET_NAME}")
 
     # Initialize Gemini service
     gemini_api_key = settings.GEMINI_API_KEY
@@ -54,16 +49,11 @@ async def lifespan(app: FastAPI):
     app.state.chat_service = GeminiChatService(genai_client)
 
     # Initialize the image generation service with Vertex AI
-    app.state.image_generation_service = (
-        ImageGenerationService()
-    )  # Initialize RAG services
-    app.state.embedding_service = EmbeddingService()
-    app.state.vector_store = CloudVectorStore(
-        bucket_name=BUCKET_NAME, project_id=GCP_PROJECT_ID
-    )
-
-    # Load embeddings from cloud storage
-    app.state.vector_store.load_from_cloud()
+    app.state.image_generation_service = ImageGenerationService()
+    # The RAG services are built once, with the RAG router, which also loads
+    # the default collection on startup and flushes the stores on shutdown
+    app.state.embedding_service = embedding_service
+    app.state.vector_stores = vector_stores
 
     # Setup image store with cleanup task
     setup_image_store(app)
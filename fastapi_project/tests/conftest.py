@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from app.apps.rag.utils.storage import LocalObjectStore
+from app.apps.rag.utils.vector_store import CloudVectorStore
+
+
+@pytest.fixture
+def object_store(tmp_path):
+    return LocalObjectStore(str(tmp_path / "storage"))
+
+
+@pytest.fixture
+def make_store(object_store, tmp_path):
+    """Factory of vector stores on one shared object store, closed after the test"""
+    stores = []
+
+    def make(**options) -> CloudVectorStore:
+        if options.get("write_behind"):
+            options.setdefault("journal_dir", str(tmp_path / "journal"))
+        store = CloudVectorStore(
+            bucket_name="test",
+            project_id="test",
+            object_store=options.pop("object_store", object_store),
+            **options,
+        )
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def chunks(doc_id, texts, **metadata):
+    """Documents for the chunks of one document, as the API builds them"""
+    return [
+        {"text": text, "metadata": dict(metadata, doc_id=doc_id, chunk_index=i)}
+        for i, text in enumerate(texts)
+    ]
+
+
+def unit_vectors(count, dim=8, seed=0):
+    """Random, well separated embeddings"""
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+def crash(store: CloudVectorStore) -> None:
+    """Leave a write-behind store as if its process died before flushing"""
+    with store._manifest_lock:
+        store._pending_changes = 0
+        store.journal.close()
+        store.journal = None
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from app.apps.rag.utils.buffers import GrowableArray, RowChunks
+
+from conftest import chunks, unit_vectors
+
+
+def mapped(tmp_path, array):
+    path = str(tmp_path / "rows.npy")
+    np.save(path, array)
+    return np.load(path, mmap_mode="r")
+
+
+def test_append_keeps_a_read_only_base_mapped(tmp_path):
+    rows = np.arange(12, dtype=np.float32).reshape(6, 2)
+    base = mapped(tmp_path, rows)
+    array = GrowableArray(base)
+    assert array.view is base
+
+    array.append(-rows[:3])
+    view = array.view
+    assert isinstance(view, RowChunks)
+    assert view.chunks[0] is base
+    assert len(array) == len(view) == 9
+    assert view.shape == (9, 2)
+
+    expected = np.vstack([rows, -rows[:3]])
+    np.testing.assert_array_equal(np.asarray(view), expected)
+    np.testing.assert_array_equal(view[7], expected[7])
+    np.testing.assert_array_equal(view[-1], expected[-1])
+    np.testing.assert_array_equal(view[4:8], expected[4:8])
+    assert np.shares_memory(view[1:3], base)
+    np.testing.assert_array_equal(view[[8, 0, 6]], expected[[8, 0, 6]])
+    mask = np.arange(9) % 2 == 0
+    np.testing.assert_array_equal(view[mask], expected[mask])
+    np.testing.assert_array_equal(view @ np.ones(2, dtype=np.float32), expected.sum(axis=1))
+    np.testing.assert_array_equal(view != 0, expected != 0)
+    assert view.tolist() == expected.tolist()
+    with pytest.raises(IndexError):
+        view[9]
+
+
+def test_views_taken_before_an_append_stay_valid(tmp_path):
+    base = mapped(tmp_path, np.arange(4, dtype=np.int64))
+    array = GrowableArray(base, min_capacity=2)
+    array.append([4])
+    before = array.view
+    for value in range(5, 40):
+        array.append([value])
+    assert before.tolist() == [0, 1, 2, 3, 4]
+    assert array.view.tolist() == list(range(40))
+
+
+def test_search_reads_mapped_and_appended_rows(make_store):
+    embeddings = unit_vectors(6)
+    store = make_store()
+    store.add_documents(chunks("a", ["one", "two", "three", "four"]), embeddings[:4])
+    assert store.save_to_cloud()
+
+    reloaded = make_store()
+    assert reloaded.load_from_cloud()
+    reloaded.add_documents(chunks("b", ["five", "six"]), embeddings[4:])
+    # The loaded rows are still read from their segment file
+    assert isinstance(reloaded.embeddings, RowChunks)
+    assert isinstance(reloaded.embeddings.chunks[0], np.memmap)
+
+    for row, text in enumerate(["one", "two", "three", "four", "five", "six"]):
+        results = reloaded.search(embeddings[row], top_k=2)
+        assert results[0]["document"]["text"] == text
+    assert reloaded.search(embeddings[5], top_k=1, filters={"doc_id": "b"})[0][
+        "document"
+    ]["text"] == "six"
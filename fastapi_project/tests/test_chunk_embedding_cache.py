@@ -0,0 +1,50 @@
+import numpy as np
+
+from app.apps.rag.utils.block_file import BlockFile
+from app.apps.rag.utils.chunk_embedding_cache import ChunkEmbeddingCache
+from app.apps.rag.utils.storage import LocalObjectStore
+
+
+class RemoteObjectStore(LocalObjectStore):
+    """Local storage without local files, like GCS; counts the entries written"""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.entries_written = 0
+
+    def local_path(self, key):
+        return None
+
+    def put(self, key, data, content_type=None):
+        self.entries_written += BlockFile(
+            np.frombuffer(data, dtype=np.uint8)
+        ).attributes["rows"]
+        return super().put(key, data, content_type=content_type)
+
+
+def test_merges_similarly_sized_files(tmp_path):
+    store = RemoteObjectStore(str(tmp_path / "storage"))
+    cache = ChunkEmbeddingCache(store, "model", local_cache_dir=str(tmp_path / "local"))
+    for i in range(256):
+        cache.append([f"text {i}"], np.full((1, 3), i, dtype=np.float32))
+
+    # Merging everything on every compaction would rewrite O(n^2) entries
+    assert store.entries_written <= 256 * 5
+    assert cache.stats()["files"] <= 3 * 4
+    found = ChunkEmbeddingCache(store, "model", local_cache_dir=str(tmp_path / "other")).lookup(
+        [f"text {i}" for i in range(256)] + ["missing"]
+    )
+    assert found[-1] is None
+    assert all(np.allclose(vector, i) for i, vector in enumerate(found[:-1]))
+
+
+def test_copies_default_to_the_user_cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    store = RemoteObjectStore(str(tmp_path / "storage"))
+    cache = ChunkEmbeddingCache(store, "model")
+    assert cache.local_cache_dir == str(tmp_path / "cache" / "embedding-cache")
+
+    cache.append(["a"], np.ones((1, 3), dtype=np.float32))
+    assert cache._copies
+    (key,) = cache._copies
+    assert (tmp_path / "cache" / "embedding-cache" / key).exists()
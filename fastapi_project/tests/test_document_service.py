@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+# The parser's dependencies are needed to import the service
+for module in ("docx", "PyPDF2", "langchain.text_splitter"):
+    pytest.importorskip(module)
+
+from app.apps.rag.services.document_service import REGISTRY_KEY, DocumentService
+
+
+@pytest.fixture
+def service(object_store):
+    return DocumentService("test", "test", object_store=object_store)
+
+
+def upload(service, count, prefix="doc"):
+    return [
+        service.upload_document(f"{prefix} {i}".encode(), f"{prefix}{i}.txt")["doc_id"]
+        for i in range(count)
+    ]
+
+
+def test_delete_removes_only_that_document(service):
+    doc_ids = upload(service, 3)
+
+    assert service.delete_document(doc_ids[1])
+    assert service.get_document(doc_ids[1]) is None
+    assert [doc["doc_id"] for doc in service.list_documents()] == [doc_ids[0], doc_ids[2]]
+    assert service.get_document(doc_ids[2])["doc_id"] == doc_ids[2]
+    assert not service.delete_document(doc_ids[1])
+
+
+def test_failed_registry_upload_keeps_the_cached_registry(service, object_store, monkeypatch):
+    doc_ids = upload(service, 2)
+    put = object_store.put
+
+    def failing_put(key, *args, **kwargs):
+        if key == REGISTRY_KEY:
+            raise RuntimeError("storage unavailable")
+        return put(key, *args, **kwargs)
+
+    monkeypatch.setattr(object_store, "put", failing_put)
+    assert not service.delete_document(doc_ids[0])
+    monkeypatch.undo()
+
+    assert service.get_document(doc_ids[0])["doc_id"] == doc_ids[0]
+
+
+def test_concurrent_instances_keep_every_change(service, object_store):
+    kept = upload(service, 2)
+    other = DocumentService("test", "test", object_store=object_store)
+    uploaded = []
+
+    def add(instance, i):
+        uploaded.append(upload(instance, 1, prefix=f"new{i}-")[0])
+
+    threads = [
+        threading.Thread(target=add, args=(service if i % 2 else other, i))
+        for i in range(10)
+    ]
+    threads.append(threading.Thread(target=other.delete_document, args=(kept[0],)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    fresh = DocumentService("test", "test", object_store=object_store)
+    assert {doc["doc_id"] for doc in fresh.list_documents()} == set(uploaded) | {kept[1]}
@@ -0,0 +1,99 @@
+import numpy as np
+
+from app.apps.rag.utils.fingerprints import FingerprintIndex
+
+from conftest import chunks, unit_vectors
+
+LONG = "the refund is issued to the original card within five business days"
+
+
+def test_exact_fingerprints_keep_punctuation_and_signs():
+    exact = FingerprintIndex.fingerprint(
+        ["-$10", "$10", "1.5", "15", "Refund  status", "refund status\n"]
+    )[:, 0]
+    assert exact[0] != exact[1]
+    assert exact[2] != exact[3]
+    # Only case and whitespace are normalized away
+    assert exact[4] == exact[5]
+
+
+def test_near_duplicates_are_found_by_words():
+    index = FingerprintIndex()
+    index.add(FingerprintIndex.fingerprint([LONG]))
+    assert index.match(FingerprintIndex.fingerprint([LONG + "!"])[0]) == ("near", 0)
+    assert index.match(FingerprintIndex.fingerprint([LONG.upper()])[0]) == ("exact", 0)
+
+
+def test_find_duplicates_tells_amounts_apart(make_store):
+    store = make_store()
+    store.add_documents(chunks("a", ["Fee: -$10"]), unit_vectors(1))
+    found = store.find_duplicates(["Fee: $10", "fee:  -$10"])
+    assert found[0] is None
+    assert found[1]["match"] == "exact" and found[1]["doc_id"] == "a"
+
+
+def texts(results):
+    return [result["document"]["text"] for result in results]
+
+
+def test_references_are_visible_to_doc_id_filters(make_store):
+    store = make_store()
+    embeddings = unit_vectors(3)
+    store.add_documents(chunks("a", ["shared", "only a"]), embeddings[:2])
+    store.add_documents(chunks("b", ["only b"]), embeddings[2:])
+    # b's first chunk duplicates a's first one and is not stored again
+    assert store.add_references("b", [("a", 0, 1)]) == []
+
+    assert sorted(texts(store.search(embeddings[0], top_k=5, filters={"doc_id": "b"}))) == [
+        "only b",
+        "shared",
+    ]
+    assert sorted(texts(store.search(embeddings[0], top_k=5, filters={"doc_id": "a"}))) == [
+        "only a",
+        "shared",
+    ]
+
+    # Deleting the owner keeps the shared chunk, now under b
+    assert store.delete_documents_by_id("a")
+    results = store.search(embeddings[0], top_k=5, filters={"doc_id": "b"})
+    assert sorted(texts(results)) == ["only b", "shared"]
+    assert {result["document"]["metadata"]["doc_id"] for result in results} == {"b"}
+    assert store.search(embeddings[0], top_k=5, filters={"doc_id": "a"}) == []
+
+
+def test_deleting_the_referrer_keeps_the_owner(make_store):
+    store = make_store()
+    embeddings = unit_vectors(2)
+    store.add_documents(chunks("a", ["shared"]), embeddings[:1])
+    store.add_documents(chunks("b", ["only b"]), embeddings[1:])
+    store.add_references("b", [("a", 0, 1)])
+
+    assert store.delete_documents_by_id("b")
+    assert store.search(embeddings[0], top_k=5, filters={"doc_id": "b"}) == []
+    assert texts(store.search(embeddings[0], top_k=5, filters={"doc_id": "a"})) == ["shared"]
+    assert store.references == {}
+
+
+def test_references_survive_a_reload(make_store):
+    store = make_store()
+    embeddings = unit_vectors(2)
+    store.add_documents(chunks("a", ["shared"]), embeddings[:1])
+    store.add_documents(chunks("b", ["only b"]), embeddings[1:])
+    store.add_references("b", [("a", 0, 1)])
+
+    restarted = make_store()
+    assert restarted.load_from_cloud()
+    assert sorted(
+        texts(restarted.search(embeddings[0], top_k=5, filters={"doc_id": "b"}))
+    ) == ["only b", "shared"]
+    # Compaction renumbers the rows, references included
+    assert restarted.delete_documents_by_id("b")
+    restarted.add_documents(chunks("c", ["other"]), unit_vectors(1, seed=1))
+    restarted.add_references("c", [("a", 0, 1)])
+    assert restarted.compact()
+    assert sorted(
+        texts(restarted.search(embeddings[0], top_k=5, filters={"doc_id": "c"}))
+    ) == ["other", "shared"]
+    assert np.isclose(
+        restarted.search(embeddings[0], top_k=1, filters={"doc_id": "c"})[0]["score"], 1.0
+    )
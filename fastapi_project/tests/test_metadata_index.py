@@ -0,0 +1,69 @@
+import math
+
+import numpy as np
+
+from app.apps.rag.utils.metadata_index import MetadataIndex
+
+from conftest import chunks, crash, unit_vectors
+
+
+def test_filters_by_keyword_and_range():
+    index = MetadataIndex()
+    index.add(
+        [
+            {"metadata": {"doc_id": "a", "page": 1, "upload_time": "2025-01-01T00:00:00"}},
+            {"metadata": {"doc_id": "b", "page": 2, "upload_time": "2025-06-01T00:00:00"}},
+            {"metadata": {"doc_id": "b", "page": 3}},
+        ]
+    )
+
+    assert index.rows({"doc_id": "b"}).tolist() == [1, 2]
+    assert index.rows({"doc_id": ["a", "b"], "page": {"gte": 2}}).tolist() == [1, 2]
+    assert index.rows({"upload_time": {"lt": "2025-03-01T00:00:00"}}).tolist() == [0]
+
+
+def test_unparseable_range_values_are_left_out():
+    index = MetadataIndex()
+    index.add(
+        [
+            {"metadata": {"page": "first", "upload_time": "yesterday"}},
+            {"metadata": {"page": 2, "chunk_index": {"nested": True}}},
+        ]
+    )
+
+    assert index.size == 2
+    assert index.rows({"page": {"gte": 0}}).tolist() == [1]
+    assert index.rows({"upload_time": {"gte": 0}}).tolist() == []
+    assert math.isnan(MetadataIndex._to_number("first"))
+
+
+def test_bad_metadata_value_does_not_break_add(make_store):
+    store = make_store()
+    embeddings = unit_vectors(3)
+    store.add_documents(chunks("a", ["alpha"]), embeddings[:1])
+    store.add_documents(chunks("b", ["bad"], page="first"), embeddings[1:2])
+    store.add_documents(chunks("c", ["gamma"]), embeddings[2:])
+
+    assert len(store.documents) == len(store.embeddings) == 3
+    top = store.search(embeddings[2], top_k=1)[0]["document"]
+    assert top["text"] == "gamma"
+    filtered = store.search(embeddings[0], top_k=3, filters={"doc_id": "c"})
+    assert [result["document"]["text"] for result in filtered] == ["gamma"]
+    # The raw value is kept with the document
+    bad = store.search(embeddings[1], top_k=1, filters={"doc_id": "b"})[0]["document"]
+    assert bad["metadata"]["page"] == "first"
+
+
+def test_bad_metadata_value_replays_from_journal(make_store):
+    store = make_store(write_behind=True, flush_max_pending=100, flush_interval=3600)
+    embeddings = unit_vectors(2)
+    store.add_documents(chunks("a", ["alpha"], upload_time="not a date"), embeddings[:1])
+    store.add_documents(chunks("b", ["beta"]), embeddings[1:])
+    crash(store)
+
+    restarted = make_store(write_behind=True)
+    assert restarted.load_from_cloud()
+    assert len(restarted.documents) == 2
+    assert np.allclose(
+        restarted.search(embeddings[1], top_k=1)[0]["score"], 1.0, atol=1e-5
+    )
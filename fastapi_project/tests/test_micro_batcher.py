@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from app.apps.rag.utils.micro_batcher import MicroBatcher
+
+
+def test_a_failing_request_does_not_fail_its_batch():
+    running, release = threading.Event(), threading.Event()
+    calls = []
+
+    def process(items):
+        if items == ["block"]:
+            running.set()
+            release.wait(5)
+            return ["blocked"]
+        calls.append(list(items))
+        if "bad" in items:
+            raise ValueError("bad item")
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(process, max_batch_size=8, max_wait=0.5)
+    try:
+        # The only worker is busy, so the next requests queue into one batch
+        blocker = batcher.submit(["block"])
+        assert running.wait(5)
+        futures = [batcher.submit(items) for items in (["a"], ["bad"], ["b", "c"], ["d"])]
+        release.set()
+        assert blocker.result(5) == ["blocked"]
+
+        assert futures[0].result(5) == ["A"]
+        with pytest.raises(ValueError):
+            futures[1].result(5)
+        assert futures[2].result(5) == ["B", "C"]
+        assert futures[3].result(5) == ["D"]
+        assert calls[0] == ["a", "bad", "b", "c", "d"]
+        stats = batcher.stats()
+        assert (stats["completed"], stats["failed"]) == (4, 1)
+    finally:
+        batcher.close()
+
+
+def test_submit_after_close_raises():
+    batcher = MicroBatcher(lambda items: items)
+    assert batcher.submit([1, 2]).result(5) == [1, 2]
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit([3])
+    # Closing twice is harmless
+    batcher.close()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from app.apps.rag.utils.quantization import ProductQuantizer, Quantizer, ScalarQuantizer
+
+from conftest import chunks, unit_vectors
+
+
+def normalized(count, dim=16, seed=0):
+    vectors = unit_vectors(count, dim, seed)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_quantizer_is_abstract():
+    with pytest.raises(TypeError):
+        Quantizer()
+
+    class Incomplete(Quantizer):
+        def encode(self, embeddings):
+            return embeddings
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.parametrize("quantizer", [ScalarQuantizer(), ProductQuantizer()])
+def test_scores_approximate_dot_products(quantizer):
+    embeddings = normalized(512)
+    queries = normalized(4, seed=1)
+    quantizer.train(embeddings)
+    assert quantizer.is_trained and len(quantizer.codes) == len(embeddings)
+
+    scores = quantizer.score(queries)
+    exact = queries @ embeddings.T
+    assert np.abs(scores - exact).mean() < 0.15
+    rows = np.array([3, 100, 511])
+    np.testing.assert_allclose(quantizer.score(queries, rows), scores[:, rows], rtol=1e-5)
+
+
+@pytest.mark.parametrize("quantization", ["int8", "pq"])
+def test_quantized_store_finds_and_reloads_rows(make_store, quantization):
+    embeddings = normalized(64)
+    texts = [f"chunk {i}" for i in range(64)]
+    store = make_store(quantization=quantization, min_index_size=32)
+    store.add_documents(chunks("a", texts), embeddings)
+    assert store.snapshot.quantizer.is_trained
+    assert store.save_to_cloud()
+
+    reloaded = make_store(quantization=quantization, min_index_size=32)
+    assert reloaded.load_from_cloud()
+    for row in (0, 31, 63):
+        assert reloaded.search(embeddings[row], top_k=1)[0]["document"]["text"] == texts[row]
@@ -0,0 +1,197 @@
+import threading
+
+import numpy as np
+
+from conftest import chunks, crash, unit_vectors
+
+
+def texts_of(results):
+    return [result["document"]["text"] for result in results]
+
+
+def doc_ids(store):
+    """doc_ids of the live rows"""
+    snapshot = store.snapshot
+    return sorted(
+        {
+            doc_id
+            for doc_id, deleted in zip(snapshot.documents.values("doc_id"), snapshot.deleted)
+            if not deleted
+        }
+    )
+
+
+def test_add_search_delete_round_trip(make_store):
+    embeddings = unit_vectors(5)
+    store = make_store()
+    store.add_documents(chunks("a", ["one", "two", "three"], source="a.pdf"), embeddings[:3])
+    store.add_documents(chunks("b", ["four", "five"], source="b.pdf"), embeddings[3:])
+
+    for row, text in enumerate(["one", "two", "three", "four", "five"]):
+        results = store.search(embeddings[row], top_k=3)
+        assert texts_of(results)[0] == text
+        assert results[0]["score"] > 0.999
+    assert texts_of(store.search(embeddings[0], top_k=5, filters={"doc_id": "b"})) in (
+        ["four", "five"],
+        ["five", "four"],
+    )
+
+    assert store.delete_documents_by_id("a")
+    assert not store.delete_documents_by_id("a")
+    assert set(texts_of(store.search(embeddings[0], top_k=5))) == {"four", "five"}
+    assert store.search(embeddings[0], top_k=5, filters={"doc_id": "a"}) == []
+
+    reloaded = make_store()
+    assert reloaded.load_from_cloud()
+    assert doc_ids(reloaded) == ["b"]
+    assert texts_of(reloaded.search(embeddings[4], top_k=1)) == ["five"]
+
+
+def test_top_k_is_ordered_and_matches_batch_search(make_store):
+    embeddings = unit_vectors(50)
+    store = make_store()
+    store.add_documents(chunks("a", [f"chunk {i}" for i in range(50)]), embeddings)
+    queries = unit_vectors(3, seed=1)
+
+    expected = (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)) @ (
+        queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    ).T
+    batch = store.search_batch(queries, top_k=[5, 1, 80])
+    for i, (query, results) in enumerate(zip(queries, batch)):
+        scores = [result["score"] for result in results]
+        assert scores == sorted(scores, reverse=True)
+        assert len(results) == [5, 1, 50][i]
+        best = np.sort(expected[:, i])[::-1][: len(results)]
+        np.testing.assert_allclose(scores, best, rtol=1e-5)
+        # Queries are normalized, so their length does not matter
+        assert texts_of(store.search(3 * query, top_k=len(results))) == texts_of(results)
+
+
+def test_compaction_keeps_live_rows_only(make_store):
+    embeddings = unit_vectors(6)
+    store = make_store(max_tombstone_ratio=10.0)
+    for i, doc_id in enumerate("abc"):
+        store.add_documents(
+            chunks(doc_id, [f"{doc_id}0", f"{doc_id}1"]), embeddings[2 * i : 2 * i + 2]
+        )
+    store.delete_documents_by_id("b")
+    assert len(store.segments) == 3
+
+    assert store.compact()
+    assert len(store.segments) == 1
+    assert store.deleted_count == 0
+    assert doc_ids(store) == ["a", "c"]
+    reloaded = make_store()
+    assert reloaded.load_from_cloud()
+    assert doc_ids(reloaded) == ["a", "c"]
+    assert texts_of(reloaded.search(embeddings[5], top_k=1)) == ["c1"]
+
+
+def test_journal_replay_after_a_crash(make_store):
+    embeddings = unit_vectors(4)
+    lazy = {
+        "write_behind": True,
+        "flush_max_pending": 100,
+        "flush_interval": 3600,
+        "max_tombstone_ratio": 10.0,
+    }
+    store = make_store(**lazy)
+    store.add_documents(chunks("a", ["one", "two"]), embeddings[:2])
+    store.flush()
+    store.add_documents(chunks("b", ["three"]), embeddings[2:3])
+    store.add_documents(chunks("c", ["four"]), embeddings[3:])
+    store.delete_documents_by_id("a")
+    crash(store)
+
+    # Only the first add reached storage
+    stored = make_store()
+    assert stored.load_from_cloud()
+    assert doc_ids(stored) == ["a"]
+    restarted = make_store(**lazy)
+    assert restarted.load_from_cloud()
+    assert doc_ids(restarted) == ["b", "c"]
+    assert texts_of(restarted.search(embeddings[3], top_k=1)) == ["four"]
+
+    assert restarted.flush()
+    reloaded = make_store()
+    assert reloaded.load_from_cloud()
+    assert doc_ids(reloaded) == ["b", "c"]
+
+
+def test_concurrent_writers_merge_their_changes(make_store):
+    embeddings = unit_vectors(4)
+    first = make_store()
+    first.add_documents(chunks("a", ["one"]), embeddings[:1])
+    second = make_store()
+    assert second.load_from_cloud()
+
+    # Both write on top of the same manifest; the conditional writes merge them
+    first.add_documents(chunks("b", ["two"]), embeddings[1:2])
+    second.add_documents(chunks("c", ["three"]), embeddings[2:3])
+    second.delete_documents_by_id("a")
+    first.add_documents(chunks("d", ["four"]), embeddings[3:])
+
+    reloaded = make_store()
+    assert reloaded.load_from_cloud()
+    assert doc_ids(reloaded) == ["b", "c", "d"]
+    assert first.refresh_remote()
+    assert doc_ids(first) == ["b", "c", "d"]
+    assert texts_of(first.search(embeddings[2], top_k=1)) == ["three"]
+
+
+def test_concurrent_adds_to_one_store(make_store):
+    store = make_store()
+    embeddings = unit_vectors(40)
+
+    def add(worker):
+        for i in range(worker, 40, 4):
+            store.add_documents(chunks(f"doc-{i}", [f"text {i}"]), embeddings[i : i + 1])
+
+    threads = [threading.Thread(target=add, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.snapshot.size == 40
+    for i in (0, 17, 39):
+        assert texts_of(store.search(embeddings[i], top_k=1)) == [f"text {i}"]
+    reloaded = make_store()
+    assert reloaded.load_from_cloud()
+    assert len(doc_ids(reloaded)) == 40
+
+
+def test_load_retries_when_a_compaction_deletes_its_segments(make_store):
+    embeddings = unit_vectors(4)
+    writer = make_store()
+    for i, doc_id in enumerate("abcd"):
+        writer.add_documents(chunks(doc_id, [doc_id]), embeddings[i : i + 1])
+
+    reader = make_store()
+    read_segment = reader._read_segment
+    compacted = []
+
+    def read_after_compaction(segment, object_store):
+        if not compacted:
+            # The writer merges the segments right after the reader listed them
+            compacted.append(writer.compact())
+        return read_segment(segment, object_store)
+
+    reader._read_segment = read_after_compaction
+    assert reader.load_from_cloud()
+    assert compacted == [True]
+    assert len(reader.segments) == 1
+    assert doc_ids(reader) == ["a", "b", "c", "d"]
+
+
+def test_ivf_index_finds_the_nearest_rows(make_store):
+    embeddings = unit_vectors(400, dim=16)
+    texts = [f"chunk {i}" for i in range(400)]
+    store = make_store(index_type="ivf", min_index_size=100, nprobe=4)
+    store.add_documents(chunks("a", texts), embeddings)
+    assert store.index.is_trained
+
+    for row in (0, 123, 399):
+        assert texts_of(store.search(embeddings[row], top_k=1)) == [texts[row]]
+    exact = store.search(embeddings[7], top_k=10, exact=True)
+    assert np.isclose(exact[0]["score"], 1.0)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from app.apps.rag.utils.fingerprints import FingerprintIndex
+
+from conftest import chunks, crash, unit_vectors
+
+
+def assert_aligned(store):
+    snapshot = store.snapshot
+    assert (
+        len(snapshot.documents)
+        == snapshot.size
+        == len(snapshot.deleted)
+        == snapshot.metadata_index.size
+        == snapshot.lexical_index.size
+        == snapshot.fingerprint_index.size
+    )
+
+
+def test_failed_add_leaves_the_store_untouched(make_store, monkeypatch):
+    store = make_store()
+    embeddings = unit_vectors(3)
+    store.add_documents(chunks("a", ["alpha"]), embeddings[:1])
+    before = store.snapshot
+
+    def fail(texts):
+        raise RuntimeError("fingerprinting failed")
+
+    monkeypatch.setattr(FingerprintIndex, "fingerprint", staticmethod(fail))
+    with pytest.raises(RuntimeError):
+        store.add_documents(chunks("b", ["beta"]), embeddings[1:2])
+    monkeypatch.undo()
+
+    assert store.snapshot is before
+    assert_aligned(store)
+    store.add_documents(chunks("c", ["gamma"]), embeddings[2:])
+    assert_aligned(store)
+    assert store.search(embeddings[2], top_k=1)[0]["document"]["text"] == "gamma"
+    assert [
+        result["document"]["text"]
+        for result in store.search(embeddings[2], top_k=5, filters={"doc_id": "c"})
+    ] == ["gamma"]
+
+
+def test_embeddings_of_another_dimension_are_rejected(make_store):
+    store = make_store(write_behind=True, flush_interval=3600)
+    store.add_documents(chunks("a", ["alpha"]), unit_vectors(1, dim=8))
+    with pytest.raises(ValueError):
+        store.add_documents(chunks("b", ["beta"]), unit_vectors(1, dim=4))
+    with pytest.raises(ValueError):
+        store.add_documents(chunks("c", ["gamma", "delta"]), unit_vectors(1, dim=8))
+
+    assert_aligned(store)
+    # Nothing of the rejected adds was journaled
+    assert [header["op"] for header, _ in store.journal.replay()] == ["add"]
+
+
+def test_unreplayable_journal_record_is_skipped(make_store):
+    store = make_store(write_behind=True, flush_interval=3600)
+    embeddings = unit_vectors(2)
+    store.add_documents(chunks("a", ["alpha"]), embeddings[:1])
+    # A record no add would write, e.g. from a bug in an older version
+    store.journal.append(
+        {"op": "add", "documents": chunks("x", ["broken"])}, unit_vectors(2, dim=3)
+    )
+    store.add_documents(chunks("b", ["beta"]), embeddings[1:])
+    crash(store)
+
+    restarted = make_store(write_behind=True, flush_interval=3600)
+    assert restarted.load_from_cloud()
+    assert_aligned(restarted)
+    assert sorted(restarted.documents.values("doc_id")) == ["a", "b"]
+    assert restarted.search(embeddings[1], top_k=1)[0]["document"]["text"] == "beta"
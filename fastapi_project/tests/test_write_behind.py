@@ -0,0 +1,47 @@
+import os
+
+from conftest import chunks, crash, unit_vectors
+
+LAZY = {"write_behind": True, "flush_max_pending": 100, "flush_interval": 3600}
+
+
+def test_flush_writes_pending_changes_as_one_segment(make_store):
+    store = make_store(max_tombstone_ratio=1.0, **LAZY)
+    embeddings = unit_vectors(4)
+    store.add_documents(chunks("a", ["one", "two"]), embeddings[:2])
+    assert store.persistence_stats()["pending_changes"] == 1
+    assert store.flush()
+    store.add_documents(chunks("b", ["three"]), embeddings[2:3])
+    store.add_documents(chunks("c", ["four"]), embeddings[3:])
+    store.delete_documents_by_id("a")
+    assert store.flush()
+
+    # The earlier segment is kept as it is; merging is compact()'s job
+    assert len(store.segments) == 2
+    assert store.persistence_stats()["pending_changes"] == 0
+    restarted = make_store()
+    assert restarted.load_from_cloud()
+    assert sorted(restarted.documents.values("doc_id")) == ["b", "c"]
+
+
+def test_each_instance_journals_to_its_own_file(make_store):
+    first = make_store(**LAZY)
+    second = make_store(**LAZY)
+    embeddings = unit_vectors(2)
+    first.add_documents(chunks("a", ["from first"]), embeddings[:1])
+    second.add_documents(chunks("b", ["from second"]), embeddings[1:])
+    assert first.journal.path != second.journal.path
+
+    # The first instance's flush must not drop the second one's records
+    assert first.flush()
+    assert os.path.getsize(second.journal.path)
+    crash(second)
+
+    # A restart adopts the journal the second instance left behind
+    restarted = make_store(**LAZY)
+    assert restarted.load_from_cloud()
+    assert sorted(restarted.documents.values("doc_id")) == ["a", "b"]
+    assert restarted.flush()
+    reloaded = make_store()
+    assert reloaded.load_from_cloud()
+    assert sorted(reloaded.documents.values("doc_id")) == ["a", "b"]